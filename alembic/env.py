@@ -57,9 +57,12 @@ def run_migrations_online():
         poolclass=pool.NullPool)
 
     with connectable.connect() as connection:
+        # every revision commits on its own, so one that fails rolls back
+        # alone and leaves the revisions before it applied and recorded
         context.configure(
             connection=connection,
-            target_metadata=target_metadata
+            target_metadata=target_metadata,
+            transaction_per_migration=True
         )
 
         with context.begin_transaction():
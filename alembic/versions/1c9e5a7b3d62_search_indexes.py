@@ -0,0 +1,87 @@
+"""search indexes
+
+Adds the pg_trgm extension and trigram GIN indexes for substring search on
+the searchable names. Each searchable TEXT column gets a `<column>_tsv`
+tsvector kept up to date by a trigger, with a GIN index for full-text
+search, as view_models.search expects them. The tsvector columns are not
+mapped by the models. Indexes are built CONCURRENTLY, like the movement
+indexes.
+
+Revision ID: 1c9e5a7b3d62
+Revises: b7f3c1d8e4a2
+Create Date: 2026-10-18 19:02:37.611940
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1c9e5a7b3d62'
+down_revision = 'b7f3c1d8e4a2'
+branch_labels = None
+depends_on = None
+
+TRIGRAM_COLUMNS = [
+    ('location', 'name'),
+    ('product', 'name'),
+    ('product_raw_material', 'name'),
+    ('raw_material', 'name'),
+]
+
+# the text search configuration must stay the one view_models.search queries
+TEXT_COLUMNS = [
+    ('location', 'other_details'),
+    ('raw_material', 'description'),
+]
+
+
+def upgrade():
+    # the columns and triggers are created in the migration transaction;
+    # they are also written to be re-run should an index build below fail
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for table, column in TEXT_COLUMNS:
+        op.execute(f'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column}_tsv tsvector')
+        op.execute(
+            f"""
+            CREATE OR REPLACE FUNCTION {table}_{column}_tsv() RETURNS trigger AS $$
+            BEGIN
+                NEW.{column}_tsv := to_tsvector('simple', coalesce(NEW.{column}, ''));
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql
+            """
+        )
+        op.execute(f'DROP TRIGGER IF EXISTS {table}_{column}_tsv ON {table}')
+        op.execute(
+            f'CREATE TRIGGER {table}_{column}_tsv '
+            f'BEFORE INSERT OR UPDATE OF {column} ON {table} '
+            f'FOR EACH ROW EXECUTE PROCEDURE {table}_{column}_tsv()'
+        )
+        op.execute(
+            f"UPDATE {table} "
+            f"SET {column}_tsv = to_tsvector('simple', coalesce({column}, ''))"
+        )
+    # see d2a7c9e41b3f: CONCURRENTLY cannot run inside a transaction block
+    with op.get_context().autocommit_block():
+        for table, column in TRIGRAM_COLUMNS:
+            op.execute(
+                f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {table}_{column}_trgm_index '
+                f'ON {table} USING gin ({column} gin_trgm_ops)'
+            )
+        for table, column in TEXT_COLUMNS:
+            op.execute(
+                f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {table}_{column}_tsv_index '
+                f'ON {table} USING gin ({column}_tsv)'
+            )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for table, column in reversed(TRIGRAM_COLUMNS):
+            op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {table}_{column}_trgm_index')
+    for table, column in reversed(TEXT_COLUMNS):
+        op.execute(f'DROP TRIGGER IF EXISTS {table}_{column}_tsv ON {table}')
+        op.execute(f'DROP FUNCTION IF EXISTS {table}_{column}_tsv()')
+        op.execute(f'ALTER TABLE {table} DROP COLUMN IF EXISTS {column}_tsv')
+    # pg_trgm is left installed; other objects of the database may use it
@@ -0,0 +1,58 @@
+"""transfer orders
+
+Adds transfer_order and transfer_order_line: a document moving many
+products and raw materials from one location to another, posted in a
+single transaction by inventory.transfers.
+
+Revision ID: 2b7e4c9a6d31
+Revises: 6f2b9d4e8a17
+Create Date: 2026-10-19 00:26:41.730954
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2b7e4c9a6d31'
+down_revision = '6f2b9d4e8a17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'transfer_order',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('from_location_id', sa.Integer, sa.ForeignKey('location.id'), nullable=False),
+        sa.Column('to_location_id', sa.Integer, sa.ForeignKey('location.id'), nullable=False),
+        sa.Column('description', sa.TEXT),
+        sa.Column('posted_at', sa.TIMESTAMP),
+        sa.Column('time_created', sa.TIMESTAMP, server_default=sa.func.now()),
+        sa.Column('time_updated', sa.TIMESTAMP, server_default=sa.func.now()),
+        sa.CheckConstraint('from_location_id <> to_location_id'),
+    )
+    op.create_table(
+        'transfer_order_line',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column(
+            'transfer_order_id',
+            sa.Integer,
+            sa.ForeignKey('transfer_order.id', ondelete='CASCADE'),
+            nullable=False,
+        ),
+        sa.Column('product_id', sa.Integer, sa.ForeignKey('product.id')),
+        sa.Column('raw_material_id', sa.Integer, sa.ForeignKey('raw_material.id')),
+        sa.Column('qty', sa.Integer, sa.CheckConstraint('qty > 0'), nullable=False),
+        sa.CheckConstraint('(product_id IS NULL) <> (raw_material_id IS NULL)'),
+    )
+    op.create_index(
+        'transfer_order_line_transfer_order_id_index',
+        'transfer_order_line',
+        ['transfer_order_id'],
+    )
+
+
+def downgrade():
+    op.drop_table('transfer_order_line')
+    op.drop_table('transfer_order')
@@ -0,0 +1,41 @@
+"""row counts
+
+Adds the row_count table holding cached exact row counts of the movement
+tables, split over shards so that concurrent movement commits do not queue
+on one row, and seeds it with the current counts.
+
+Revision ID: 3e6f0b8c2a51
+Revises: f4b8e2d15a96
+Create Date: 2026-10-18 15:21:36.604127
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3e6f0b8c2a51'
+down_revision = 'f4b8e2d15a96'
+branch_labels = None
+depends_on = None
+
+COUNTED_TABLES = ['product_movement', 'raw_material_movement']
+
+
+def upgrade():
+    op.create_table(
+        'row_count',
+        sa.Column('table_name', sa.String(63), primary_key=True),
+        sa.Column('shard', sa.SmallInteger, primary_key=True, autoincrement=False),
+        sa.Column('row_count', sa.BigInteger, server_default='0', nullable=False),
+        sa.Column('time_updated', sa.TIMESTAMP, server_default=sa.func.now()),
+    )
+    for table in COUNTED_TABLES:
+        op.execute(f'''
+            INSERT INTO row_count (table_name, shard, row_count)
+            SELECT '{table}', 0, count(*) FROM {table}
+        ''')
+
+
+def downgrade():
+    op.drop_table('row_count')
@@ -0,0 +1,41 @@
+"""stock reconciliation
+
+Adds the stock_reconciliation table recording every completed run of
+`flask reconcile-stock`; the cutoff of the last run of a kind of stock is
+where the next incremental run starts.
+
+Revision ID: 4d8a1f6c2e93
+Revises: 1c9e5a7b3d62
+Create Date: 2026-10-18 20:14:52.408113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4d8a1f6c2e93'
+down_revision = '1c9e5a7b3d62'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'stock_reconciliation',
+        sa.Column('id', sa.Integer, primary_key=True),
+        sa.Column('kind', sa.String(16), nullable=False),
+        sa.Column('cutoff', sa.TIMESTAMP, nullable=False),
+        sa.Column('full_run', sa.Boolean, nullable=False),
+        sa.Column('pairs_checked', sa.Integer, nullable=False),
+        sa.Column('differences', sa.Integer, nullable=False),
+        sa.Column('repaired', sa.Integer, nullable=False),
+        sa.Column('time_created', sa.TIMESTAMP, server_default=sa.func.now(), nullable=False),
+    )
+    op.create_index(
+        'stock_reconciliation_kind_cutoff_index', 'stock_reconciliation', ['kind', 'cutoff']
+    )
+
+
+def downgrade():
+    op.drop_table('stock_reconciliation')
@@ -0,0 +1,58 @@
+"""unique stock rows
+
+Merges duplicate (location, item) rows of product_stock and
+raw_material_stock into the oldest one and adds the unique constraints the
+stock upserts rely on.
+
+Revision ID: 5b1e2f9c7d40
+Revises: a03babc74226
+Create Date: 2026-10-18 10:02:31.418206
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b1e2f9c7d40'
+down_revision = 'a03babc74226'
+branch_labels = None
+depends_on = None
+
+STOCK_TABLES = [
+    ('product_stock', 'product_id', 'product_stock_location_id_product_id_uindex'),
+    ('raw_material_stock', 'raw_material_id', 'raw_material_stock_location_id_raw_material_id_uindex'),
+]
+
+
+def upgrade():
+    for table, item_column, constraint in STOCK_TABLES:
+        # keep concurrent writers from adding new duplicates until the
+        # constraint exists
+        op.execute(f'LOCK TABLE {table} IN SHARE ROW EXCLUSIVE MODE')
+        # every duplicate received its own share of the movements, so the
+        # true balance is their sum
+        op.execute(f'''
+            UPDATE {table} s
+            SET available_stock = merged.total
+            FROM (
+                SELECT MIN(id) AS keep_id, SUM(available_stock) AS total
+                FROM {table}
+                GROUP BY location_id, {item_column}
+                HAVING COUNT(*) > 1
+            ) merged
+            WHERE s.id = merged.keep_id
+        ''')
+        op.execute(f'''
+            DELETE FROM {table} s
+            USING {table} keep
+            WHERE s.location_id = keep.location_id
+              AND s.{item_column} = keep.{item_column}
+              AND s.id > keep.id
+        ''')
+        op.create_unique_constraint(constraint, table, ['location_id', item_column])
+
+
+def downgrade():
+    for table, item_column, constraint in STOCK_TABLES:
+        op.drop_constraint(constraint, table, type_='unique')
@@ -0,0 +1,207 @@
+"""dashboard views
+
+Adds the materialized views the admin index page reads: stock totals per
+location, the top movers of the last 7 and 30 days, the stock rows at zero
+and the manufacturing output of the last 30 days, plus dashboard_refreshed
+recording when they were last refreshed. Each has a unique index so that
+`flask refresh-dashboard` can refresh it CONCURRENTLY, without blocking the
+page. Top movers are read from the daily movement rollups (9e2c4b7a1d05),
+so refreshing does not grow with the movement history either.
+
+Revision ID: 6f2b9d4e8a17
+Revises: 9e2c4b7a1d05
+Create Date: 2026-10-18 23:41:09.318220
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6f2b9d4e8a17'
+down_revision = '9e2c4b7a1d05'
+branch_labels = None
+depends_on = None
+
+# kind -> (stock table, item column)
+STOCK_TABLES = {
+    'product': ('product_stock', 'product_id'),
+    'raw_material': ('raw_material_stock', 'raw_material_id'),
+}
+
+# windows of the top movers, in days, and the items kept per window
+MOVER_WINDOWS = [7, 30]
+TOP_MOVERS = 10
+
+MANUFACTURING_DAYS = 30
+
+
+def _stock_totals(kind):
+    table, item_column = STOCK_TABLES[kind]
+    return f'''
+        SELECT s.location_id, s.{item_column} AS item_id,
+               s.available_stock + COALESCE(SUM(sh.available_stock), 0) AS stock,
+               s.time_updated
+        FROM {table} s
+        LEFT JOIN {table}_shard sh
+          ON sh.location_id = s.location_id AND sh.{item_column} = s.{item_column}
+        GROUP BY s.location_id, s.{item_column}, s.available_stock, s.time_updated
+    '''
+
+
+def _totals(kind):
+    return f'''
+        SELECT location_id,
+               count(*) FILTER (WHERE stock > 0) AS items,
+               count(*) FILTER (WHERE stock = 0) AS zero_items,
+               SUM(stock) AS units
+        FROM ({_stock_totals(kind)}) t
+        GROUP BY location_id
+    '''
+
+
+def _movers(kind):
+    table, item_column = STOCK_TABLES[kind]
+    windows = ', '.join(f'({days})' for days in MOVER_WINDOWS)
+    return f'''
+        SELECT '{kind}' AS kind, w.days, r.{item_column} AS item_id,
+               SUM(r.inflow) AS inflow, SUM(r.outflow) AS outflow,
+               row_number() OVER (
+                   PARTITION BY w.days
+                   ORDER BY SUM(r.inflow) + SUM(r.outflow) DESC, r.{item_column}
+               ) AS rank
+        FROM {kind}_movement_daily r
+        JOIN (VALUES {windows}) w (days)
+          ON r.day > current_date - w.days AND r.day <= current_date
+        GROUP BY w.days, r.{item_column}
+        HAVING SUM(r.inflow) + SUM(r.outflow) > 0
+    '''
+
+
+def _zero_stock(kind):
+    return f'''
+        SELECT '{kind}' AS kind, t.location_id, location.name AS location_name,
+               t.item_id, item.name AS item_name, t.time_updated
+        FROM ({_stock_totals(kind)}) t
+        JOIN location ON location.id = t.location_id
+        JOIN {kind} item ON item.id = t.item_id
+        WHERE t.stock = 0
+    '''
+
+
+def upgrade():
+    op.create_index(
+        'product_manufacturing_time_created_index',
+        'product_manufacturing',
+        ['time_created'],
+    )
+    op.execute(
+        f'''
+        CREATE MATERIALIZED VIEW dashboard_location_totals AS
+        SELECT location.id AS location_id, location.name AS location_name,
+               COALESCE(p.items, 0) AS product_items,
+               COALESCE(p.zero_items, 0) AS product_zero_items,
+               COALESCE(p.units, 0) AS product_units,
+               COALESCE(r.items, 0) AS raw_material_items,
+               COALESCE(r.zero_items, 0) AS raw_material_zero_items,
+               COALESCE(r.units, 0) AS raw_material_units
+        FROM location
+        LEFT JOIN ({_totals('product')}) p ON p.location_id = location.id
+        LEFT JOIN ({_totals('raw_material')}) r ON r.location_id = location.id
+        '''
+    )
+    op.execute(
+        'CREATE UNIQUE INDEX dashboard_location_totals_location_id_index '
+        'ON dashboard_location_totals (location_id)'
+    )
+    op.execute(
+        'CREATE INDEX dashboard_location_totals_location_name_index '
+        'ON dashboard_location_totals (location_name, location_id)'
+    )
+
+    op.execute(
+        f'''
+        CREATE MATERIALIZED VIEW dashboard_top_movers AS
+        SELECT m.kind, m.days, m.rank, m.item_id, item.name AS item_name,
+               m.inflow, m.outflow
+        FROM ({_movers('product')}) m
+        JOIN product item ON item.id = m.item_id
+        WHERE m.rank <= {TOP_MOVERS}
+        UNION ALL
+        SELECT m.kind, m.days, m.rank, m.item_id, item.name, m.inflow, m.outflow
+        FROM ({_movers('raw_material')}) m
+        JOIN raw_material item ON item.id = m.item_id
+        WHERE m.rank <= {TOP_MOVERS}
+        '''
+    )
+    op.execute(
+        'CREATE UNIQUE INDEX dashboard_top_movers_kind_days_rank_index '
+        'ON dashboard_top_movers (kind, days, rank)'
+    )
+
+    op.execute(
+        f'''
+        CREATE MATERIALIZED VIEW dashboard_zero_stock AS
+        {_zero_stock('product')}
+        UNION ALL
+        {_zero_stock('raw_material')}
+        '''
+    )
+    op.execute(
+        'CREATE UNIQUE INDEX dashboard_zero_stock_kind_location_id_item_id_index '
+        'ON dashboard_zero_stock (kind, location_id, item_id)'
+    )
+    op.execute(
+        'CREATE INDEX dashboard_zero_stock_kind_time_updated_index '
+        'ON dashboard_zero_stock (kind, time_updated DESC)'
+    )
+
+    # output from the ledger, which records what each run actually added
+    op.execute(
+        f'''
+        CREATE MATERIALIZED VIEW dashboard_manufacturing_daily AS
+        SELECT runs.day, runs.runs, runs.products, runs.batches,
+               COALESCE(output.units, 0) AS units
+        FROM (
+            SELECT CAST(time_created AS date) AS day, count(*) AS runs,
+                   count(DISTINCT product_id) AS products,
+                   SUM(batch_size) AS batches
+            FROM product_manufacturing
+            WHERE time_created >= current_date - {MANUFACTURING_DAYS - 1}
+            GROUP BY 1
+        ) runs
+        LEFT JOIN (
+            SELECT CAST(time_created AS date) AS day, SUM(delta) AS units
+            FROM product_stock_ledger
+            WHERE source = 'product_manufacturing'
+              AND time_created >= current_date - {MANUFACTURING_DAYS - 1}
+            GROUP BY 1
+        ) output ON output.day = runs.day
+        '''
+    )
+    op.execute(
+        'CREATE UNIQUE INDEX dashboard_manufacturing_daily_day_index '
+        'ON dashboard_manufacturing_daily (day)'
+    )
+
+    op.execute(
+        'CREATE MATERIALIZED VIEW dashboard_refreshed AS '
+        'SELECT 1 AS id, now() AS refreshed_at'
+    )
+    op.execute(
+        'CREATE UNIQUE INDEX dashboard_refreshed_id_index ON dashboard_refreshed (id)'
+    )
+
+
+def downgrade():
+    for view in (
+        'dashboard_refreshed',
+        'dashboard_manufacturing_daily',
+        'dashboard_zero_stock',
+        'dashboard_top_movers',
+        'dashboard_location_totals',
+    ):
+        op.execute(f'DROP MATERIALIZED VIEW {view}')
+    op.drop_index(
+        'product_manufacturing_time_created_index', table_name='product_manufacturing'
+    )
@@ -0,0 +1,30 @@
+"""product bom version
+
+Adds product.bom_version, set from product_bom_version_seq whenever the
+bill of materials of the product changes, which the per-process BOM caches
+compare against.
+
+Revision ID: 7a2d5c9e0f18
+Revises: 3e6f0b8c2a51
+Create Date: 2026-10-18 17:08:55.731940
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7a2d5c9e0f18'
+down_revision = '3e6f0b8c2a51'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('CREATE SEQUENCE product_bom_version_seq')
+    op.add_column('product', sa.Column('bom_version', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    op.drop_column('product', 'bom_version')
+    op.execute('DROP SEQUENCE product_bom_version_seq')
@@ -0,0 +1,81 @@
+"""stock ledger and snapshots
+
+Adds the append-only stock ledgers and their snapshot tables, and opens
+the ledgers with the current balance of every stock row.
+
+Revision ID: 8c3d4a6e1f27
+Revises: 5b1e2f9c7d40
+Create Date: 2026-10-18 11:40:12.093114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c3d4a6e1f27'
+down_revision = '5b1e2f9c7d40'
+branch_labels = None
+depends_on = None
+
+KINDS = [
+    ('product', 'product_id', 'product'),
+    ('raw_material', 'raw_material_id', 'raw_material'),
+]
+
+
+def upgrade():
+    for kind, item_column, item_table in KINDS:
+        op.create_table(
+            f'{kind}_stock_ledger',
+            sa.Column('id', sa.BigInteger, primary_key=True),
+            sa.Column('location_id', sa.Integer, sa.ForeignKey('location.id'), nullable=False),
+            sa.Column(item_column, sa.Integer, sa.ForeignKey(f'{item_table}.id'), nullable=False),
+            sa.Column('delta', sa.Integer, nullable=False),
+            sa.Column('balance', sa.Integer, nullable=False),
+            sa.Column('source', sa.String(50)),
+            sa.Column('source_id', sa.Integer),
+            sa.Column('time_created', sa.TIMESTAMP, server_default=sa.func.now(), nullable=False),
+        )
+        op.create_index(
+            f'{kind}_stock_ledger_location_item_time_index',
+            f'{kind}_stock_ledger',
+            ['location_id', item_column, 'time_created'],
+        )
+        op.create_index(
+            f'{kind}_stock_ledger_time_created_index',
+            f'{kind}_stock_ledger',
+            ['time_created'],
+        )
+        op.create_table(
+            f'{kind}_stock_snapshot',
+            sa.Column('id', sa.BigInteger, primary_key=True),
+            sa.Column('location_id', sa.Integer, sa.ForeignKey('location.id'), nullable=False),
+            sa.Column(item_column, sa.Integer, sa.ForeignKey(f'{item_table}.id'), nullable=False),
+            sa.Column('balance', sa.Integer, nullable=False),
+            sa.Column('snapshot_time', sa.TIMESTAMP, nullable=False),
+        )
+        op.create_index(
+            f'{kind}_stock_snapshot_location_item_time_index',
+            f'{kind}_stock_snapshot',
+            ['location_id', item_column, 'snapshot_time'],
+        )
+        op.create_index(
+            f'{kind}_stock_snapshot_snapshot_time_index',
+            f'{kind}_stock_snapshot',
+            ['snapshot_time'],
+        )
+        op.execute(f'''
+            INSERT INTO {kind}_stock_ledger
+                (location_id, {item_column}, delta, balance, source)
+            SELECT location_id, {item_column}, available_stock, available_stock,
+                   'opening_balance'
+            FROM {kind}_stock
+            WHERE location_id IS NOT NULL AND {item_column} IS NOT NULL
+        ''')
+
+
+def downgrade():
+    for kind, item_column, item_table in KINDS:
+        op.drop_table(f'{kind}_stock_snapshot')
+        op.drop_table(f'{kind}_stock_ledger')
@@ -0,0 +1,28 @@
+"""movement queue creates source
+
+Adds movement_queue.creates_source, set on the queue row a movement's
+creation writes, so that the worker only deletes a movement whose
+creation it rejects and restores the quantity of rejected edits.
+
+Revision ID: 8f3a6c1d2b94
+Revises: 2b7e4c9a6d31
+Create Date: 2026-10-18 20:12:37.402816
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8f3a6c1d2b94'
+down_revision = '2b7e4c9a6d31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('movement_queue', sa.Column('creates_source', sa.Boolean(), server_default=sa.false(), nullable=False))
+
+
+def downgrade():
+    op.drop_column('movement_queue', 'creates_source')
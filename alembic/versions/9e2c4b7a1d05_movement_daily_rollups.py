@@ -0,0 +1,120 @@
+"""movement daily rollups
+
+Adds product_movement_daily and raw_material_movement_daily holding the
+inflow and outflow of every item per location and day, kept up to date by
+statement triggers on the movement tables and filled from the existing
+movements. Each statement adds to a random one of ROLLUP_SHARDS rows per
+(day, location, item), so movements of a hot item do not queue on one row;
+`flask compact-movement-rollups` folds them together again. The triggers
+must match inventory.rollups.
+
+Writes to the movement tables wait until this migration has committed.
+
+Revision ID: 9e2c4b7a1d05
+Revises: 4d8a1f6c2e93
+Create Date: 2026-10-18 21:03:17.552804
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e2c4b7a1d05'
+down_revision = '4d8a1f6c2e93'
+branch_labels = None
+depends_on = None
+
+MOVEMENT_TABLES = [
+    ('product_movement', 'product_id'),
+    ('raw_material_movement', 'raw_material_id'),
+]
+
+ROLLUP_SHARDS = 8
+
+
+def _lines(rows, item_column, sign):
+    day = 'COALESCE(movement_date, CAST(time_created AS date), current_date)'
+    return f'''
+        SELECT {day} AS day, to_location_id AS location_id, {item_column} AS item_id,
+               {sign} * qty AS inflow, 0 AS outflow
+        FROM {rows} WHERE to_location_id IS NOT NULL
+        UNION ALL
+        SELECT {day}, from_location_id, {item_column}, 0, {sign} * qty
+        FROM {rows} WHERE from_location_id IS NOT NULL
+    '''
+
+
+def _add(table, item_column, lines, shard):
+    return f'''
+        INSERT INTO {table}_daily (day, location_id, {item_column}, shard, inflow, outflow)
+        SELECT day, location_id, item_id, {shard}, SUM(inflow), SUM(outflow)
+        FROM ({lines}) l
+        GROUP BY day, location_id, item_id
+        HAVING SUM(inflow) <> 0 OR SUM(outflow) <> 0
+        ORDER BY day, location_id, item_id
+        ON CONFLICT (day, location_id, {item_column}, shard) DO UPDATE
+        SET inflow = {table}_daily.inflow + EXCLUDED.inflow,
+            outflow = {table}_daily.outflow + EXCLUDED.outflow
+    '''
+
+
+def upgrade():
+    for table, item_column in MOVEMENT_TABLES:
+        op.create_table(
+            f'{table}_daily',
+            sa.Column('day', sa.Date, nullable=False),
+            sa.Column('location_id', sa.Integer, nullable=False),
+            sa.Column(item_column, sa.Integer, nullable=False),
+            sa.Column('shard', sa.SmallInteger, nullable=False),
+            sa.Column('inflow', sa.BigInteger, nullable=False),
+            sa.Column('outflow', sa.BigInteger, nullable=False),
+            sa.PrimaryKeyConstraint('day', 'location_id', item_column, 'shard'),
+        )
+        op.create_index(
+            f'{table}_daily_location_id_day_index', f'{table}_daily', ['location_id', 'day']
+        )
+        op.create_index(
+            f'{table}_daily_unfolded_index', f'{table}_daily', ['day'],
+            postgresql_where=sa.text('shard <> 0'),
+        )
+        shard = f'floor(random() * {ROLLUP_SHARDS})'
+        new_lines = _lines('new_rows', item_column, 1)
+        old_lines = _lines('old_rows', item_column, -1)
+        op.execute(
+            f'''
+            CREATE FUNCTION {table}_daily() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'INSERT' THEN
+                    {_add(table, item_column, new_lines, shard)};
+                ELSIF TG_OP = 'UPDATE' THEN
+                    {_add(table, item_column, new_lines + ' UNION ALL ' + old_lines, shard)};
+                ELSE
+                    {_add(table, item_column, old_lines, shard)};
+                END IF;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+            '''
+        )
+        # transition tables allow one event per trigger and no column list
+        for event, referencing in (
+            ('INSERT', 'NEW TABLE AS new_rows'),
+            ('UPDATE', 'OLD TABLE AS old_rows NEW TABLE AS new_rows'),
+            ('DELETE', 'OLD TABLE AS old_rows'),
+        ):
+            op.execute(
+                f'CREATE TRIGGER {table}_daily_{event.lower()} AFTER {event} ON {table} '
+                f'REFERENCING {referencing} '
+                f'FOR EACH STATEMENT EXECUTE PROCEDURE {table}_daily()'
+            )
+        op.execute(f'LOCK TABLE {table} IN SHARE MODE')
+        op.execute(_add(table, item_column, _lines(table, item_column, 1), 0))
+
+
+def downgrade():
+    for table, item_column in MOVEMENT_TABLES:
+        for event in ('insert', 'update', 'delete'):
+            op.execute(f'DROP TRIGGER {table}_daily_{event} ON {table}')
+        op.execute(f'DROP FUNCTION {table}_daily()')
+        op.drop_table(f'{table}_daily')
@@ -0,0 +1,38 @@
+"""name prefix indexes
+
+Indexes lower(name) of the reference tables in the C collation, so that the
+type-ahead lookups of the admin forms can find and order rows by a name
+prefix without a sort. Built CONCURRENTLY, like the movement indexes.
+
+Revision ID: b7f3c1d8e4a2
+Revises: e9b4d6a2c815
+Create Date: 2026-10-18 18:36:12.804417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7f3c1d8e4a2'
+down_revision = 'e9b4d6a2c815'
+branch_labels = None
+depends_on = None
+
+TABLES = ['location', 'product', 'raw_material']
+
+
+def upgrade():
+    # see d2a7c9e41b3f: CONCURRENTLY cannot run inside a transaction block
+    with op.get_context().autocommit_block():
+        for table in TABLES:
+            op.execute(
+                f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {table}_name_prefix_index '
+                f'ON {table} ((lower(name) COLLATE "C"), id)'
+            )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for table in reversed(TABLES):
+            op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {table}_name_prefix_index')
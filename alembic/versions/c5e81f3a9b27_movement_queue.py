@@ -0,0 +1,49 @@
+"""movement queue
+
+Adds the movement_queue table that movements are written to in
+write-behind mode, until a worker applies their stock changes.
+
+Revision ID: c5e81f3a9b27
+Revises: 7a2d5c9e0f18
+Create Date: 2026-10-18 17:21:04.118532
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5e81f3a9b27'
+down_revision = '7a2d5c9e0f18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'movement_queue',
+        sa.Column('id', sa.BigInteger, primary_key=True),
+        sa.Column('kind', sa.String(16), nullable=False),
+        sa.Column('item_id', sa.Integer, nullable=False),
+        sa.Column('from_location_id', sa.Integer, sa.ForeignKey('location.id')),
+        sa.Column('to_location_id', sa.Integer, sa.ForeignKey('location.id')),
+        sa.Column('qty', sa.Integer, nullable=False),
+        sa.Column('source', sa.String(50)),
+        sa.Column('source_id', sa.Integer),
+        sa.Column('status', sa.String(16), server_default='pending', nullable=False),
+        sa.Column('error', sa.TEXT),
+        sa.Column('time_created', sa.TIMESTAMP, server_default=sa.func.now(), nullable=False),
+        sa.Column('time_updated', sa.TIMESTAMP, server_default=sa.func.now()),
+    )
+    op.create_index(
+        'movement_queue_pending_index', 'movement_queue', ['id'],
+        postgresql_where=sa.text("status = 'pending'"),
+    )
+    op.create_index(
+        'movement_queue_pending_item_index', 'movement_queue', ['kind', 'item_id'],
+        postgresql_where=sa.text("status = 'pending'"),
+    )
+
+
+def downgrade():
+    op.drop_table('movement_queue')
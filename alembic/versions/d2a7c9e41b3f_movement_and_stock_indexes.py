@@ -0,0 +1,56 @@
+"""movement and stock indexes
+
+Indexes the stock lookup and movement listing paths. The indexes are built
+with CREATE INDEX CONCURRENTLY so that writers are not blocked while they
+build on large tables.
+
+Revision ID: d2a7c9e41b3f
+Revises: 8c3d4a6e1f27
+Create Date: 2026-10-18 13:05:47.520318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2a7c9e41b3f'
+down_revision = '8c3d4a6e1f27'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('product_movement_product_id_movement_date_index', 'product_movement', ['product_id', 'movement_date']),
+    ('product_movement_from_location_id_product_id_index', 'product_movement', ['from_location_id', 'product_id']),
+    ('product_movement_to_location_id_product_id_index', 'product_movement', ['to_location_id', 'product_id']),
+    ('product_movement_movement_date_id_index', 'product_movement', ['movement_date', 'id']),
+    ('product_movement_time_created_index', 'product_movement', ['time_created']),
+    ('raw_material_movement_raw_material_id_movement_date_index', 'raw_material_movement', ['raw_material_id', 'movement_date']),
+    ('raw_material_movement_from_location_id_raw_material_id_index', 'raw_material_movement', ['from_location_id', 'raw_material_id']),
+    ('raw_material_movement_to_location_id_raw_material_id_index', 'raw_material_movement', ['to_location_id', 'raw_material_id']),
+    ('raw_material_movement_movement_date_id_index', 'raw_material_movement', ['movement_date', 'id']),
+    ('raw_material_movement_time_created_index', 'raw_material_movement', ['time_created']),
+    ('product_stock_product_id_location_id_index', 'product_stock', ['product_id', 'location_id']),
+    ('product_stock_time_created_index', 'product_stock', ['time_created']),
+    ('raw_material_stock_raw_material_id_location_id_index', 'raw_material_stock', ['raw_material_id', 'location_id']),
+    ('raw_material_stock_time_created_index', 'raw_material_stock', ['time_created']),
+]
+
+
+def upgrade():
+    # CONCURRENTLY cannot run inside a transaction block: the migration
+    # transaction is committed before the block and a new one begun after
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            # IF NOT EXISTS lets a build interrupted part way be re-run; an
+            # index left INVALID by a failed build has to be dropped by hand
+            # first.
+            op.execute(
+                f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} ({", ".join(columns)})'
+            )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, columns in reversed(INDEXES):
+            op.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {name}')
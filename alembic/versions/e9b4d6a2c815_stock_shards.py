@@ -0,0 +1,54 @@
+"""stock shards
+
+Adds stock.shards and the product_stock_shard and raw_material_stock_shard
+tables holding the sub-rows of sharded stock rows.
+
+Revision ID: e9b4d6a2c815
+Revises: c5e81f3a9b27
+Create Date: 2026-10-18 17:52:40.306719
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e9b4d6a2c815'
+down_revision = 'c5e81f3a9b27'
+branch_labels = None
+depends_on = None
+
+STOCK_TABLES = [
+    ('product_stock', 'product_id', 'product'),
+    ('raw_material_stock', 'raw_material_id', 'raw_material'),
+]
+
+
+def upgrade():
+    for table, item_column, item_table in STOCK_TABLES:
+        op.add_column(table, sa.Column('shards', sa.SmallInteger(), server_default='0', nullable=False))
+        op.create_table(
+            f'{table}_shard',
+            sa.Column('location_id', sa.Integer, sa.ForeignKey('location.id'), primary_key=True, autoincrement=False),
+            sa.Column(item_column, sa.Integer, sa.ForeignKey(f'{item_table}.id'), primary_key=True, autoincrement=False),
+            sa.Column('shard', sa.SmallInteger, primary_key=True, autoincrement=False),
+            sa.Column('available_stock', sa.Integer, sa.CheckConstraint('available_stock>=0'), nullable=False),
+            sa.Column('time_updated', sa.TIMESTAMP, server_default=sa.func.now()),
+        )
+
+
+def downgrade():
+    for table, item_column, _ in STOCK_TABLES:
+        # fold the shards back into their stock rows before dropping them
+        op.execute(f'''
+            UPDATE {table} s
+            SET available_stock = s.available_stock + sums.total
+            FROM (
+                SELECT location_id, {item_column}, SUM(available_stock) AS total
+                FROM {table}_shard
+                GROUP BY location_id, {item_column}
+            ) sums
+            WHERE s.location_id = sums.location_id AND s.{item_column} = sums.{item_column}
+        ''')
+        op.drop_table(f'{table}_shard')
+        op.drop_column(table, 'shards')
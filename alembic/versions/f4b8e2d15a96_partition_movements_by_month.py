@@ -0,0 +1,131 @@
+"""partition movements by month
+
+Optionally turns product_movement and raw_material_movement into tables
+range partitioned by month on movement_date. Partitioning rewrites both
+tables under an exclusive lock, so it only runs when asked for:
+
+    alembic -x partition_movements=true upgrade head
+
+Without it this revision changes nothing. Monthly partitions are created
+from the oldest movement up to `partition_months_ahead` (default 3) months
+past the current one, plus a DEFAULT partition; run
+`flask create-movement-partitions` periodically to add the next months.
+
+Revision ID: f4b8e2d15a96
+Revises: d2a7c9e41b3f
+Create Date: 2026-10-18 13:42:09.186734
+
+"""
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f4b8e2d15a96'
+down_revision = 'd2a7c9e41b3f'
+branch_labels = None
+depends_on = None
+
+MOVEMENT_TABLES = [
+    ('product_movement', 'product_id', 'product'),
+    ('raw_material_movement', 'raw_material_id', 'raw_material'),
+]
+
+
+def _indexes(table, item_column):
+    return [
+        (f'{table}_{item_column}_movement_date_index', [item_column, 'movement_date']),
+        (f'{table}_from_location_id_{item_column}_index', ['from_location_id', item_column]),
+        (f'{table}_to_location_id_{item_column}_index', ['to_location_id', item_column]),
+        (f'{table}_movement_date_id_index', ['movement_date', 'id']),
+        (f'{table}_time_created_index', ['time_created']),
+    ]
+
+
+def _add_keys(table, item_column, item_table, primary_key):
+    op.execute(f'ALTER TABLE {table} ADD CONSTRAINT {table}_pkey PRIMARY KEY ({primary_key})')
+    op.create_foreign_key(f'{table}_from_location_id_fkey', table, 'location', ['from_location_id'], ['id'])
+    op.create_foreign_key(f'{table}_to_location_id_fkey', table, 'location', ['to_location_id'], ['id'])
+    op.create_foreign_key(f'{table}_{item_column}_fkey', table, item_table, [item_column], ['id'])
+    for name, columns in _indexes(table, item_column):
+        op.create_index(name, table, columns)
+
+
+def _is_partitioned(table):
+    return op.get_bind().execute(
+        sa.text('SELECT relkind FROM pg_class WHERE oid = to_regclass(:t)'), t=table
+    ).scalar() == 'p'
+
+
+def upgrade():
+    args = context.get_x_argument(as_dictionary=True)
+    if args.get('partition_movements', '').lower() not in ('1', 'true', 'yes'):
+        return
+    months_ahead = int(args.get('partition_months_ahead', 3))
+    bind = op.get_bind()
+    for table, item_column, item_table in MOVEMENT_TABLES:
+        if _is_partitioned(table):
+            continue
+        op.execute(f'LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE')
+        # the partition key has to be part of the primary key, so it cannot
+        # be NULL any more
+        op.execute(f'''
+            UPDATE {table}
+            SET movement_date = COALESCE(CAST(time_created AS date), current_date)
+            WHERE movement_date IS NULL
+        ''')
+        op.execute(f'ALTER TABLE {table} RENAME TO {table}_unpartitioned')
+        op.execute(f'''
+            CREATE TABLE {table} (
+                LIKE {table}_unpartitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS
+            ) PARTITION BY RANGE (movement_date)
+        ''')
+        op.execute(f'''
+            ALTER TABLE {table}
+                ALTER COLUMN movement_date SET NOT NULL,
+                ALTER COLUMN movement_date SET DEFAULT current_date
+        ''')
+        months = bind.execute(sa.text(f'''
+            SELECT CAST(m AS date), CAST(m + interval '1 month' AS date)
+            FROM generate_series(
+                (SELECT date_trunc('month', COALESCE(MIN(movement_date), current_date))
+                 FROM {table}_unpartitioned),
+                date_trunc('month', current_date) + make_interval(months => :ahead),
+                interval '1 month'
+            ) m
+        '''), ahead=months_ahead).fetchall()
+        for start, end in months:
+            op.execute(
+                f"CREATE TABLE {table}_y{start.year}m{start.month:02d} PARTITION OF {table} "
+                f"FOR VALUES FROM ('{start}') TO ('{end}')"
+            )
+        op.execute(f'CREATE TABLE {table}_default PARTITION OF {table} DEFAULT')
+        op.execute(f'INSERT INTO {table} SELECT * FROM {table}_unpartitioned')
+        # keep the id sequence when the old table goes
+        op.execute(f'ALTER SEQUENCE {table}_id_seq OWNED BY NONE')
+        op.execute(f'DROP TABLE {table}_unpartitioned')
+        op.execute(f'ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id')
+        _add_keys(table, item_column, item_table, 'id, movement_date')
+
+
+def downgrade():
+    for table, item_column, item_table in MOVEMENT_TABLES:
+        if not _is_partitioned(table):
+            continue
+        op.execute(f'LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE')
+        op.execute(f'ALTER TABLE {table} RENAME TO {table}_partitioned')
+        op.execute(f'''
+            CREATE TABLE {table} (
+                LIKE {table}_partitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS
+            )
+        ''')
+        op.execute(f'''
+            ALTER TABLE {table}
+                ALTER COLUMN movement_date DROP NOT NULL,
+                ALTER COLUMN movement_date SET DEFAULT now()
+        ''')
+        op.execute(f'INSERT INTO {table} SELECT * FROM {table}_partitioned')
+        op.execute(f'ALTER SEQUENCE {table}_id_seq OWNED BY NONE')
+        op.execute(f'DROP TABLE {table}_partitioned')
+        op.execute(f'ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id')
+        _add_keys(table, item_column, item_table, 'id')
@@ -0,0 +1,310 @@
+import datetime
+import os
+
+from app_init import db, request_metrics
+from flask import Blueprint, Response, abort, jsonify, request
+from instrumentation import pool_stats
+from instrumentation.metrics import Value, merged, render
+from inventory.feasibility import feasibility_cache
+from inventory.ingest import ingest_batch, parse_rows
+from inventory.ledger import balances_as_of
+from inventory.stock import stock_balances
+from inventory.stock_cache import stock_cache
+from inventory.transactions import run_transaction
+from inventory.transfers import create_transfer_order
+from inventory.write_behind import queue_stats
+from wtforms import validators
+
+api = Blueprint("api", __name__, url_prefix="/api")
+
+# url segment -> stock / movement kind
+URL_KINDS = {"product": "product", "raw-material": "raw_material"}
+
+# rows validated, applied and committed together
+DEFAULT_BATCH_SIZE = 5000
+
+# (location, item) pairs one stock lookup may ask for
+MAX_STOCK_KEYS = 1000
+
+# ids are integer columns
+MAX_ID = 2 ** 31 - 1
+
+
+def _id_args(name):
+    """The repeated `name` argument as ids; aborts with 400 on one that is
+    not a whole number from 1 to MAX_ID, which getlist(type=int) would drop
+    or pass on to fail in the database."""
+    try:
+        ids = [int(value) for value in request.args.getlist(name)]
+    except ValueError:
+        abort(400)
+    if not all(0 < id <= MAX_ID for id in ids):
+        abort(400)
+    return ids
+
+
+def _id_arg(name):
+    """The optional single `name` argument as an id, checked as _id_args
+    checks them."""
+    ids = _id_args(name)
+    if len(ids) > 1:
+        abort(400)
+    return ids[0] if ids else None
+
+
+@api.route("/movements/<kind>/bulk", methods=["POST"])
+def bulk_movements(kind):
+    """Ingest product or raw material movements in bulk.
+
+    Accepts JSON lines (one movement object per line) or CSV with a header
+    row when sent as text/csv. Each batch of `batch_size` rows is committed
+    in its own transaction.
+    """
+    if kind not in URL_KINDS:
+        abort(404)
+    fmt = "csv" if request.mimetype == "text/csv" else "jsonl"
+    batch_size = request.args.get("batch_size", DEFAULT_BATCH_SIZE, type=int)
+    if batch_size < 1:
+        abort(400)
+    rows = parse_rows(request.get_data(as_text=True), fmt)
+    results = []
+    for start in range(0, len(rows), batch_size):
+        with db.engine.begin() as conn:
+            results.extend(
+                ingest_batch(
+                    conn,
+                    URL_KINDS[kind],
+                    rows[start : start + batch_size],
+                    first_row_number=start + 1,
+                )
+            )
+    accepted = sum(1 for result in results if result["status"] == "accepted")
+    return jsonify(accepted=accepted, rejected=len(results) - accepted, results=results)
+
+
+@api.route("/transfers", methods=["POST"])
+def transfers():
+    """Create and post a transfer order from a JSON object with
+    `from_location_id`, `to_location_id`, an optional `description` and
+    `lines`, each with a `product_id` or `raw_material_id` and a `qty`.
+
+    All lines are posted in one transaction, retried on deadlocks and
+    serialization failures, or none are.
+    """
+    body = request.get_json(silent=True)
+    try:
+        from_location_id = int(body["from_location_id"])
+        to_location_id = int(body["to_location_id"])
+        lines = []
+        for line in body["lines"]:
+            kind = "product" if line.get("product_id") is not None else "raw_material"
+            lines.append((kind, int(line[f"{kind}_id"]), int(line["qty"])))
+    except (TypeError, KeyError, ValueError, AttributeError):
+        abort(400)
+    try:
+        order_id = run_transaction(
+            lambda conn: create_transfer_order(
+                conn,
+                from_location_id,
+                to_location_id,
+                lines,
+                description=body.get("description"),
+            )
+        )
+    except validators.ValidationError as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(id=order_id, lines=len(lines)), 201
+
+
+@api.route("/stock/<kind>")
+def stock(kind):
+    """Current stock balances of every repeated `location_id` and `item_id`
+    argument pair, summed over shards, and null where a location has never
+    held an item. Served from the stock cache, so a balance can trail a
+    commit by up to STOCK_CACHE_TTL seconds."""
+    if kind not in URL_KINDS:
+        abort(404)
+    location_ids = _id_args("location_id")
+    item_ids = _id_args("item_id")
+    if not location_ids or not item_ids:
+        abort(400)
+    if len(location_ids) * len(item_ids) > MAX_STOCK_KEYS:
+        abort(400)
+    keys = [
+        (location_id, item_id) for location_id in location_ids for item_id in item_ids
+    ]
+    with db.engine.connect() as conn:
+        balances = stock_balances(conn, URL_KINDS[kind], keys)
+    return jsonify(
+        balances=[
+            {"location_id": location_id, "item_id": item_id, "balance": balance}
+            for (location_id, item_id), balance in sorted(balances.items())
+        ]
+    )
+
+
+@api.route("/stock/<kind>/as-of")
+def stock_as_of(kind):
+    """Stock balances as they stood at `at`, an ISO date (end of that day) or
+    datetime, optionally narrowed to one `location_id` and/or `item_id`."""
+    if kind not in URL_KINDS:
+        abort(404)
+    at = request.args.get("at", "")
+    try:
+        if len(at) == 10:
+            as_of = datetime.datetime.combine(
+                datetime.datetime.strptime(at, "%Y-%m-%d").date(), datetime.time.max
+            )
+        else:
+            as_of = datetime.datetime.strptime(at, "%Y-%m-%dT%H:%M:%S")
+    except ValueError:
+        abort(400)
+    with db.engine.connect() as conn:
+        balances = balances_as_of(
+            conn,
+            URL_KINDS[kind],
+            as_of,
+            location_id=_id_arg("location_id"),
+            item_id=_id_arg("item_id"),
+        )
+    return jsonify(
+        as_of=as_of.isoformat(),
+        balances=[
+            {"location_id": location_id, "item_id": item_id, "balance": balance}
+            for (location_id, item_id), balance in sorted(balances.items())
+        ],
+    )
+
+
+@api.route("/feasibility")
+def feasibility():
+    """How many whole batches of each product every location has the raw
+    materials for, and which raw material runs out first, optionally
+    narrowed to repeated `product_id` and/or `location_id` arguments.
+
+    Worked out from a per-process snapshot of bills of materials and raw
+    material stock up to FEASIBILITY_MAX_AGE seconds old; pass `refresh=1`
+    to reload it first. Rows of `batches` and `limiting_raw_material_ids`
+    follow `product_ids`, their columns `location_ids`.
+    """
+    product_ids = _id_args("product_id") or None
+    location_ids = _id_args("location_id") or None
+    with db.engine.connect() as conn:
+        snapshot = feasibility_cache.get(
+            conn, refresh=request.args.get("refresh", type=int) == 1
+        )
+        product_ids, location_ids, batches, limiting = snapshot.compute(
+            product_ids, location_ids
+        )
+        raw_materials = dict(
+            conn.execute(
+                db.text(
+                    "SELECT id, name FROM raw_material "
+                    "WHERE id = ANY(CAST(:ids AS integer[]))"
+                ),
+                ids=sorted(set(limiting.ravel().tolist())),
+            ).fetchall()
+        )
+    return jsonify(
+        as_of=datetime.datetime.fromtimestamp(snapshot.loaded_at).isoformat(),
+        product_ids=product_ids.tolist(),
+        location_ids=location_ids.tolist(),
+        batches=batches.tolist(),
+        limiting_raw_material_ids=limiting.tolist(),
+        raw_material_names={str(k): v for k, v in raw_materials.items()},
+    )
+
+
+@api.route("/pool")
+def pool():
+    """Occupancy and checkout wait totals of the database connection pool."""
+    return jsonify(pool_stats(db.engine))
+
+
+@api.route("/stock-cache")
+def stock_cache_stats():
+    """Hit, miss and invalidation counters of this process's stock cache."""
+    return jsonify(stock_cache.stats())
+
+
+@api.route("/movement-queue")
+def movement_queue():
+    """Pending and rejected movement queue rows and the worker's lag in
+    seconds."""
+    with db.engine.connect() as conn:
+        return jsonify(queue_stats(conn))
+
+
+def process_values():
+    """Connection pool and stock cache metrics of this process."""
+    pool = pool_stats(db.engine)
+    cache = stock_cache.stats()
+    values = [
+        Value(
+            "flaskentory_db_pool_checked_out",
+            "gauge",
+            "Connections checked out of the pool.",
+            pool["checked_out"],
+        ),
+        Value(
+            "flaskentory_db_pool_size",
+            "gauge",
+            "Connections the pool keeps open.",
+            pool["size"],
+        ),
+        Value(
+            "flaskentory_db_pool_checkouts_total",
+            "counter",
+            "Checkouts of a connection from the pool.",
+            pool.get("checkouts"),
+        ),
+        Value(
+            "flaskentory_db_pool_wait_seconds_total",
+            "counter",
+            "Time spent waiting for a connection.",
+            pool.get("wait_seconds_total"),
+        ),
+        Value(
+            "flaskentory_db_pool_timeouts_total",
+            "counter",
+            "Checkouts that timed out waiting for a connection.",
+            pool.get("timeouts"),
+        ),
+        Value(
+            "flaskentory_stock_cache_entries",
+            "gauge",
+            "Entries in the per-process stock caches.",
+            cache["entries"],
+        ),
+    ]
+    for name, help in [
+        ("hits", "Stock reads served by this process's stock cache."),
+        ("shared_hits", "Stock reads served by the stock cache shared segment."),
+        ("misses", "Stock reads the stock cache sent to the database."),
+        ("bypassed", "Stock reads of keys written by the reading transaction."),
+        ("invalidations", "Stock cache entries invalidated by commits."),
+    ]:
+        values.append(
+            Value(f"flaskentory_stock_cache_{name}_total", "counter", help, cache[name])
+        )
+    return values
+
+
+def metrics():
+    """Request, SQL, connection pool and stock cache metrics in the Prometheus
+    text format: those of every process of the host with a METRICS_DIR, else
+    those of this process, labelled with its pid."""
+    if request_metrics.directory:
+        request_metrics.dump()
+        text = render(merged(request_metrics.directory))
+    else:
+        text = render(request_metrics.process_metrics(), labels={"pid": os.getpid()})
+    return Response(text, mimetype="text/plain; version=0.0.4")
+
+
+def register(app):
+    feasibility_cache.max_age = app.config["FEASIBILITY_MAX_AGE"]
+    app.register_blueprint(api)
+    if app.config["METRICS_ENABLED"]:
+        request_metrics.collectors.append(process_values)
+        app.add_url_rule("/metrics", "metrics", metrics)
@@ -1,11 +1,16 @@
+from api import register as register_api
 from app_init import app
+from commands import register as register_commands
 from view_models import register
 
+register(app)
+register_api(app)
+register_commands(app)
+
 if __name__ == "__main__":
     # create demo data if demo flag set
     # if app.config["demo"]:
     #     db.drop_all()
     #     db.create_all()
     debug = not (app.config["is_production"])
-    register(app)
     app.run(debug=debug)
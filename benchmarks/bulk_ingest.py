@@ -0,0 +1,111 @@
+"""Compare movement throughput of the admin create form with the bulk API.
+
+Seeds a few locations and products, posts `--rows` product movements one
+by one through the Flask-Admin create form and then the same rows in a
+single JSON lines upload to /api/movements/product/bulk, and prints rows
+per second for each. The seeded data is deleted afterwards:
+
+    DATABASE_URL=postgresql://... python benchmarks/bulk_ingest.py --rows 2000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api import register as register_api  # noqa: E402
+from app_init import app, db  # noqa: E402
+from inventory.counts import COUNTED_TABLES, bump_row_count  # noqa: E402
+from view_models import register  # noqa: E402
+
+
+def seed(conn, tag, locations, products):
+    location_ids = [
+        conn.execute(
+            db.text("INSERT INTO location (name) VALUES (:n) RETURNING id"),
+            n=f"bench-{tag}-{i}",
+        ).scalar()
+        for i in range(locations)
+    ]
+    product_ids = [
+        conn.execute(
+            db.text("INSERT INTO product (name, quantity) VALUES (:n, 1) RETURNING id"),
+            n=f"bench-{tag}-{i}",
+        ).scalar()
+        for i in range(products)
+    ]
+    return location_ids, product_ids
+
+
+def cleanup(conn, location_ids, product_ids):
+    for table in ("product_movement", "product_stock_ledger", "product_stock"):
+        deleted = conn.execute(
+            db.text(f"DELETE FROM {table} WHERE product_id = ANY(:p)"), p=product_ids
+        ).rowcount
+        if table in COUNTED_TABLES:
+            bump_row_count(conn, table, -deleted)
+    conn.execute(db.text("DELETE FROM product WHERE id = ANY(:p)"), p=product_ids)
+    conn.execute(db.text("DELETE FROM location WHERE id = ANY(:l)"), l=location_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--locations", type=int, default=5)
+    parser.add_argument("--products", type=int, default=20)
+    args = parser.parse_args()
+
+    app.config["SQLALCHEMY_ECHO"] = False
+    register(app)
+    register_api(app)
+    client = app.test_client()
+    tag = uuid.uuid4().hex[:8]
+    with db.engine.begin() as conn:
+        location_ids, product_ids = seed(conn, tag, args.locations, args.products)
+    # inbound movements only, so no row is rejected for lack of stock
+    rows = [
+        {
+            "product_id": random.choice(product_ids),
+            "to_location_id": random.choice(location_ids),
+            "qty": random.randint(1, 100),
+        }
+        for _ in range(args.rows)
+    ]
+    try:
+        start = time.perf_counter()
+        for row in rows:
+            response = client.post(
+                "/productmovement/new/",
+                data={
+                    "product": row["product_id"],
+                    "to_location": row["to_location_id"],
+                    "qty": row["qty"],
+                },
+            )
+            assert response.status_code == 302, response.status_code
+        form_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        response = client.post(
+            "/api/movements/product/bulk",
+            data="\n".join(json.dumps(row) for row in rows),
+            content_type="application/x-ndjson",
+        )
+        bulk_seconds = time.perf_counter() - start
+        assert response.get_json()["accepted"] == args.rows, response.get_json()
+    finally:
+        with db.engine.begin() as conn:
+            cleanup(conn, location_ids, product_ids)
+
+    print(f"rows: {args.rows}")
+    print(f"form posts: {args.rows / form_seconds:>10.0f} rows/s")
+    print(f"bulk api:   {args.rows / bulk_seconds:>10.0f} rows/s")
+    print(f"speedup:    {form_seconds / bulk_seconds:>10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
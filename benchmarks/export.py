@@ -0,0 +1,201 @@
+"""Measure peak RSS and time to first byte of the admin exports.
+
+Seeds `--rows` raw material movements (CSV) or raw material stock rows
+(XLSX), then exports them through the Raw Material Movement or Raw Material
+Stock view twice, each in a fresh process: once through the streaming
+export and once through Flask-Admin's stock export, which loads every row
+before sending anything. The seeded data is deleted afterwards:
+
+    DATABASE_URL=postgresql://... python benchmarks/export.py --rows 5000000
+    DATABASE_URL=postgresql://... python benchmarks/export.py --format xlsx --rows 1000000
+"""
+import argparse
+import json
+import math
+import os
+import resource
+import subprocess
+import sys
+import time
+import types
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app_init import app, db  # noqa: E402
+from inventory.counts import bump_row_count  # noqa: E402
+
+EXPORT_URLS = {
+    "csv": "/rawmaterialmovement/export/csv/",
+    "xlsx": "/rawmaterialstock/export/xlsx/",
+}
+
+
+def seed(conn, tag, fmt, rows):
+    side = max(1, math.ceil(math.sqrt(rows))) if fmt == "xlsx" else 10
+    location_ids = [
+        row[0]
+        for row in conn.execute(
+            db.text(
+                "INSERT INTO location (name) SELECT :tag || '-' || i "
+                "FROM generate_series(1, :n) i RETURNING id"
+            ),
+            tag=tag,
+            n=side,
+        )
+    ]
+    raw_material_ids = [
+        row[0]
+        for row in conn.execute(
+            db.text(
+                "INSERT INTO raw_material (name) SELECT :tag || '-' || i "
+                "FROM generate_series(1, :n) i RETURNING id"
+            ),
+            tag=tag,
+            n=side,
+        )
+    ]
+    if fmt == "xlsx":
+        conn.execute(
+            db.text(
+                """
+                INSERT INTO raw_material_stock
+                    (location_id, raw_material_id, available_stock)
+                SELECT l, r, 1 FROM unnest(CAST(:l AS integer[])) l,
+                                    unnest(CAST(:r AS integer[])) r
+                LIMIT :n
+                """
+            ),
+            l=location_ids,
+            r=raw_material_ids,
+            n=rows,
+        )
+    else:
+        conn.execute(
+            db.text(
+                """
+                INSERT INTO raw_material_movement
+                    (movement_date, to_location_id, raw_material_id, qty)
+                SELECT current_date - i % 365,
+                       (CAST(:l AS integer[]))[1 + i % :nl],
+                       (CAST(:r AS integer[]))[1 + i / :nl % :nr],
+                       1 + i % 50
+                FROM generate_series(1, :n) i
+                """
+            ),
+            l=location_ids,
+            r=raw_material_ids,
+            nl=len(location_ids),
+            nr=len(raw_material_ids),
+            n=rows,
+        )
+        bump_row_count(conn, "raw_material_movement", rows)
+    return location_ids, raw_material_ids
+
+
+def cleanup(conn, location_ids, raw_material_ids):
+    deleted = conn.execute(
+        db.text("DELETE FROM raw_material_movement WHERE raw_material_id = ANY(:r)"),
+        r=raw_material_ids,
+    ).rowcount
+    bump_row_count(conn, "raw_material_movement", -deleted)
+    for table in ("raw_material_stock_ledger", "raw_material_stock"):
+        conn.execute(
+            db.text(f"DELETE FROM {table} WHERE raw_material_id = ANY(:r)"),
+            r=raw_material_ids,
+        )
+    conn.execute(
+        db.text("DELETE FROM raw_material WHERE id = ANY(:r)"), r=raw_material_ids
+    )
+    conn.execute(db.text("DELETE FROM location WHERE id = ANY(:l)"), l=location_ids)
+
+
+def export(fmt, mode):
+    """Run one export in this process and return its measurements."""
+    from flask_admin.contrib.sqla import ModelView
+    from view_models import register
+
+    app.config["SQLALCHEMY_ECHO"] = False
+    register(app)
+    if mode == "stock":
+        endpoint = EXPORT_URLS[fmt].split("/")[1]
+        for view in app.extensions["admin"][0]._views:
+            if getattr(view, "endpoint", None) == endpoint:
+                view._export_data = types.MethodType(ModelView._export_data, view)
+                view._export_tablib = types.MethodType(ModelView._export_tablib, view)
+    client = app.test_client()
+    start = time.perf_counter()
+    response = client.get(EXPORT_URLS[fmt], buffered=False)
+    chunks = iter(response.response)
+    size = len(next(chunks))
+    first_byte = time.perf_counter() - start
+    for chunk in chunks:
+        size += len(chunk)
+    total = time.perf_counter() - start
+    response.close()
+    return {
+        "status": response.status_code,
+        "ttfb_s": first_byte,
+        "total_s": total,
+        "bytes": size,
+        # kilobytes on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=5000000)
+    parser.add_argument("--format", choices=sorted(EXPORT_URLS), default="csv")
+    parser.add_argument(
+        "--modes",
+        default="streaming,stock",
+        help="comma separated; the stock export may be OOM killed on large runs",
+    )
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(export(args.format, args.child)))
+        return
+
+    app.config["SQLALCHEMY_ECHO"] = False
+    tag = f"bench-{uuid.uuid4().hex[:8]}"
+    with db.engine.begin() as conn:
+        location_ids, raw_material_ids = seed(conn, tag, args.format, args.rows)
+    try:
+        results = {}
+        for mode in args.modes.split(","):
+            child = subprocess.run(
+                [sys.executable, __file__, "--format", args.format, "--child", mode],
+                stdout=subprocess.PIPE,
+            )
+            results[mode] = (
+                json.loads(child.stdout.decode().strip().splitlines()[-1])
+                if child.returncode == 0
+                else {"failed": f"exit code {child.returncode}"}
+            )
+    finally:
+        with db.engine.begin() as conn:
+            cleanup(conn, location_ids, raw_material_ids)
+
+    print(f"{args.format} export of {args.rows} rows")
+    for mode, result in results.items():
+        if "failed" in result:
+            print(f"{mode:<10} {result['failed']}")
+            continue
+        print(
+            "{:<10} status: {}  ttfb: {:>8.2f} s  total: {:>8.2f} s  "
+            "size: {:>8.1f} MB  peak rss: {:>8.1f} MB".format(
+                mode,
+                result["status"],
+                result["ttfb_s"],
+                result["total_s"],
+                result["bytes"] / 1024 / 1024,
+                result["peak_rss_mb"],
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Time the vectorized feasibility pass on synthetic data.
+
+Builds bills of materials for `--products` products with `--lines` lines
+each over `--raw-materials` raw materials, random stock at `--locations`
+locations, and times Feasibility.compute for every (product, location)
+pair. The result is checked against a plain stock // quantity minimum:
+
+    python benchmarks/feasibility.py
+    python benchmarks/feasibility.py --products 5000 --locations 200 --raw-materials 10000
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from inventory.feasibility import Feasibility  # noqa: E402
+
+
+def synthetic(products, locations, raw_materials, lines, max_stock, seed):
+    rng = np.random.RandomState(seed)
+    raw_material_index = np.stack(
+        [
+            np.sort(rng.choice(raw_materials, lines, replace=False))
+            for _ in range(products)
+        ]
+    ).astype(np.intp)
+    quantities = rng.randint(1, 20, (products, lines)).astype(np.int32)
+    stock = np.zeros((raw_materials + 1, locations), np.int32)
+    stock[:-1] = rng.randint(0, max_stock, (raw_materials, locations))
+    return Feasibility(
+        np.arange(1, products + 1),
+        np.arange(1, locations + 1),
+        np.arange(1, raw_materials + 1),
+        (raw_material_index, quantities, np.full(products, lines)),
+        stock,
+        time.time(),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--locations", type=int, default=200)
+    parser.add_argument("--raw-materials", type=int, default=10000)
+    parser.add_argument("--lines", type=int, default=10, help="per product")
+    parser.add_argument("--max-stock", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    feasibility = synthetic(
+        args.products,
+        args.locations,
+        args.raw_materials,
+        args.lines,
+        args.max_stock,
+        args.seed,
+    )
+    timings = []
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        _, _, batches, limiting = feasibility.compute()
+        timings.append(time.perf_counter() - start)
+
+    expected = (
+        feasibility.stock[feasibility.raw_material_index]
+        // feasibility.quantities[:, :, None]
+    ).min(axis=1)
+    assert (batches == expected).all(), "batches differ from stock // quantity"
+    assert (limiting >= 1).all() and (limiting <= args.raw_materials).all()
+
+    print(
+        f"{args.products} products x {args.locations} locations x "
+        f"{args.raw_materials} raw materials, {args.lines} lines per product"
+    )
+    print(
+        "compute: median {:.1f} ms  min {:.1f} ms over {} runs".format(
+            statistics.median(timings) * 1000, min(timings) * 1000, args.repeat
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
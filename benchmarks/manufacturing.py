@@ -0,0 +1,193 @@
+"""Compare the set-based manufacturing path with the per-raw-material loop it
+replaced.
+
+Seeds a location, a product with a `--bom-lines` long bill of materials and
+enough raw material stock, then manufactures it `--runs` times with each
+implementation, reporting database round trips and latency per run.
+Everything happens inside one transaction that is rolled back at the end,
+so it is safe to point at a development database:
+
+    DATABASE_URL=postgresql://... python benchmarks/manufacturing.py --bom-lines 40
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event  # noqa: E402
+
+from app_init import app, db  # noqa: E402
+from inventory import manufacture  # noqa: E402
+
+
+def legacy_manufacture(conn, product_id, location_id, batch_size):
+    """The statements the old ModelViewProductManufacturing.on_model_change
+    issued, minus the validation messages."""
+    rows_needed = conn.execute(
+        db.text(
+            "select raw_material_id,raw_material_quantity from product_raw_material where product_id= :product_id"
+        ),
+        product_id=product_id,
+    ).fetchall()
+    conn.execute(
+        db.text(
+            "select raw_material_id,available_stock from raw_material_stock where location_id=:location_id AND raw_material_id = ANY(:raw_material_ids)"
+        ),
+        location_id=location_id,
+        raw_material_ids=[x[0] for x in rows_needed],
+    ).fetchall()
+    for raw_material_id, quantity in rows_needed:
+        row_from = conn.execute(
+            db.text(
+                "SELECT * FROM raw_material_stock WHERE location_id = :l AND raw_material_id = :p"
+            ),
+            p=raw_material_id,
+            l=location_id,
+        ).fetchone()
+        conn.execute(
+            db.text(
+                "UPDATE raw_material_stock SET available_stock = raw_material_stock.available_stock - :qty WHERE id = :row_id"
+            ),
+            qty=quantity * batch_size,
+            row_id=row_from.id,
+        )
+    qty_in_one_batch = conn.execute(
+        db.text("select quantity from product where id=:product_id"),
+        product_id=product_id,
+    ).fetchone()[0]
+    row_to = conn.execute(
+        db.text(
+            "SELECT * FROM product_stock WHERE location_id = :l AND product_id = :p"
+        ),
+        p=product_id,
+        l=location_id,
+    ).fetchone()
+    if row_to:
+        conn.execute(
+            db.text(
+                "UPDATE product_stock SET available_stock = product_stock.available_stock + :qty WHERE id = :id"
+            ),
+            qty=batch_size * qty_in_one_batch,
+            id=row_to.id,
+        )
+    else:
+        conn.execute(
+            db.text(
+                "INSERT INTO product_stock (location_id, product_id, available_stock) VALUES (:l,:p,:qty)"
+            ),
+            qty=batch_size * qty_in_one_batch,
+            l=location_id,
+            p=product_id,
+        )
+
+
+def seed(conn, bom_lines, stock):
+    tag = uuid.uuid4().hex[:8]
+    location_id = conn.execute(
+        db.text("INSERT INTO location (name) VALUES (:n) RETURNING id"),
+        n=f"bench-{tag}",
+    ).scalar()
+    product_id = conn.execute(
+        db.text("INSERT INTO product (name, quantity) VALUES (:n, 1) RETURNING id"),
+        n=f"bench-{tag}",
+    ).scalar()
+    for i in range(bom_lines):
+        raw_material_id = conn.execute(
+            db.text("INSERT INTO raw_material (name) VALUES (:n) RETURNING id"),
+            n=f"bench-{tag}-{i}",
+        ).scalar()
+        conn.execute(
+            db.text(
+                "INSERT INTO product_raw_material (name, raw_material_id, product_id, raw_material_quantity) VALUES (:n, :r, :p, 1)"
+            ),
+            n=f"bench-{tag}-{i}",
+            r=raw_material_id,
+            p=product_id,
+        )
+        conn.execute(
+            db.text(
+                "INSERT INTO raw_material_stock (location_id, raw_material_id, available_stock) VALUES (:l, :r, :s)"
+            ),
+            l=location_id,
+            r=raw_material_id,
+            s=stock,
+        )
+    return product_id, location_id
+
+
+def measure(conn, runs, fn):
+    round_trips = [0]
+
+    def count(*args):
+        round_trips[0] += 1
+
+    timings = []
+    event.listen(db.engine, "before_cursor_execute", count)
+    try:
+        for _ in range(runs):
+            start = time.perf_counter()
+            fn()
+            timings.append((time.perf_counter() - start) * 1000)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", count)
+    return {
+        "round_trips_per_run": round_trips[0] / runs,
+        "mean_ms": statistics.mean(timings),
+        "p50_ms": statistics.median(timings),
+        "max_ms": max(timings),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bom-lines", type=int, default=40)
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=1)
+    args = parser.parse_args()
+
+    app.config["SQLALCHEMY_ECHO"] = False
+    conn = db.engine.connect()
+    trans = conn.begin()
+    try:
+        product_id, location_id = seed(
+            conn, args.bom_lines, args.runs * args.batch_size * 2
+        )
+        results = {
+            "legacy loop": measure(
+                conn,
+                args.runs,
+                lambda: legacy_manufacture(
+                    conn, product_id, location_id, args.batch_size
+                ),
+            ),
+            "set-based": measure(
+                conn,
+                args.runs,
+                lambda: manufacture(
+                    conn, product_id, location_id, "bench", args.batch_size
+                ),
+            ),
+        }
+    finally:
+        trans.rollback()
+        conn.close()
+
+    print(f"BOM lines: {args.bom_lines}, runs: {args.runs}")
+    for name, result in results.items():
+        print(
+            "{:<12} round trips/run: {:>6.1f}  mean: {:>7.2f} ms  p50: {:>7.2f} ms  max: {:>7.2f} ms".format(
+                name,
+                result["round_trips_per_run"],
+                result["mean_ms"],
+                result["p50_ms"],
+                result["max_ms"],
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
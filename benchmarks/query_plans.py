@@ -0,0 +1,196 @@
+"""Show the query plans of the stock and movement lookups with and without
+the movement and stock indexes.
+
+Seeds `--locations` locations, `--products` products with a stock row at
+every location and `--movements` product movements spread over the last
+`--days` days, then runs EXPLAIN (ANALYZE, BUFFERS) for each query twice:
+once after dropping the indexes added by the movement and stock indexes
+migration, and once with them in place. Everything happens inside one
+transaction that is rolled back at the end, so it is safe to point at a
+development database:
+
+    DATABASE_URL=postgresql://... python benchmarks/query_plans.py --movements 1000000
+"""
+import argparse
+import os
+import re
+import sys
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app_init import app, db  # noqa: E402
+
+INDEXES = [
+    "product_movement_product_id_movement_date_index",
+    "product_movement_from_location_id_product_id_index",
+    "product_movement_to_location_id_product_id_index",
+    "product_movement_movement_date_id_index",
+    "product_movement_time_created_index",
+    "product_stock_product_id_location_id_index",
+    "product_stock_time_created_index",
+]
+
+QUERIES = [
+    (
+        "stock of a product at a location",
+        "SELECT available_stock FROM product_stock WHERE location_id = :l AND product_id = :p",
+    ),
+    (
+        "stock of a product at every location",
+        "SELECT location_id, available_stock FROM product_stock WHERE product_id = :p",
+    ),
+    (
+        "movement list, first page by date",
+        "SELECT * FROM product_movement ORDER BY movement_date DESC, id DESC LIMIT 20",
+    ),
+    (
+        "movement history of a product",
+        "SELECT * FROM product_movement WHERE product_id = :p "
+        "ORDER BY movement_date DESC LIMIT 50",
+    ),
+    (
+        "inflows of a product at a location",
+        "SELECT * FROM product_movement WHERE to_location_id = :l AND product_id = :p",
+    ),
+    (
+        "movements created in the last hour",
+        "SELECT count(*) FROM product_movement "
+        "WHERE time_created >= now() - interval '1 hour'",
+    ),
+]
+
+
+def seed(conn, locations, products, movements, days):
+    tag = uuid.uuid4().hex[:8]
+    location_ids = [
+        row[0]
+        for row in conn.execute(
+            db.text(
+                "INSERT INTO location (name) SELECT :tag || '-' || i "
+                "FROM generate_series(1, :n) i RETURNING id"
+            ),
+            tag=f"bench-{tag}",
+            n=locations,
+        )
+    ]
+    product_ids = [
+        row[0]
+        for row in conn.execute(
+            db.text(
+                "INSERT INTO product (name, quantity) SELECT :tag || '-' || i, 1 "
+                "FROM generate_series(1, :n) i RETURNING id"
+            ),
+            tag=f"bench-{tag}",
+            n=products,
+        )
+    ]
+    conn.execute(
+        db.text(
+            """
+            INSERT INTO product_stock (location_id, product_id, available_stock)
+            SELECT l, p, 1000 FROM unnest(CAST(:l AS integer[])) l,
+                                   unnest(CAST(:p AS integer[])) p
+            """
+        ),
+        l=location_ids,
+        p=product_ids,
+    )
+    conn.execute(
+        db.text(
+            """
+            INSERT INTO product_movement
+                (movement_date, from_location_id, to_location_id, product_id, qty,
+                 time_created)
+            SELECT CAST(now() - r.age AS date),
+                   CASE WHEN i % 3 = 0 THEN NULL
+                        ELSE (CAST(:l AS integer[]))[1 + i % cardinality(CAST(:l AS integer[]))]
+                   END,
+                   (CAST(:l AS integer[]))[1 + (i / 7) % cardinality(CAST(:l AS integer[]))],
+                   (CAST(:p AS integer[]))[1 + (i * 31) % cardinality(CAST(:p AS integer[]))],
+                   1 + i % 50,
+                   now() - r.age
+            FROM generate_series(1, :n) i,
+                 LATERAL (SELECT make_interval(secs => random() * :days * 86400) AS age
+                          WHERE i > 0) r
+            """
+        ),
+        l=location_ids,
+        p=product_ids,
+        n=movements,
+        days=days,
+    )
+    conn.execute(db.text("ANALYZE product_movement"))
+    conn.execute(db.text("ANALYZE product_stock"))
+    return location_ids[len(location_ids) // 2], product_ids[len(product_ids) // 2]
+
+
+def explain(conn, query, params):
+    plan = [
+        row[0]
+        for row in conn.execute(
+            db.text("EXPLAIN (ANALYZE, BUFFERS) " + query), **params
+        )
+    ]
+    runtime = None
+    for line in plan:
+        match = re.search(r"Execution Time: ([\d.]+)", line)
+        if match:
+            runtime = float(match.group(1))
+    return plan, runtime
+
+
+def run(conn, params, verbose):
+    runtimes = []
+    for title, query in QUERIES:
+        plan, runtime = explain(conn, query, params)
+        runtimes.append(runtime)
+        if verbose:
+            print(f"-- {title}")
+            print("\n".join(plan))
+            print()
+    return runtimes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--locations", type=int, default=50)
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--movements", type=int, default=200000)
+    parser.add_argument("--days", type=int, default=730)
+    parser.add_argument(
+        "--summary", action="store_true", help="only print execution times"
+    )
+    args = parser.parse_args()
+
+    app.config["SQLALCHEMY_ECHO"] = False
+    conn = db.engine.connect()
+    trans = conn.begin()
+    try:
+        location_id, product_id = seed(
+            conn, args.locations, args.products, args.movements, args.days
+        )
+        params = {"l": location_id, "p": product_id}
+
+        if not args.summary:
+            print("==== without indexes ====\n")
+        savepoint = conn.begin_nested()
+        for name in INDEXES:
+            conn.execute(db.text(f"DROP INDEX IF EXISTS {name}"))
+        before = run(conn, params, not args.summary)
+        savepoint.rollback()
+
+        if not args.summary:
+            print("==== with indexes ====\n")
+        after = run(conn, params, not args.summary)
+    finally:
+        trans.rollback()
+        conn.close()
+
+    print(f"{'query':<40} {'without':>12} {'with':>12}")
+    for (title, _), without, with_ in zip(QUERIES, before, after):
+        print(f"{title:<40} {without:>9.2f} ms {with_:>9.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
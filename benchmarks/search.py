@@ -0,0 +1,145 @@
+"""Time admin list searches on raw materials with and without the search
+indexes.
+
+Seeds `--rows` raw materials with names (ending in a serial number) and
+descriptions made of a small vocabulary, plus a supplier code per row for
+the long tail of words real descriptions have, then runs `--searches` random
+searches (whole words, word fragments and serial number fragments) through
+the Raw Material view's get_list the way its list page runs them: first
+through view_models.search and then, for `--baseline-searches` of them,
+through Flask-Admin's ILIKE search. Needs the search indexes migration. The
+seeded data is deleted afterwards:
+
+    DATABASE_URL=postgresql://... python benchmarks/search.py --rows 1000000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+import types
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app_init import app, db  # noqa: E402
+
+WORDS = [
+    "steel",
+    "brass",
+    "copper",
+    "nylon",
+    "rubber",
+    "walnut",
+    "bolt",
+    "washer",
+    "gasket",
+    "bracket",
+    "hinge",
+    "spring",
+]
+
+
+def seed(conn, tag, rows):
+    conn.execute(
+        db.text(
+            """
+            INSERT INTO raw_material (name, description)
+            SELECT w[1 + i % 12] || ' ' || w[1 + i / 12 % 12] || ' ' || i,
+                   'Sold by the ' || w[1 + i / 144 % 12] || ' box, fits the '
+                   || w[1 + i / 7 % 12] || ' ' || w[1 + i / 11 % 12] || ' range, '
+                   || 'supplier code S' || CAST(i AS bigint) * 7919 % 1000003
+                   || '. Batch ' || :tag
+            FROM generate_series(1, :n) i, CAST(:words AS text[]) w
+            """
+        ),
+        tag=tag,
+        n=rows,
+        words=WORDS,
+    )
+
+
+def cleanup(conn, tag):
+    conn.execute(
+        db.text("DELETE FROM raw_material WHERE description LIKE :p"), p=f"% {tag}"
+    )
+
+
+def terms(rng, rows, count):
+    result = []
+    for _ in range(count):
+        kind = rng.randrange(4)
+        if kind == 0:
+            result.append(rng.choice(WORDS))
+        elif kind == 1:
+            word = rng.choice(WORDS)
+            start = rng.randrange(len(word) - 3)
+            result.append(word[start : start + 4])
+        elif kind == 2:
+            result.append(f"{rng.choice(WORDS)} {rng.choice(WORDS)[:3]}")
+        else:
+            result.append(str(rng.randrange(1, rows))[:-1])
+    return result
+
+
+def run(view, searches):
+    timings = []
+    for search in searches:
+        with app.test_request_context(f"/{view.endpoint}/?search={search}"):
+            start = time.perf_counter()
+            count, data = view.get_list(0, None, False, search, [])
+            timings.append(time.perf_counter() - start)
+            db.session.remove()
+    return timings
+
+
+def summary(name, timings):
+    timings = sorted(timings)
+    p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+    return "{:<22} p50: {:>8.1f} ms  p99: {:>8.1f} ms  max: {:>8.1f} ms".format(
+        name, statistics.median(timings) * 1000, p99 * 1000, timings[-1] * 1000,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--searches", type=int, default=500)
+    parser.add_argument("--baseline-searches", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    from flask_admin.contrib.sqla import ModelView
+    from view_models import register
+
+    app.config["SQLALCHEMY_ECHO"] = False
+    register(app)
+    view = next(
+        view
+        for view in app.extensions["admin"][0]._views
+        if getattr(view, "endpoint", None) == "rawmaterial"
+    )
+    tag = uuid.uuid4().hex[:8]
+    with db.engine.begin() as conn:
+        seed(conn, tag, args.rows)
+    with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(db.text("VACUUM ANALYZE raw_material"))
+    try:
+        searches = terms(random.Random(args.seed), args.rows, args.searches)
+        run(view, searches[:10])
+        indexed = run(view, searches)
+        view._apply_search = types.MethodType(ModelView._apply_search, view)
+        view._apply_sorting = types.MethodType(ModelView._apply_sorting, view)
+        baseline = run(view, searches[: args.baseline_searches])
+    finally:
+        with db.engine.begin() as conn:
+            cleanup(conn, tag)
+
+    print(f"{len(searches)} searches over {args.rows} raw materials")
+    print(summary("indexed search", indexed))
+    print(summary("ILIKE search", baseline))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Time single stock lookups with and without the stock cache.
+
+Seeds `--items` raw material stock rows at one location, then reads
+`--lookups` random ones one at a time: straight from the database, through
+the cache while it fills, through the warm cache of the same process, and
+through the cache of a fresh process (another worker), which starts with an
+empty LRU but finds the rows in the shared segment. The seeded data is
+deleted afterwards:
+
+    DATABASE_URL=postgresql://... python benchmarks/stock_cache.py
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app_init import app, db  # noqa: E402
+from inventory.stock import stock_balances  # noqa: E402
+from inventory.stock_cache import stock_cache  # noqa: E402
+
+
+def seed(conn, tag, items):
+    location_id = conn.execute(
+        db.text("INSERT INTO location (name) VALUES (:tag) RETURNING id"), tag=tag
+    ).scalar()
+    raw_material_ids = [
+        row[0]
+        for row in conn.execute(
+            db.text(
+                "INSERT INTO raw_material (name) SELECT :tag || '-' || i "
+                "FROM generate_series(1, :n) i RETURNING id"
+            ),
+            tag=tag,
+            n=items,
+        )
+    ]
+    conn.execute(
+        db.text(
+            """
+            INSERT INTO raw_material_stock (location_id, raw_material_id, available_stock)
+            SELECT :l, r, 100 FROM unnest(CAST(:r AS integer[])) r
+            """
+        ),
+        l=location_id,
+        r=raw_material_ids,
+    )
+    return location_id, raw_material_ids
+
+
+def cleanup(conn, location_id, raw_material_ids):
+    conn.execute(
+        db.text("DELETE FROM raw_material_stock WHERE raw_material_id = ANY(:r)"),
+        r=raw_material_ids,
+    )
+    conn.execute(
+        db.text("DELETE FROM raw_material WHERE id = ANY(:r)"), r=raw_material_ids
+    )
+    conn.execute(db.text("DELETE FROM location WHERE id = :l"), l=location_id)
+
+
+def lookups(keys, cached):
+    """Read every key on its own and return the mean microseconds per read
+    and the cache counters it moved."""
+    before = stock_cache.stats()
+    with db.engine.connect() as conn:
+        start = time.perf_counter()
+        for key in keys:
+            stock_balances(conn, "raw_material", [key], cached=cached)
+        mean_us = (time.perf_counter() - start) / len(keys) * 1e6
+    after = stock_cache.stats()
+    counters = {
+        name: after[name] - before[name] for name in ("hits", "shared_hits", "misses")
+    }
+    return mean_us, counters
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--items", type=int, default=5000)
+    parser.add_argument("--lookups", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    app.config["SQLALCHEMY_ECHO"] = False
+    if args.child:
+        keys = [tuple(key) for key in json.load(sys.stdin)]
+        print(json.dumps(lookups(keys, True)))
+        return
+
+    tag = f"bench-{uuid.uuid4().hex[:8]}"
+    with db.engine.begin() as conn:
+        location_id, raw_material_ids = seed(conn, tag, args.items)
+    try:
+        rng = random.Random(args.seed)
+        keys = [
+            (location_id, rng.choice(raw_material_ids)) for _ in range(args.lookups)
+        ]
+        results = [
+            ("database", lookups(keys, False)),
+            ("cache, filling", lookups(keys, True)),
+            ("cache, warm", lookups(keys, True)),
+        ]
+        child = subprocess.run(
+            [sys.executable, __file__, "--child"],
+            input=json.dumps(keys).encode(),
+            stdout=subprocess.PIPE,
+            check=True,
+        )
+        results.append(
+            ("cache, other process", json.loads(child.stdout.decode().splitlines()[-1]))
+        )
+    finally:
+        with db.engine.begin() as conn:
+            cleanup(conn, location_id, raw_material_ids)
+
+    print(f"{args.lookups} lookups over {args.items} stock rows")
+    for name, (mean_us, counters) in results:
+        print(
+            f"{name:<22} {mean_us:>8.1f} us/lookup  hits: {counters['hits']:>6}  "
+            f"shared hits: {counters['shared_hits']:>6}  misses: {counters['misses']:>6}"
+        )
+
+
+if __name__ == "__main__":
+    main()
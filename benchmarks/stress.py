@@ -0,0 +1,415 @@
+"""Stress the stock-changing admin views with concurrent writers and check
+the balances they leave.
+
+For every `--writers` level a fresh catalog is seeded: `--locations`
+locations each receiving `--stock` of `--products` products and
+`--raw-materials` raw materials (every product needs two of them). Each
+writer has its own Flask test client and sends `--requests` random posts:
+product and raw material movements, manufacturing runs and multi-line
+transfer orders between the seeded locations, with quantities large
+enough that some are rejected for lack of stock. Writers work on the
+same few rows, so their transactions queue on row locks; one that still
+deadlocks is retried (tests/test_transactions.py forces that path).
+
+After each level the seeded stock must hold up:
+
+- no balance is negative;
+- transfers moved stock without creating or losing any, so the totals
+  only changed by what manufacturing produced and consumed;
+- every balance equals what the movements and manufacturing runs add up
+  to (inventory.reconciliation.compare_stock);
+- every accepted post left its rows and no rejected one left any.
+
+Throughput, rejections and retries are reported per level and the seeded
+data is deleted afterwards:
+
+    DATABASE_URL=postgresql://... python benchmarks/stress.py --writers 1,8,64
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app_init import app, db  # noqa: E402
+from inventory.counts import COUNTED_TABLES, bump_row_count  # noqa: E402
+from inventory.reconciliation import MANUFACTURING_SOURCE, compare_stock  # noqa: E402
+from inventory.stock import LEDGER_TABLES, STOCK_TABLES, apply_deltas  # noqa: E402
+
+# description of the receipts that seed the stock
+SEED_DESCRIPTION = "stress seed"
+
+# tables holding rows of the seeded items, in deletion order
+ITEM_TABLES = {
+    "product": [
+        "product_movement",
+        "product_movement_daily",
+        "product_manufacturing",
+        "product_stock_ledger",
+        "product_stock_snapshot",
+        "product_stock_shard",
+        "product_stock",
+        "product_raw_material",
+    ],
+    "raw_material": [
+        "raw_material_movement",
+        "raw_material_movement_daily",
+        "raw_material_stock_ledger",
+        "raw_material_stock_snapshot",
+        "raw_material_stock_shard",
+        "raw_material_stock",
+        "product_raw_material",
+    ],
+}
+
+
+def seed(conn, tag, args):
+    catalog = {}
+    for table, rows in (
+        ("location", args.locations),
+        ("product", args.products),
+        ("raw_material", args.raw_materials),
+    ):
+        extra = ", quantity" if table == "product" else ""
+        catalog[table] = [
+            row[0]
+            for row in conn.execute(
+                db.text(
+                    f"INSERT INTO {table} (name{extra}) "
+                    f"SELECT :tag || '-' || i{', 1' if extra else ''} "
+                    f"FROM generate_series(1, :n) i ORDER BY i RETURNING id"
+                ),
+                tag=tag,
+                n=rows,
+            )
+        ]
+    raw_materials = catalog["raw_material"]
+    for n, product_id in enumerate(catalog["product"]):
+        for k in range(2):
+            conn.execute(
+                db.text(
+                    "INSERT INTO product_raw_material "
+                    "(name, product_id, raw_material_id, raw_material_quantity) "
+                    "VALUES (:name, :product_id, :raw_material_id, :qty)"
+                ),
+                name=f"{tag}-{n}-{k}",
+                product_id=product_id,
+                raw_material_id=raw_materials[(n + k) % len(raw_materials)],
+                qty=1 + k,
+            )
+    # the stock arrives as receipts, so that the movements account for it
+    for kind in STOCK_TABLES:
+        _, item_column = STOCK_TABLES[kind]
+        inserted = conn.execute(
+            db.text(
+                f"""
+                INSERT INTO {kind}_movement
+                    (movement_date, to_location_id, {item_column}, qty, description)
+                SELECT current_date, l, i, :stock, :description
+                FROM unnest(CAST(:locations AS integer[])) l
+                CROSS JOIN unnest(CAST(:items AS integer[])) i
+                """
+            ),
+            locations=catalog["location"],
+            items=catalog[kind],
+            stock=args.stock,
+            description=SEED_DESCRIPTION,
+        ).rowcount
+        bump_row_count(conn, f"{kind}_movement", inserted)
+        apply_deltas(
+            conn,
+            kind,
+            {
+                (location_id, item_id): args.stock
+                for location_id in catalog["location"]
+                for item_id in catalog[kind]
+            },
+        )
+    return catalog
+
+
+def cleanup(conn, tag):
+    prefix = f"{tag}-%"
+    conn.execute(
+        db.text(
+            "DELETE FROM transfer_order WHERE from_location_id IN "
+            "(SELECT id FROM location WHERE name LIKE :p)"
+        ),
+        p=prefix,
+    )
+    for kind, tables in ITEM_TABLES.items():
+        for table in tables:
+            deleted = conn.execute(
+                db.text(
+                    f"DELETE FROM {table} WHERE {kind}_id IN "
+                    f"(SELECT id FROM {kind} WHERE name LIKE :p)"
+                ),
+                p=prefix,
+            ).rowcount
+            if table in COUNTED_TABLES:
+                bump_row_count(conn, table, -deleted)
+    for table in ("product", "raw_material", "location"):
+        conn.execute(db.text(f"DELETE FROM {table} WHERE name LIKE :p"), p=prefix)
+
+
+def post_product_movement(client, rng, catalog, args):
+    from_location, to_location = rng.sample(catalog["location"], 2)
+    return client.post(
+        "/productmovement/new/",
+        data={
+            "product": rng.choice(catalog["product"]),
+            "from_location": from_location,
+            "to_location": to_location,
+            "qty": rng.randint(1, args.stock // 2),
+        },
+    )
+
+
+def post_raw_material_movement(client, rng, catalog, args):
+    from_location, to_location = rng.sample(catalog["location"], 2)
+    return client.post(
+        "/rawmaterialmovement/new/",
+        data={
+            "raw_material": rng.choice(catalog["raw_material"]),
+            "from_location": from_location,
+            "to_location": to_location,
+            "qty": rng.randint(1, args.stock // 2),
+        },
+    )
+
+
+def post_product_manufacturing(client, rng, catalog, args):
+    return client.post(
+        "/productmanufacturing/new/",
+        data={
+            "product": rng.choice(catalog["product"]),
+            "to_location": rng.choice(catalog["location"]),
+            "batch_size": rng.randint(1, args.stock // 8),
+        },
+    )
+
+
+def post_transfer_order(client, rng, catalog, args):
+    from_location, to_location = rng.sample(catalog["location"], 2)
+    data = {"from_location": from_location, "to_location": to_location}
+    lines = [("product", item) for item in rng.sample(catalog["product"], 2)]
+    lines.append(("raw_material", rng.choice(catalog["raw_material"])))
+    for n, (kind, item_id) in enumerate(lines):
+        data[f"lines-{n}-{kind}"] = item_id
+        data[f"lines-{n}-qty"] = rng.randint(1, args.stock // 4)
+    return client.post("/transferorder/new/", data=data)
+
+
+OPERATIONS = {
+    "product_movement": post_product_movement,
+    "raw_material_movement": post_raw_material_movement,
+    "product_manufacturing": post_product_manufacturing,
+    "transfer_order": post_transfer_order,
+}
+
+
+def outcome(response):
+    # a saved record redirects; a rejected one renders the form again with
+    # the error flashed
+    if response.status_code == 302:
+        return "accepted"
+    if response.status_code == 200:
+        body = response.get_data()
+        # a transaction still conflicting after TRANSACTION_RETRIES attempts
+        if b"Failed to save record" in body:
+            return "failed"
+        if b"alert-danger" in body:
+            return "rejected"
+    return f"error {response.status_code}"
+
+
+class RetryCounter(logging.Handler):
+    """Counts the transactions retry_transient runs again, from its log."""
+
+    def __init__(self):
+        super().__init__(logging.INFO)
+        self.retries = 0
+
+    def emit(self, record):
+        if record.msg.startswith("retrying transaction"):
+            self.retries += 1
+
+
+def run_writers(writers, requests, seed_value, catalog, args):
+    results = {name: {} for name in OPERATIONS}
+    lock = threading.Lock()
+
+    def writer(index):
+        rng = random.Random(f"{seed_value}-{writers}-{index}")
+        client = app.test_client()
+        for _ in range(requests):
+            name = rng.choice(list(OPERATIONS))
+            result = outcome(OPERATIONS[name](client, rng, catalog, args))
+            with lock:
+                results[name][result] = results[name].get(result, 0) + 1
+
+    threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - start
+
+
+def check(conn, catalog, results, args):
+    """Return the list of invariants the writers broke."""
+    failures = []
+    locations = catalog["location"]
+    for kind in STOCK_TABLES:
+        _, item_column = STOCK_TABLES[kind]
+        negative, total, manufactured = conn.execute(
+            db.text(
+                f"""
+                SELECT
+                    (SELECT COUNT(*) FROM {kind}_stock
+                     WHERE location_id = ANY(:l) AND available_stock < 0),
+                    (SELECT COALESCE(SUM(available_stock), 0) FROM {kind}_stock
+                     WHERE location_id = ANY(:l))
+                    + (SELECT COALESCE(SUM(available_stock), 0)
+                       FROM {kind}_stock_shard WHERE location_id = ANY(:l)),
+                    (SELECT COALESCE(SUM(delta), 0) FROM {LEDGER_TABLES[kind]}
+                     WHERE location_id = ANY(:l) AND source = :source)
+                """
+            ),
+            l=locations,
+            source=MANUFACTURING_SOURCE,
+        ).fetchone()
+        if negative:
+            failures.append(f"{kind}: {negative} negative balances")
+        seeded = args.stock * len(locations) * len(catalog[kind])
+        if total != seeded + manufactured:
+            failures.append(
+                f"{kind}: total {total}, expected {seeded} seeded "
+                f"{manufactured:+} manufactured"
+            )
+        _, differences = compare_stock(conn, kind, locations)
+        if differences:
+            failures.append(
+                f"{kind}: {len(differences)} balances differ from the movements, "
+                f"e.g. {differences[0]}"
+            )
+        movements = conn.execute(
+            db.text(
+                f"""
+                SELECT COUNT(*) FROM {kind}_movement
+                WHERE to_location_id = ANY(:l) AND from_location_id IS NOT NULL
+                """
+            ),
+            l=locations,
+        ).scalar()
+        transfer_lines = conn.execute(
+            db.text(
+                f"""
+                SELECT COUNT(*) FROM transfer_order_line t
+                JOIN transfer_order o ON o.id = t.transfer_order_id
+                WHERE o.from_location_id = ANY(:l) AND t.{item_column} IS NOT NULL
+                """
+            ),
+            l=locations,
+        ).scalar()
+        accepted = results[f"{kind}_movement"].get("accepted", 0)
+        if movements != accepted + transfer_lines:
+            failures.append(
+                f"{kind}: {movements} movements for {accepted} accepted posts "
+                f"and {transfer_lines} transfer order lines"
+            )
+    runs, orders, unposted = conn.execute(
+        db.text(
+            """
+            SELECT
+                (SELECT COUNT(*) FROM product_manufacturing
+                 WHERE to_location_id = ANY(:l)),
+                (SELECT COUNT(*) FROM transfer_order WHERE from_location_id = ANY(:l)),
+                (SELECT COUNT(*) FROM transfer_order
+                 WHERE from_location_id = ANY(:l) AND posted_at IS NULL)
+            """
+        ),
+        l=locations,
+    ).fetchone()
+    for name, rows in (("product_manufacturing", runs), ("transfer_order", orders)):
+        accepted = results[name].get("accepted", 0)
+        if rows != accepted:
+            failures.append(f"{name}: {rows} rows for {accepted} accepted posts")
+    if unposted:
+        failures.append(f"transfer_order: {unposted} orders saved but not posted")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--writers", default="1,2,4,8,16,32,64")
+    parser.add_argument("--requests", type=int, default=25, help="per writer")
+    parser.add_argument("--locations", type=int, default=4)
+    parser.add_argument("--products", type=int, default=3)
+    parser.add_argument("--raw-materials", type=int, default=3)
+    parser.add_argument("--stock", type=int, default=200, help="per item and location")
+    parser.add_argument("--seed", default="stress")
+    args = parser.parse_args()
+
+    levels = [int(writers) for writers in args.writers.split(",")]
+    if args.locations < 2 or args.products < 2 or args.raw_materials < 2:
+        parser.error("need at least two locations, products and raw materials")
+
+    from view_models import register
+
+    app.config["SQLALCHEMY_ECHO"] = False
+    app.config["SQLALCHEMY_POOL_SIZE"] = max(levels) + 1
+    # movements must change the stock in their own transaction
+    app.config["MOVEMENT_WRITE_BEHIND"] = False
+    register(app)
+    counter = RetryCounter()
+    app.logger.setLevel(logging.INFO)
+    app.logger.addHandler(counter)
+    failed = False
+    print(
+        f"{'writers':>7} {'posts/s':>9} {'accepted':>9} {'rejected':>9} "
+        f"{'errors':>7} {'retries':>8}  result"
+    )
+    try:
+        for writers in levels:
+            tag = f"stress-{uuid.uuid4().hex[:8]}"
+            with db.engine.begin() as conn:
+                catalog = seed(conn, tag, args)
+            try:
+                counter.retries = 0
+                results, seconds = run_writers(
+                    writers, args.requests, args.seed, catalog, args
+                )
+                with db.engine.begin() as conn:
+                    failures = check(conn, catalog, results, args)
+            finally:
+                with db.engine.begin() as conn:
+                    cleanup(conn, tag)
+            outcomes = {}
+            for result in results.values():
+                for name, n in result.items():
+                    outcomes[name] = outcomes.get(name, 0) + n
+            accepted = outcomes.pop("accepted", 0)
+            rejected = outcomes.pop("rejected", 0)
+            errors = sum(outcomes.values())
+            failed = failed or bool(failures or errors)
+            print(
+                f"{writers:>7} {writers * args.requests / seconds:>9.1f} "
+                f"{accepted:>9} {rejected:>9} {errors:>7} "
+                f"{counter.retries:>8}  {'; '.join(failures) or 'ok'}"
+            )
+            if errors:
+                print(f"{'':>7} errors: {outcomes}")
+    finally:
+        app.logger.removeHandler(counter)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
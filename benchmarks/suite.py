@@ -0,0 +1,506 @@
+"""Load the posting, manufacturing, list and export paths and report each
+as JSON that can be diffed between runs.
+
+Seeds a synthetic catalog: `--locations` locations, `--products` products
+with `--bom-lines` long bills of materials over `--raw-materials` raw
+materials, stock of every item at every location, and `--movements`
+historical movements in each of the product and raw material movement
+tables. Then, one operation at a time, `--threads` threads each with their
+own Flask test client send `--requests` requests in total (`--export-requests`
+for exports) through the admin views: product and raw material movement
+posts (transfers between two locations), manufacturing posts, list pages
+and exports. Every operation is reported with its throughput, p50/p95/p99 latency and the SQL statements
+(database round trips) per request:
+
+    DATABASE_URL=postgresql://... python benchmarks/suite.py --output before.json
+    DATABASE_URL=postgresql://... python benchmarks/suite.py --compare before.json
+
+The seeded data is deleted afterwards unless `--keep` is given; `--tag`
+reuses a catalog kept by an earlier run, so millions of movements are only
+seeded once per database. SQLite (`DATABASE_URL=sqlite:///...`) stands in
+for seeding and the read paths; the posting paths need PostgreSQL and are
+reported with their errors there.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event  # noqa: E402
+
+from app_init import app, db  # noqa: E402
+from inventory.counts import COUNTED_TABLES, bump_row_count  # noqa: E402
+
+# stock of every seeded item at every location, enough that no transfer or
+# manufacturing run is rejected
+SEEDED_STOCK = 10 ** 9
+
+# days of history the seeded movements are spread over
+HISTORY_DAYS = 730
+
+# tables holding rows of the seeded items, in deletion order
+ITEM_TABLES = {
+    "product": [
+        "product_movement",
+        "product_movement_daily",
+        "product_manufacturing",
+        "product_stock_ledger",
+        "product_stock_snapshot",
+        "product_stock_shard",
+        "product_stock",
+        "product_raw_material",
+    ],
+    "raw_material": [
+        "raw_material_movement",
+        "raw_material_movement_daily",
+        "raw_material_stock_ledger",
+        "raw_material_stock_snapshot",
+        "raw_material_stock_shard",
+        "raw_material_stock",
+        "product_raw_material",
+    ],
+}
+
+
+def post_product_movement(client, rng, catalog):
+    from_location, to_location = rng.sample(catalog["location"], 2)
+    return client.post(
+        "/productmovement/new/",
+        data={
+            "product": rng.choice(catalog["product"]),
+            "from_location": from_location,
+            "to_location": to_location,
+            "qty": rng.randint(1, 10),
+        },
+    )
+
+
+def post_raw_material_movement(client, rng, catalog):
+    from_location, to_location = rng.sample(catalog["location"], 2)
+    return client.post(
+        "/rawmaterialmovement/new/",
+        data={
+            "raw_material": rng.choice(catalog["raw_material"]),
+            "from_location": from_location,
+            "to_location": to_location,
+            "qty": rng.randint(1, 10),
+        },
+    )
+
+
+def post_product_manufacturing(client, rng, catalog):
+    return client.post(
+        "/productmanufacturing/new/",
+        data={
+            "product": rng.choice(catalog["product"]),
+            "to_location": rng.choice(catalog["location"]),
+            "batch_size": rng.randint(1, 5),
+        },
+    )
+
+
+def get(url):
+    def operation(client, rng, catalog):
+        return client.get(url)
+
+    return operation
+
+
+# name -> (request, expected status code, run by default)
+OPERATIONS = {
+    "product_movement_create": (post_product_movement, 302, True),
+    "raw_material_movement_create": (post_raw_material_movement, 302, True),
+    "product_manufacturing_create": (post_product_manufacturing, 302, True),
+    "product_movement_list": (get("/productmovement/"), 200, True),
+    "raw_material_movement_list": (get("/rawmaterialmovement/"), 200, True),
+    "product_stock_list": (get("/productstock/"), 200, True),
+    "raw_material_stock_list": (get("/rawmaterialstock/"), 200, True),
+    "product_manufacturing_list": (get("/productmanufacturing/"), 200, True),
+    "product_stock_export": (get("/productstock/export/csv/"), 200, True),
+    "raw_material_stock_export": (get("/rawmaterialstock/export/csv/"), 200, True),
+    # every movement, so one request takes as long as the seeded history
+    "raw_material_movement_export": (
+        get("/rawmaterialmovement/export/csv/"),
+        200,
+        False,
+    ),
+}
+
+
+def _series(dialect):
+    if dialect == "postgresql":
+        return "generate_series(0, :n - 1) AS s(i)"
+    return (
+        "(WITH RECURSIVE s(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM s "
+        "WHERE i < :n - 1) SELECT i FROM s) AS s"
+    )
+
+
+def _days_ago(dialect):
+    if dialect == "postgresql":
+        return f"current_date - i % {HISTORY_DAYS}"
+    return f"date('now', '-' || (i % {HISTORY_DAYS}) || ' days')"
+
+
+def _numbered(table):
+    """The seeded rows of `table` numbered from 0, to spread generated rows
+    over them."""
+    return (
+        f"(SELECT id, row_number() OVER (ORDER BY id) - 1 AS n "
+        f"FROM {table} WHERE name LIKE :prefix)"
+    )
+
+
+def seed(conn, tag, args):
+    dialect = conn.dialect.name
+    series = _series(dialect)
+    prefix = f"{tag}-%"
+    for table, rows, extra_columns, extra_values in (
+        ("location", args.locations, "", ""),
+        ("product", args.products, ", quantity", ", 1 + i % 10"),
+        ("raw_material", args.raw_materials, "", ""),
+    ):
+        conn.execute(
+            db.text(
+                f"INSERT INTO {table} (name{extra_columns}) "
+                f"SELECT :tag || '-' || i{extra_values} FROM {series}"
+            ),
+            tag=tag,
+            n=rows,
+        )
+    # raw materials (p * bom_lines + k) % raw_materials for k < bom_lines,
+    # distinct within a product
+    conn.execute(
+        db.text(
+            f"""
+            INSERT INTO product_raw_material
+                (name, product_id, raw_material_id, raw_material_quantity)
+            SELECT :tag || '-' || p.n || '-' || b.i, p.id, r.id, 1 + b.i % 3
+            FROM {_numbered('product')} p
+            CROSS JOIN (SELECT i FROM {series}) b
+            JOIN {_numbered('raw_material')} r
+              ON r.n = (p.n * :bom_lines + b.i) % :raw_materials
+            """
+        ),
+        tag=tag,
+        prefix=prefix,
+        n=args.bom_lines,
+        bom_lines=args.bom_lines,
+        raw_materials=args.raw_materials,
+    )
+    for kind in ("product", "raw_material"):
+        conn.execute(
+            db.text(
+                f"""
+                INSERT INTO {kind}_stock (location_id, {kind}_id, available_stock)
+                SELECT l.id, i.id, :stock
+                FROM {_numbered('location')} l CROSS JOIN {_numbered(kind)} i
+                """
+            ),
+            prefix=prefix,
+            stock=SEEDED_STOCK,
+        )
+        counts = {"product": args.products, "raw_material": args.raw_materials}
+        inserted = conn.execute(
+            db.text(
+                f"""
+                INSERT INTO {kind}_movement
+                    (movement_date, from_location_id, to_location_id,
+                     {kind}_id, qty)
+                SELECT {_days_ago(dialect)},
+                       CASE WHEN i % 3 > 0 THEN f.id END,
+                       t.id, it.id, 1 + i % 50
+                FROM {series}
+                JOIN {_numbered('location')} t ON t.n = i % :locations
+                JOIN {_numbered('location')} f ON f.n = (i + 1) % :locations
+                JOIN {_numbered(kind)} it ON it.n = i / :locations % :items
+                """
+            ),
+            prefix=prefix,
+            n=args.movements,
+            locations=args.locations,
+            items=counts[kind],
+        ).rowcount
+        if dialect == "postgresql":
+            bump_row_count(conn, f"{kind}_movement", inserted)
+
+
+def catalog_ids(conn, tag):
+    return {
+        table: [
+            row[0]
+            for row in conn.execute(
+                db.text(f"SELECT id FROM {table} WHERE name LIKE :p ORDER BY id"),
+                p=f"{tag}-%",
+            )
+        ]
+        for table in ("location", "product", "raw_material")
+    }
+
+
+def cleanup(conn, tag):
+    prefix = f"{tag}-%"
+    for kind, tables in ITEM_TABLES.items():
+        for table in tables:
+            deleted = conn.execute(
+                db.text(
+                    f"DELETE FROM {table} WHERE {kind}_id IN "
+                    f"(SELECT id FROM {kind} WHERE name LIKE :p)"
+                ),
+                p=prefix,
+            ).rowcount
+            if table in COUNTED_TABLES and conn.dialect.name == "postgresql":
+                bump_row_count(conn, table, -deleted)
+    for table in ("product", "raw_material", "location"):
+        conn.execute(db.text(f"DELETE FROM {table} WHERE name LIKE :p"), p=prefix)
+
+
+def percentile(ordered, fraction):
+    return ordered[
+        min(len(ordered) - 1, max(0, math.ceil(len(ordered) * fraction) - 1))
+    ]
+
+
+def run_operation(name, requests, threads, seed_value, catalog):
+    """Send `requests` requests of operation `name` from `threads` threads
+    and return their measurements."""
+    request, expected_status, _ = OPERATIONS[name]
+    counter = threading.local()
+
+    def count(*args):
+        counter.statements = getattr(counter, "statements", 0) + 1
+
+    timings, round_trips, errors = [], [], {}
+    lock = threading.Lock()
+
+    def worker(index, share):
+        rng = random.Random(f"{seed_value}-{name}-{index}")
+        client = app.test_client()
+        for _ in range(share):
+            counter.statements = 0
+            start = time.perf_counter()
+            response = request(client, rng, catalog)
+            # reads a streamed body to the end
+            response.get_data()
+            seconds = time.perf_counter() - start
+            with lock:
+                if response.status_code == expected_status:
+                    timings.append(seconds)
+                    round_trips.append(counter.statements)
+                else:
+                    errors[response.status_code] = (
+                        errors.get(response.status_code, 0) + 1
+                    )
+
+    shares = [requests // threads + (i < requests % threads) for i in range(threads)]
+    workers = [
+        threading.Thread(target=worker, args=(i, share))
+        for i, share in enumerate(shares)
+        if share
+    ]
+    event.listen(db.engine, "before_cursor_execute", count)
+    try:
+        start = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        event.remove(db.engine, "before_cursor_execute", count)
+
+    result = {
+        "requests": requests,
+        "ok": len(timings),
+        "errors": {str(status): n for status, n in sorted(errors.items())},
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(timings) / elapsed, 2),
+    }
+    if timings:
+        timings.sort()
+        result.update(
+            {
+                f"{label}_ms": round(value * 1000, 2)
+                for label, value in (
+                    ("mean", sum(timings) / len(timings)),
+                    ("p50", percentile(timings, 0.5)),
+                    ("p95", percentile(timings, 0.95)),
+                    ("p99", percentile(timings, 0.99)),
+                    ("max", timings[-1]),
+                )
+            }
+        )
+        result["round_trips_mean"] = round(sum(round_trips) / len(round_trips), 2)
+        result["round_trips_max"] = max(round_trips)
+    return result
+
+
+def environment(conn):
+    try:
+        commit = (
+            subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"],
+                cwd=os.path.dirname(os.path.abspath(__file__)),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+            )
+            .stdout.decode()
+            .strip()
+            or None
+        )
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "database": conn.dialect.name,
+        "server_version": ".".join(
+            str(part) for part in conn.dialect.server_version_info or ()
+        ),
+    }
+
+
+def compare(baseline, results):
+    print(
+        "{:<30} {:>11} {:>11} {:>9} {:>11} {:>11} {:>9}".format(
+            "operation",
+            "rps before",
+            "rps after",
+            "change",
+            "p95 before",
+            "p95 after",
+            "change",
+        )
+    )
+    for name, result in results["operations"].items():
+        before = baseline["operations"].get(name)
+        if not before or "p95_ms" not in before or "p95_ms" not in result:
+            print(f"{name:<30} (not comparable)")
+            continue
+        print(
+            "{:<30} {:>11.1f} {:>11.1f} {:>+8.1f}% {:>8.1f} ms {:>8.1f} ms {:>+8.1f}%".format(
+                name,
+                before["throughput_rps"],
+                result["throughput_rps"],
+                (result["throughput_rps"] / before["throughput_rps"] - 1) * 100,
+                before["p95_ms"],
+                result["p95_ms"],
+                (result["p95_ms"] / before["p95_ms"] - 1) * 100,
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--locations", type=int, default=20)
+    parser.add_argument("--products", type=int, default=500)
+    parser.add_argument("--raw-materials", type=int, default=2000)
+    parser.add_argument("--bom-lines", type=int, default=10)
+    parser.add_argument(
+        "--movements", type=int, default=1000000, help="per movement table"
+    )
+    parser.add_argument("--requests", type=int, default=200, help="per operation")
+    parser.add_argument(
+        "--export-requests",
+        type=int,
+        default=10,
+        help="per export, each of which reads a whole table",
+    )
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument(
+        "--operations",
+        default=",".join(
+            name for name, (_, _, default) in OPERATIONS.items() if default
+        ),
+        help="comma separated, out of: " + ", ".join(OPERATIONS),
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tag", help="reuse the catalog of a run with --keep")
+    parser.add_argument("--keep", action="store_true", help="keep the seeded data")
+    parser.add_argument("--output", help="write the JSON here instead of stdout")
+    parser.add_argument("--compare", help="JSON of an earlier run to compare with")
+    args = parser.parse_args()
+    operations = args.operations.split(",")
+    for name in operations:
+        if name not in OPERATIONS:
+            parser.error(f"unknown operation {name}")
+    if args.bom_lines > args.raw_materials or args.locations < 2:
+        parser.error("need --bom-lines <= --raw-materials and --locations >= 2")
+
+    from view_models import register
+
+    app.config["SQLALCHEMY_ECHO"] = False
+    register(app)
+    if db.engine.dialect.name == "sqlite":
+        db.create_all()
+    tag = args.tag or f"bench-{uuid.uuid4().hex[:8]}"
+    with db.engine.begin() as conn:
+        catalog = catalog_ids(conn, tag)
+        if not catalog["location"]:
+            seed(conn, tag, args)
+            catalog = catalog_ids(conn, tag)
+        meta = environment(conn)
+    if db.engine.dialect.name == "postgresql":
+        with db.engine.connect().execution_options(
+            isolation_level="AUTOCOMMIT"
+        ) as conn:
+            conn.execute(db.text("VACUUM ANALYZE"))
+    try:
+        # one request of each first, so that no measurement pays for
+        # first-use caches and compiled templates
+        for name in operations:
+            run_operation(name, 1, 1, "warm-up", catalog)
+        results = {
+            "meta": dict(
+                meta,
+                tag=tag,
+                seed=args.seed,
+                threads=args.threads,
+                requests=args.requests,
+                export_requests=args.export_requests,
+                catalog={
+                    "locations": len(catalog["location"]),
+                    "products": len(catalog["product"]),
+                    "raw_materials": len(catalog["raw_material"]),
+                    "bom_lines": args.bom_lines,
+                    "movements": args.movements,
+                },
+            ),
+            "operations": {
+                name: run_operation(
+                    name,
+                    args.export_requests if "export" in name else args.requests,
+                    args.threads,
+                    args.seed,
+                    catalog,
+                )
+                for name in operations
+            },
+        }
+    finally:
+        if not args.keep:
+            with db.engine.begin() as conn:
+                cleanup(conn, tag)
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == "__main__":
+    main()
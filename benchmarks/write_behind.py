@@ -0,0 +1,139 @@
+"""Compare hot-item movement throughput with and without write-behind.
+
+`--threads` writers post `--movements` product movements each, all between
+the same two locations for the same product, as the admin would: every
+movement is its own transaction that also spends `--hold-ms` on the rest
+of the request after touching stock. Directly applied, each transaction
+holds the two stock row locks for that long; queued, the writers only
+insert queue rows and the queue is then drained with each `--batch-sizes`.
+The seeded data is deleted afterwards:
+
+    DATABASE_URL=postgresql://... python benchmarks/write_behind.py
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app_init import app, db  # noqa: E402
+from inventory.stock import apply_delta, move_stock  # noqa: E402
+from inventory.write_behind import (  # noqa: E402
+    drain_movement_queue,
+    enqueue_movement,
+)
+
+
+def seed(conn, tag, stock):
+    location_ids = [
+        row[0]
+        for row in conn.execute(
+            db.text(
+                "INSERT INTO location (name) SELECT :tag || '-' || i "
+                "FROM generate_series(1, 2) i RETURNING id"
+            ),
+            tag=tag,
+        )
+    ]
+    product_id = conn.execute(
+        db.text("INSERT INTO product (name, quantity) VALUES (:tag, 0) RETURNING id"),
+        tag=tag,
+    ).scalar()
+    apply_delta(conn, "product", location_ids[0], product_id, stock)
+    return location_ids, product_id
+
+
+def cleanup(conn, location_ids, product_id):
+    conn.execute(
+        db.text("DELETE FROM movement_queue WHERE kind = 'product' AND item_id = :p"),
+        p=product_id,
+    )
+    for table in ("product_stock_ledger", "product_stock"):
+        conn.execute(
+            db.text(f"DELETE FROM {table} WHERE product_id = :p"), p=product_id
+        )
+    conn.execute(db.text("DELETE FROM product WHERE id = :p"), p=product_id)
+    conn.execute(db.text("DELETE FROM location WHERE id = ANY(:l)"), l=location_ids)
+
+
+def run_writers(move, location_ids, product_id, threads, movements, hold_ms):
+    def writer():
+        for _ in range(movements):
+            with db.engine.begin() as conn:
+                shortfall = move(
+                    conn, "product", product_id, location_ids[0], location_ids[1], 1
+                )
+                assert shortfall is None, shortfall
+                conn.execute(db.text("SELECT pg_sleep(:s)"), s=hold_ms / 1000)
+
+    workers = [threading.Thread(target=writer) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--movements", type=int, default=50, help="per thread")
+    parser.add_argument("--hold-ms", type=float, default=20)
+    parser.add_argument("--batch-sizes", default="1,10,100,1000")
+    args = parser.parse_args()
+
+    app.config["SQLALCHEMY_ECHO"] = False
+    app.config["SQLALCHEMY_POOL_SIZE"] = args.threads + 1
+    total = args.threads * args.movements
+    tag = f"bench-{uuid.uuid4().hex[:8]}"
+    with db.engine.begin() as conn:
+        location_ids, product_id = seed(conn, tag, total * 10)
+    try:
+        print(
+            f"{total} movements of one product from {args.threads} writers, "
+            f"{args.hold_ms:g} ms of request work each"
+        )
+        seconds = run_writers(
+            move_stock,
+            location_ids,
+            product_id,
+            args.threads,
+            args.movements,
+            args.hold_ms,
+        )
+        print(f"{'direct':<22} {total / seconds:>10.0f} movements/s")
+        batch_sizes = [int(size) for size in args.batch_sizes.split(",")]
+        for round_number, batch_size in enumerate(batch_sizes):
+            seconds = run_writers(
+                enqueue_movement,
+                location_ids,
+                product_id,
+                args.threads,
+                args.movements,
+                args.hold_ms,
+            )
+            if not round_number:
+                print(f"{'queued (writers)':<22} {total / seconds:>10.0f} movements/s")
+            start = time.perf_counter()
+            while True:
+                with db.engine.begin() as conn:
+                    applied, rejected = drain_movement_queue(conn, batch_size)
+                assert not rejected
+                if not applied:
+                    break
+            seconds = time.perf_counter() - start
+            print(
+                f"{'drain, batch ' + str(batch_size):<22} "
+                f"{total / seconds:>10.0f} movements/s"
+            )
+    finally:
+        with db.engine.begin() as conn:
+            cleanup(conn, location_ids, product_id)
+
+
+if __name__ == "__main__":
+    main()
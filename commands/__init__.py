@@ -0,0 +1,354 @@
+import csv
+import os
+import time
+
+import click
+from app_init import db
+from inventory.bom import recompute_bom_totals
+from inventory.counts import COUNTED_TABLES, refresh_row_count
+from inventory.dashboard import DASHBOARD_VIEWS, refresh_dashboard_view
+from inventory.ledger import SNAPSHOT_TABLES, take_snapshot
+from inventory.partitions import (
+    PARTITIONED_TABLES,
+    create_monthly_partitions,
+    is_partitioned,
+)
+from inventory.reconciliation import (
+    last_cutoff,
+    reconcile_stock,
+    record_reconciliation,
+    touched_keys,
+)
+from inventory.rollups import ROLLUP_TABLES, compact_rollups, rebuild_rollups
+from inventory.stock import (
+    STOCK_TABLES,
+    fold_stock_shards,
+    set_stock_shards,
+    sharded_stock_keys,
+)
+from inventory.transactions import run_transaction
+from inventory.write_behind import drain_movement_queue, queue_stats
+
+
+def register(app):
+    @app.cli.command("snapshot-stock")
+    @click.option(
+        "--lag-minutes",
+        default=10,
+        show_default=True,
+        help="How far behind the current time the snapshot is cut; must exceed "
+        "the longest stock transaction.",
+    )
+    def snapshot_stock(lag_minutes):
+        """Fold the stock ledgers into a new snapshot run.
+
+        Run this periodically (e.g. hourly or nightly) to keep point-in-time
+        balance queries fast.
+        """
+        with db.engine.begin() as conn:
+            cutoff = conn.execute(
+                db.text("SELECT CAST(now() - make_interval(mins => :m) AS timestamp)"),
+                m=lag_minutes,
+            ).scalar()
+            for kind in SNAPSHOT_TABLES:
+                written = take_snapshot(conn, kind, cutoff)
+                click.echo(f"{kind}: {written} snapshot rows up to {cutoff}")
+
+    @app.cli.command("create-movement-partitions")
+    @click.option(
+        "--months-ahead",
+        default=3,
+        show_default=True,
+        help="How many months past the current one to create partitions for.",
+    )
+    def create_movement_partitions(months_ahead):
+        """Create the upcoming monthly partitions of the movement tables.
+
+        Only applies once the movement tables have been partitioned by the
+        optional partitioning migration. Run it at least monthly so new
+        movements never land in the DEFAULT partition.
+        """
+        with db.engine.begin() as conn:
+            for table in PARTITIONED_TABLES:
+                if not is_partitioned(conn, table):
+                    click.echo(f"{table}: not partitioned, skipped")
+                    continue
+                first_month = conn.execute(db.text("SELECT current_date")).scalar()
+                created = create_monthly_partitions(
+                    conn, table, first_month, months_ahead + 1
+                )
+                click.echo(f"{table}: created {', '.join(created) or 'nothing'}")
+
+    @app.cli.command("refresh-row-counts")
+    def refresh_row_counts():
+        """Recount the movement tables and reset their cached row counts.
+
+        Only needed after movements were inserted or deleted outside the
+        application. Briefly blocks movement writes while each table is
+        counted.
+        """
+        for table in COUNTED_TABLES:
+            with db.engine.begin() as conn:
+                count = refresh_row_count(conn, table)
+            click.echo(f"{table}: {count} rows")
+
+    @app.cli.command("recompute-bom-totals")
+    def recompute_bom_totals_command():
+        """Recompute the quantity of every product from its bill of
+        materials in one pass.
+
+        Run it after importing ProductRawMaterial rows in bulk outside the
+        admin; it also invalidates every cached bill of materials.
+        """
+        with db.engine.begin() as conn:
+            changed = recompute_bom_totals(conn)
+        click.echo(f"{changed} product quantities changed")
+
+    @app.cli.command("drain-movement-queue")
+    @click.option(
+        "--batch-size",
+        default=1000,
+        show_default=True,
+        help="Queue rows applied per transaction.",
+    )
+    @click.option(
+        "--interval",
+        default=1.0,
+        show_default=True,
+        help="Seconds to wait when the queue is empty.",
+    )
+    @click.option("--once", is_flag=True, help="Stop once the queue is empty.")
+    def drain_movement_queue_command(batch_size, interval, once):
+        """Apply the stock changes of queued movements in batches.
+
+        Runs as the worker for MOVEMENT_WRITE_BEHIND; several may run at
+        once. A batch is applied and removed from the queue in one
+        transaction, so a stopped worker resumes where it left off.
+        """
+        while True:
+            applied, rejected = run_transaction(
+                lambda conn: drain_movement_queue(conn, batch_size)
+            )
+            if applied or rejected:
+                click.echo(f"{applied} applied, {rejected} rejected")
+            elif once:
+                break
+            else:
+                time.sleep(interval)
+
+    @app.cli.command("movement-queue-status")
+    def movement_queue_status():
+        """Show the movement queue's pending and rejected rows and lag."""
+        with db.engine.connect() as conn:
+            stats = queue_stats(conn)
+        click.echo(
+            "{pending} pending, {rejected} rejected, lag {lag_seconds:.1f} s".format(
+                **stats
+            )
+        )
+
+    @app.cli.command("shard-stock")
+    @click.argument("kind", type=click.Choice(sorted(STOCK_TABLES)))
+    @click.argument("location_id", type=int)
+    @click.argument("item_id", type=int)
+    @click.option(
+        "--shards",
+        default=8,
+        show_default=True,
+        help="Sub-rows to spread the stock over; 0 folds it back into one row.",
+    )
+    def shard_stock(kind, location_id, item_id, shards):
+        """Spread the stock row of a high-contention item over shards, so
+        concurrent movements of it stop queueing on one row lock."""
+        with db.engine.begin() as conn:
+            set_stock_shards(conn, kind, location_id, item_id, shards)
+        click.echo(f"{kind} {item_id} at location {location_id}: {shards} shards")
+
+    @app.cli.command("fold-stock-shards")
+    @click.option(
+        "--batch-size",
+        default=100,
+        show_default=True,
+        help="Stock rows folded per transaction.",
+    )
+    def fold_stock_shards_command(batch_size):
+        """Fold the shards of every sharded stock row together and spread
+        them evenly again.
+
+        Run it periodically (e.g. every few minutes): outflows no single
+        shard can cover lock the whole row, and manufacturing and batched
+        writes fold the shards of the rows they touch into the row itself.
+        """
+        for kind in sorted(STOCK_TABLES):
+            with db.engine.connect() as conn:
+                keys = sharded_stock_keys(conn, kind)
+            for start in range(0, len(keys), batch_size):
+                with db.engine.begin() as conn:
+                    fold_stock_shards(conn, kind, keys[start : start + batch_size])
+            click.echo(f"{kind}: {len(keys)} stock rows folded")
+
+    @app.cli.command("reconcile-stock")
+    @click.option(
+        "--kind",
+        "kinds",
+        type=click.Choice(sorted(STOCK_TABLES)),
+        multiple=True,
+        help="Kind of stock to reconcile; repeat for several. Default: all.",
+    )
+    @click.option(
+        "--full",
+        is_flag=True,
+        help="Compare every item at every location, not only those written "
+        "since the last run.",
+    )
+    @click.option("--repair", is_flag=True, help="Correct the stock rows that differ.")
+    @click.option(
+        "--workers",
+        default=os.cpu_count() or 4,
+        show_default=True,
+        help="Processes the locations are spread over.",
+    )
+    @click.option(
+        "--lag-minutes",
+        default=10,
+        show_default=True,
+        help="How far behind the current time the next run starts; must exceed "
+        "the longest stock transaction.",
+    )
+    @click.option(
+        "--report",
+        type=click.Path(dir_okay=False, writable=True),
+        help="CSV file the differences are written to. "
+        "Default: stock-reconciliation-<time>.csv",
+    )
+    def reconcile_stock_command(kinds, full, repair, workers, lag_minutes, report):
+        """Recompute stock balances from the movements and manufacturing
+        runs and report the stock rows that differ.
+
+        Without --full only the items whose stock or movements were written
+        since the last run are compared, so nightly runs stay short; the
+        first run of each kind is always full. Queued write-behind
+        movements are not counted until the worker applies them. Repairs
+        are recorded in the stock ledger.
+        """
+        report = report or time.strftime("stock-reconciliation-%Y%m%dT%H%M%S.csv")
+        with open(report, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(
+                [
+                    "kind",
+                    "location_id",
+                    "item_id",
+                    "expected",
+                    "actual",
+                    "difference",
+                    "repaired",
+                ]
+            )
+            for kind in kinds or sorted(STOCK_TABLES):
+                with db.engine.connect() as conn:
+                    cutoff = conn.execute(
+                        db.text(
+                            "SELECT CAST(now() - make_interval(mins => :m) AS timestamp)"
+                        ),
+                        m=lag_minutes,
+                    ).scalar()
+                    since = None if full else last_cutoff(conn, kind)
+                    if since is None:
+                        keys = None
+                        location_ids = [
+                            row[0]
+                            for row in conn.execute(db.text("SELECT id FROM location"))
+                        ]
+                    else:
+                        keys = touched_keys(conn, kind, since)
+                        location_ids = sorted({key[0] for key in keys})
+                checked = differences = repaired = 0
+                for chunk_checked, chunk_differences, chunk_repaired in reconcile_stock(
+                    kind, location_ids, keys, repair, workers
+                ):
+                    repaired_keys = {row[:2] for row in chunk_repaired}
+                    for location_id, item_id, expected, actual in chunk_differences:
+                        writer.writerow(
+                            [
+                                kind,
+                                location_id,
+                                item_id,
+                                expected,
+                                actual,
+                                expected - (actual or 0),
+                                (location_id, item_id) in repaired_keys,
+                            ]
+                        )
+                    checked += chunk_checked
+                    differences += len(chunk_differences)
+                    repaired += len(chunk_repaired)
+                with db.engine.begin() as conn:
+                    record_reconciliation(
+                        conn,
+                        kind,
+                        cutoff,
+                        since is None,
+                        checked,
+                        differences,
+                        repaired,
+                    )
+                click.echo(
+                    f"{kind}: {checked} stock rows compared"
+                    + (f" since {since}" if since is not None else "")
+                    + f", {differences} differ, {repaired} repaired"
+                )
+        click.echo(f"report written to {report}")
+
+    @app.cli.command("compact-movement-rollups")
+    def compact_movement_rollups():
+        """Fold the shard rows of the daily movement rollups together.
+
+        Run it periodically (e.g. hourly or nightly): every movement
+        statement adds to a random shard row of its day, location and item,
+        which the reports sum over.
+        """
+        for kind in sorted(ROLLUP_TABLES):
+            with db.engine.begin() as conn:
+                folded = compact_rollups(conn, kind)
+            click.echo(f"{kind}: {folded} rollup rows folded")
+
+    @app.cli.command("rebuild-movement-rollups")
+    @click.argument("first_day", type=click.DateTime(formats=["%Y-%m-%d"]))
+    @click.argument("last_day", type=click.DateTime(formats=["%Y-%m-%d"]))
+    def rebuild_movement_rollups(first_day, last_day):
+        """Recompute the daily movement rollups of FIRST_DAY to LAST_DAY
+        from the movements.
+
+        Only needed after movements were written with the rollup triggers
+        disabled. New movements of each kind wait while its rollups are
+        rebuilt.
+        """
+        for kind in sorted(ROLLUP_TABLES):
+            with db.engine.begin() as conn:
+                written = rebuild_rollups(conn, kind, first_day.date(), last_day.date())
+            click.echo(f"{kind}: {written} rollup rows written")
+
+    @app.cli.command("refresh-dashboard")
+    @click.option(
+        "--interval",
+        default=0,
+        show_default=True,
+        help="Seconds between refreshes; 0 refreshes once.",
+    )
+    def refresh_dashboard(interval):
+        """Refresh the views the admin index page is read from.
+
+        Run it on a schedule (e.g. every few minutes from cron or the Heroku
+        scheduler), or as a worker with --interval. The page keeps showing
+        the previous figures while a refresh runs.
+        """
+        while True:
+            start = time.monotonic()
+            for view in DASHBOARD_VIEWS:
+                with db.engine.begin() as conn:
+                    refresh_dashboard_view(conn, view)
+            click.echo(f"dashboard refreshed in {time.monotonic() - start:.1f}s")
+            if not interval:
+                break
+            time.sleep(interval)
@@ -1,4 +1,14 @@
 from app_init import db
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.elements import CollationClause
+
+
+@compiles(CollationClause, "sqlite")
+def compile_sqlite_collation(element, compiler, **kw):
+    # SQLite, as in tests, has no "C" collation; BINARY orders the same way
+    if element.collation == "C":
+        return "BINARY"
+    return compiler.visit_collation(element, **kw)
 
 
 class RawMaterial(db.Model):
@@ -9,6 +19,12 @@ class RawMaterial(db.Model):
     time_updated = db.Column(
         db.TIMESTAMP, onupdate=db.func.now(), server_default=db.func.now()
     )
+    # prefix lookups of the admin forms, see view_models.lookups
+    __table_args__ = (
+        db.Index(
+            "raw_material_name_prefix_index", db.func.lower(name).collate("C"), id
+        ),
+    )
 
     def __str__(self):
         return "{}".format(self.name)
@@ -22,10 +38,15 @@ class Product(db.Model):
     name = db.Column(db.String(100), unique=True, nullable=False)
     description = db.Column(db.TEXT)
     quantity = db.Column(db.Integer(), nullable=False)
+    bom_version = db.Column(db.Integer(), nullable=False, server_default="0")
     time_created = db.Column(db.TIMESTAMP, server_default=db.func.now())
     time_updated = db.Column(
         db.TIMESTAMP, onupdate=db.func.now(), server_default=db.func.now()
     )
+    # prefix lookups of the admin forms, see view_models.lookups
+    __table_args__ = (
+        db.Index("product_name_prefix_index", db.func.lower(name).collate("C"), id),
+    )
 
     def __str__(self):
         return "{}".format(self.name)
@@ -65,6 +86,10 @@ class Location(db.Model):
     time_updated = db.Column(
         db.TIMESTAMP, onupdate=db.func.now(), server_default=db.func.now()
     )
+    # prefix lookups of the admin forms, see view_models.lookups
+    __table_args__ = (
+        db.Index("location_name_prefix_index", db.func.lower(name).collate("C"), id),
+    )
 
     def __str__(self):
         return "{}".format(self.name)
@@ -87,6 +112,9 @@ class ProductManufacturing(db.Model):
     time_updated = db.Column(
         db.TIMESTAMP, onupdate=db.func.now(), server_default=db.func.now()
     )
+    __table_args__ = (
+        db.Index("product_manufacturing_time_created_index", "time_created"),
+    )
 
     def __str__(self):
         return "{}".format(self.id)
@@ -108,6 +136,26 @@ class ProductMovement(db.Model):
         db.TIMESTAMP, onupdate=db.func.now(), server_default=db.func.now()
     )
 
+    __table_args__ = (
+        db.Index(
+            "product_movement_product_id_movement_date_index",
+            "product_id",
+            "movement_date",
+        ),
+        db.Index(
+            "product_movement_from_location_id_product_id_index",
+            "from_location_id",
+            "product_id",
+        ),
+        db.Index(
+            "product_movement_to_location_id_product_id_index",
+            "to_location_id",
+            "product_id",
+        ),
+        db.Index("product_movement_movement_date_id_index", "movement_date", "id"),
+        db.Index("product_movement_time_created_index", "time_created"),
+    )
+
     def __str__(self):
         return "{}".format(self.id)
 
@@ -130,6 +178,26 @@ class RawMaterialMovement(db.Model):
         db.TIMESTAMP, onupdate=db.func.now(), server_default=db.func.now()
     )
 
+    __table_args__ = (
+        db.Index(
+            "raw_material_movement_raw_material_id_movement_date_index",
+            "raw_material_id",
+            "movement_date",
+        ),
+        db.Index(
+            "raw_material_movement_from_location_id_raw_material_id_index",
+            "from_location_id",
+            "raw_material_id",
+        ),
+        db.Index(
+            "raw_material_movement_to_location_id_raw_material_id_index",
+            "to_location_id",
+            "raw_material_id",
+        ),
+        db.Index("raw_material_movement_movement_date_id_index", "movement_date", "id"),
+        db.Index("raw_material_movement_time_created_index", "time_created"),
+    )
+
     def __str__(self):
         return "{}".format(self.id)
 
@@ -141,16 +209,23 @@ class ProductStock(db.Model):
     available_stock = db.Column(
         db.Integer, db.CheckConstraint("available_stock>=0"), nullable=False
     )
+    shards = db.Column(db.SmallInteger, nullable=False, server_default="0")
     location = db.relationship(Location, foreign_keys=[location_id])
     product = db.relationship(Product, foreign_keys=[product_id])
     time_created = db.Column(db.TIMESTAMP, server_default=db.func.now())
     time_updated = db.Column(
         db.TIMESTAMP, onupdate=db.func.now(), server_default=db.func.now()
     )
-    db.UniqueConstraint(
-        "location_id",
-        "product_id",
-        name="raw_material_stock_location_id_raw_material_id_uindex",
+    __table_args__ = (
+        db.UniqueConstraint(
+            "location_id",
+            "product_id",
+            name="product_stock_location_id_product_id_uindex",
+        ),
+        db.Index(
+            "product_stock_product_id_location_id_index", "product_id", "location_id"
+        ),
+        db.Index("product_stock_time_created_index", "time_created"),
     )
 
 
@@ -161,14 +236,308 @@ class RawMaterialStock(db.Model):
     available_stock = db.Column(
         db.Integer, db.CheckConstraint("available_stock>=0"), nullable=False
     )
+    shards = db.Column(db.SmallInteger, nullable=False, server_default="0")
+    location = db.relationship(Location, foreign_keys=[location_id])
+    raw_material = db.relationship(RawMaterial, foreign_keys=[raw_material_id])
+    time_created = db.Column(db.TIMESTAMP, server_default=db.func.now())
+    time_updated = db.Column(
+        db.TIMESTAMP, onupdate=db.func.now(), server_default=db.func.now()
+    )
+    __table_args__ = (
+        db.UniqueConstraint(
+            "location_id",
+            "raw_material_id",
+            name="raw_material_stock_location_id_raw_material_id_uindex",
+        ),
+        db.Index(
+            "raw_material_stock_raw_material_id_location_id_index",
+            "raw_material_id",
+            "location_id",
+        ),
+        db.Index("raw_material_stock_time_created_index", "time_created"),
+    )
+
+
+class ProductStockShard(db.Model):
+    location_id = db.Column(
+        db.Integer, db.ForeignKey(Location.id), primary_key=True, autoincrement=False
+    )
+    product_id = db.Column(
+        db.Integer, db.ForeignKey(Product.id), primary_key=True, autoincrement=False
+    )
+    shard = db.Column(db.SmallInteger, primary_key=True, autoincrement=False)
+    available_stock = db.Column(
+        db.Integer, db.CheckConstraint("available_stock>=0"), nullable=False
+    )
+    time_updated = db.Column(
+        db.TIMESTAMP, onupdate=db.func.now(), server_default=db.func.now()
+    )
+
+
+class RawMaterialStockShard(db.Model):
+    location_id = db.Column(
+        db.Integer, db.ForeignKey(Location.id), primary_key=True, autoincrement=False
+    )
+    raw_material_id = db.Column(
+        db.Integer,
+        db.ForeignKey(RawMaterial.id),
+        primary_key=True,
+        autoincrement=False,
+    )
+    shard = db.Column(db.SmallInteger, primary_key=True, autoincrement=False)
+    available_stock = db.Column(
+        db.Integer, db.CheckConstraint("available_stock>=0"), nullable=False
+    )
+    time_updated = db.Column(
+        db.TIMESTAMP, onupdate=db.func.now(), server_default=db.func.now()
+    )
+
+
+# stock of a stock row including what its shards hold, on top of its own
+# available_stock
+ProductStock.total_stock = db.column_property(
+    ProductStock.available_stock
+    + db.select([db.func.coalesce(db.func.sum(ProductStockShard.available_stock), 0)])
+    .where(ProductStockShard.location_id == ProductStock.location_id)
+    .where(ProductStockShard.product_id == ProductStock.product_id)
+    .correlate_except(ProductStockShard)
+    .as_scalar()
+)
+RawMaterialStock.total_stock = db.column_property(
+    RawMaterialStock.available_stock
+    + db.select(
+        [db.func.coalesce(db.func.sum(RawMaterialStockShard.available_stock), 0)]
+    )
+    .where(RawMaterialStockShard.location_id == RawMaterialStock.location_id)
+    .where(RawMaterialStockShard.raw_material_id == RawMaterialStock.raw_material_id)
+    .correlate_except(RawMaterialStockShard)
+    .as_scalar()
+)
+
+
+class ProductStockLedger(db.Model):
+    id = db.Column(db.BigInteger, primary_key=True)
+    location_id = db.Column(db.Integer, db.ForeignKey(Location.id), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey(Product.id), nullable=False)
+    delta = db.Column(db.Integer, nullable=False)
+    balance = db.Column(db.Integer, nullable=False)
+    source = db.Column(db.String(50))
+    source_id = db.Column(db.Integer)
+    location = db.relationship(Location, foreign_keys=[location_id])
+    product = db.relationship(Product, foreign_keys=[product_id])
+    time_created = db.Column(db.TIMESTAMP, server_default=db.func.now(), nullable=False)
+    __table_args__ = (
+        db.Index(
+            "product_stock_ledger_location_item_time_index",
+            "location_id",
+            "product_id",
+            "time_created",
+        ),
+        db.Index("product_stock_ledger_time_created_index", "time_created"),
+    )
+
+
+class RawMaterialStockLedger(db.Model):
+    id = db.Column(db.BigInteger, primary_key=True)
+    location_id = db.Column(db.Integer, db.ForeignKey(Location.id), nullable=False)
+    raw_material_id = db.Column(
+        db.Integer, db.ForeignKey(RawMaterial.id), nullable=False
+    )
+    delta = db.Column(db.Integer, nullable=False)
+    balance = db.Column(db.Integer, nullable=False)
+    source = db.Column(db.String(50))
+    source_id = db.Column(db.Integer)
+    location = db.relationship(Location, foreign_keys=[location_id])
+    raw_material = db.relationship(RawMaterial, foreign_keys=[raw_material_id])
+    time_created = db.Column(db.TIMESTAMP, server_default=db.func.now(), nullable=False)
+    __table_args__ = (
+        db.Index(
+            "raw_material_stock_ledger_location_item_time_index",
+            "location_id",
+            "raw_material_id",
+            "time_created",
+        ),
+        db.Index("raw_material_stock_ledger_time_created_index", "time_created"),
+    )
+
+
+class ProductStockSnapshot(db.Model):
+    id = db.Column(db.BigInteger, primary_key=True)
+    location_id = db.Column(db.Integer, db.ForeignKey(Location.id), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey(Product.id), nullable=False)
+    balance = db.Column(db.Integer, nullable=False)
+    snapshot_time = db.Column(db.TIMESTAMP, nullable=False)
+    location = db.relationship(Location, foreign_keys=[location_id])
+    product = db.relationship(Product, foreign_keys=[product_id])
+    __table_args__ = (
+        db.Index(
+            "product_stock_snapshot_location_item_time_index",
+            "location_id",
+            "product_id",
+            "snapshot_time",
+        ),
+        db.Index("product_stock_snapshot_snapshot_time_index", "snapshot_time"),
+    )
+
+
+class RawMaterialStockSnapshot(db.Model):
+    id = db.Column(db.BigInteger, primary_key=True)
+    location_id = db.Column(db.Integer, db.ForeignKey(Location.id), nullable=False)
+    raw_material_id = db.Column(
+        db.Integer, db.ForeignKey(RawMaterial.id), nullable=False
+    )
+    balance = db.Column(db.Integer, nullable=False)
+    snapshot_time = db.Column(db.TIMESTAMP, nullable=False)
     location = db.relationship(Location, foreign_keys=[location_id])
     raw_material = db.relationship(RawMaterial, foreign_keys=[raw_material_id])
+    __table_args__ = (
+        db.Index(
+            "raw_material_stock_snapshot_location_item_time_index",
+            "location_id",
+            "raw_material_id",
+            "snapshot_time",
+        ),
+        db.Index("raw_material_stock_snapshot_snapshot_time_index", "snapshot_time"),
+    )
+
+
+class RowCount(db.Model):
+    table_name = db.Column(db.String(63), primary_key=True)
+    shard = db.Column(db.SmallInteger, primary_key=True, autoincrement=False)
+    row_count = db.Column(db.BigInteger, nullable=False, server_default="0")
+    time_updated = db.Column(
+        db.TIMESTAMP, onupdate=db.func.now(), server_default=db.func.now()
+    )
+
+
+class MovementQueue(db.Model):
+    id = db.Column(db.BigInteger, primary_key=True)
+    kind = db.Column(db.String(16), nullable=False)
+    item_id = db.Column(db.Integer, nullable=False)
+    from_location_id = db.Column(db.Integer, db.ForeignKey(Location.id))
+    to_location_id = db.Column(db.Integer, db.ForeignKey(Location.id))
+    qty = db.Column(db.Integer, nullable=False)
+    source = db.Column(db.String(50))
+    source_id = db.Column(db.Integer)
+    # written by the creation of the source movement, not by an edit of it
+    creates_source = db.Column(db.Boolean, nullable=False, server_default=db.false())
+    status = db.Column(db.String(16), nullable=False, server_default="pending")
+    error = db.Column(db.TEXT)
+    from_location = db.relationship(Location, foreign_keys=[from_location_id])
+    to_location = db.relationship(Location, foreign_keys=[to_location_id])
+    time_created = db.Column(db.TIMESTAMP, server_default=db.func.now(), nullable=False)
+    time_updated = db.Column(
+        db.TIMESTAMP, onupdate=db.func.now(), server_default=db.func.now()
+    )
+    __table_args__ = (
+        db.Index(
+            "movement_queue_pending_index",
+            "id",
+            postgresql_where=db.text("status = 'pending'"),
+        ),
+        db.Index(
+            "movement_queue_pending_item_index",
+            "kind",
+            "item_id",
+            postgresql_where=db.text("status = 'pending'"),
+        ),
+    )
+
+
+class StockReconciliation(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(16), nullable=False)
+    cutoff = db.Column(db.TIMESTAMP, nullable=False)
+    full_run = db.Column(db.Boolean, nullable=False)
+    pairs_checked = db.Column(db.Integer, nullable=False)
+    differences = db.Column(db.Integer, nullable=False)
+    repaired = db.Column(db.Integer, nullable=False)
+    time_created = db.Column(db.TIMESTAMP, server_default=db.func.now(), nullable=False)
+    __table_args__ = (
+        db.Index("stock_reconciliation_kind_cutoff_index", "kind", "cutoff"),
+    )
+
+
+class ProductMovementDaily(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    location_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    product_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    shard = db.Column(db.SmallInteger, primary_key=True, autoincrement=False)
+    inflow = db.Column(db.BigInteger, nullable=False)
+    outflow = db.Column(db.BigInteger, nullable=False)
+    __table_args__ = (
+        db.Index("product_movement_daily_location_id_day_index", "location_id", "day"),
+        db.Index(
+            "product_movement_daily_unfolded_index",
+            "day",
+            postgresql_where=db.text("shard <> 0"),
+        ),
+    )
+
+
+class RawMaterialMovementDaily(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    location_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    raw_material_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    shard = db.Column(db.SmallInteger, primary_key=True, autoincrement=False)
+    inflow = db.Column(db.BigInteger, nullable=False)
+    outflow = db.Column(db.BigInteger, nullable=False)
+    __table_args__ = (
+        db.Index(
+            "raw_material_movement_daily_location_id_day_index", "location_id", "day"
+        ),
+        db.Index(
+            "raw_material_movement_daily_unfolded_index",
+            "day",
+            postgresql_where=db.text("shard <> 0"),
+        ),
+    )
+
+
+class TransferOrder(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    from_location_id = db.Column(
+        db.Integer(), db.ForeignKey(Location.id), nullable=False
+    )
+    to_location_id = db.Column(db.Integer(), db.ForeignKey(Location.id), nullable=False)
+    description = db.Column(db.TEXT)
+    from_location = db.relationship(Location, foreign_keys=[from_location_id])
+    to_location = db.relationship(Location, foreign_keys=[to_location_id])
+    lines = db.relationship(
+        "TransferOrderLine",
+        back_populates="transfer_order",
+        cascade="all, delete-orphan",
+        order_by="TransferOrderLine.id",
+    )
+    posted_at = db.Column(db.TIMESTAMP)
     time_created = db.Column(db.TIMESTAMP, server_default=db.func.now())
     time_updated = db.Column(
         db.TIMESTAMP, onupdate=db.func.now(), server_default=db.func.now()
     )
-    db.UniqueConstraint(
-        "location_id",
-        "raw_material_id",
-        name="raw_material_stock_location_id_raw_material_id_uindex",
+    __table_args__ = (db.CheckConstraint("from_location_id <> to_location_id"),)
+
+    def __str__(self):
+        return "{}".format(self.id)
+
+
+class TransferOrderLine(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    transfer_order_id = db.Column(
+        db.Integer(),
+        db.ForeignKey(TransferOrder.id, ondelete="CASCADE"),
+        nullable=False,
+    )
+    product_id = db.Column(db.Integer(), db.ForeignKey(Product.id))
+    raw_material_id = db.Column(db.Integer(), db.ForeignKey(RawMaterial.id))
+    qty = db.Column(db.Integer(), db.CheckConstraint("qty > 0"), nullable=False)
+    transfer_order = db.relationship(TransferOrder, back_populates="lines")
+    product = db.relationship(Product, foreign_keys=[product_id])
+    raw_material = db.relationship(RawMaterial, foreign_keys=[raw_material_id])
+    __table_args__ = (
+        # a line moves either a product or a raw material
+        db.CheckConstraint("(product_id IS NULL) <> (raw_material_id IS NULL)"),
+        db.Index("transfer_order_line_transfer_order_id_index", "transfer_order_id"),
     )
+
+    def __str__(self):
+        return "{} x {}".format(self.qty, self.product or self.raw_material)
@@ -0,0 +1,54 @@
+import gc
+import os
+
+# Load the app, the admin views and their templates once in the master and
+# fork the workers from it, so they start at once and share its memory
+# instead of each importing everything again. GUNICORN_PRELOAD=false goes
+# back to every worker loading the app itself, e.g. for --reload.
+preload_app = os.environ.get("GUNICORN_PRELOAD", "true").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+
+
+def when_ready(server):
+    if preload_app:
+        # objects loaded so far are kept out of the collector, whose passes
+        # would otherwise write to (and so copy) every page they are on
+        gc.freeze()
+
+
+def pre_fork(server, worker):
+    if preload_app:
+        from app_init import db
+
+        # a worker must not inherit the master's connections: a socket used
+        # by two processes mixes up their statements. Workers that do get
+        # one anyway drop it on checkout (see instrumentation.pool).
+        db.engine.dispose()
+
+
+def on_starting(server):
+    directory = os.environ.get("METRICS_DIR")
+    if directory and os.path.isdir(directory):
+        # the files of a previous run's workers would be added to this one's
+        for entry in os.listdir(directory):
+            if entry.endswith(".json"):
+                os.remove(os.path.join(directory, entry))
+
+
+def worker_exit(server, worker):
+    from app_init import request_metrics
+
+    # keep the requests served since the last write
+    if request_metrics.directory:
+        request_metrics.dump()
+
+
+def child_exit(server, worker):
+    directory = os.environ.get("METRICS_DIR")
+    if directory:
+        from instrumentation.metrics import mark_process_dead
+
+        mark_process_dead(directory, worker.pid)
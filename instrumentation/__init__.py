@@ -0,0 +1,2 @@
+from instrumentation.pool import InstrumentedQueuePool, pool_stats
+from instrumentation.requests import RequestMetrics
@@ -0,0 +1,190 @@
+import bisect
+import json
+import os
+import threading
+
+# seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter(object):
+    """Running total per combination of label values."""
+
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), value=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            yield self.name, dict(zip(self.labelnames, labels)), value
+
+
+class Histogram(object):
+    """Observations counted into cumulative buckets per combination of label
+    values, with their sum and count."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        # one slot per bucket, one for +Inf, then the sum
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            series[bucket] += 1
+            series[-1] += value
+
+    def samples(self):
+        with self._lock:
+            series = sorted((labels, list(s)) for labels, s in self._series.items())
+        for labels, counts in series:
+            labels = dict(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                yield self.name + "_bucket", dict(labels, le=str(bound)), cumulative
+            yield self.name + "_sum", labels, counts[-1]
+            yield self.name + "_count", labels, cumulative
+
+
+class Value(object):
+    """A single unlabelled value read when the metrics are rendered."""
+
+    def __init__(self, name, kind, help, value):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.value = value
+
+    def samples(self):
+        if self.value is not None:
+            yield self.name, {}, self.value
+
+
+class Samples(object):
+    """A metric rebuilt from samples, such as those merged() adds up."""
+
+    def __init__(self, name, kind, help, samples):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self._samples = samples
+
+    def samples(self):
+        return iter(self._samples)
+
+
+def _dump_path(directory, pid):
+    return os.path.join(directory, f"{pid}.json")
+
+
+def dump(metrics, directory):
+    """Write the current samples of this process's `metrics` to its file in
+    `directory`, for merged() in whichever process is scraped."""
+    data = [
+        {
+            "name": metric.name,
+            "kind": metric.kind,
+            "help": metric.help,
+            "samples": list(metric.samples()),
+        }
+        for metric in metrics
+    ]
+    path = _dump_path(directory, os.getpid())
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(data, f)
+    # readers see the old file or the new one, never part of one
+    os.replace(f"{path}.tmp", path)
+
+
+def _load(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        # removed since it was listed
+        return []
+
+
+def mark_process_dead(directory, pid):
+    """Drop the gauges of a process that exited from its file. Its counters
+    and histograms stay, so that the totals never go down."""
+    path = _dump_path(directory, pid)
+    data = [metric for metric in _load(path) if metric["kind"] != "gauge"]
+    if data:
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(data, f)
+        os.replace(f"{path}.tmp", path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def merged(directory):
+    """The metrics every process dumped to `directory`, with the samples of
+    the same name and labels added up."""
+    metrics = {}
+    for entry in sorted(os.listdir(directory)):
+        if not entry.endswith(".json"):
+            continue
+        for metric in _load(os.path.join(directory, entry)):
+            _, _, totals = metrics.setdefault(
+                metric["name"], (metric["kind"], metric["help"], {})
+            )
+            for name, labels, value in metric["samples"]:
+                key = (name, tuple(labels.items()))
+                totals[key] = totals.get(key, 0) + value
+    return [
+        Samples(
+            name,
+            kind,
+            help,
+            [
+                (sample, dict(labels), value)
+                for (sample, labels), value in totals.items()
+            ],
+        )
+        for name, (kind, help, totals) in metrics.items()
+    ]
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render(metrics, labels=None):
+    """The metrics in the Prometheus text exposition format, with `labels`
+    added to every sample."""
+    lines = []
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, sample_labels, value in metric.samples():
+            if labels:
+                sample_labels = dict(sample_labels, **labels)
+            if sample_labels:
+                name += "{%s}" % ",".join(
+                    f'{key}="{_escape(str(label))}"'
+                    for key, label in sample_labels.items()
+                )
+            lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,114 @@
+import os
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+
+class PoolStats(object):
+    """Running totals of connection checkouts for one pool."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.overflow_opened = 0
+        self.timeouts = 0
+
+    def record_checkout(self, seconds):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+
+    def record_overflow(self):
+        with self._lock:
+            self.overflow_opened += 1
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a
+    connection, how many overflow connections were opened and how many
+    checkouts timed out."""
+
+    def __init__(self, *args, **kw):
+        super().__init__(*args, **kw)
+        self.stats = PoolStats()
+        self._timing = threading.local()
+
+    def _do_get(self):
+        # QueuePool._do_get retries by calling itself; time the outer call only
+        if getattr(self._timing, "active", False):
+            return super()._do_get()
+        self._timing.active = True
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except exc.TimeoutError:
+            self.stats.record_timeout()
+            raise
+        finally:
+            self._timing.active = False
+        self.stats.record_checkout(time.perf_counter() - start)
+        return conn
+
+    def _inc_overflow(self):
+        opened = super()._inc_overflow()
+        if opened and self._overflow > 0:
+            self.stats.record_overflow()
+        return opened
+
+    def recreate(self):
+        # engine.dispose() swaps in a new pool; keep counting into the same
+        # totals
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+@event.listens_for(InstrumentedQueuePool, "connect")
+def _remember_pid(dbapi_connection, connection_record):
+    connection_record.info["pid"] = os.getpid()
+
+
+@event.listens_for(InstrumentedQueuePool, "checkout")
+def _check_pid(dbapi_connection, connection_record, connection_proxy):
+    # a connection a forked process inherited is still the parent's socket;
+    # drop it without closing it (which would end the parent's session) and
+    # let the pool open a new one
+    pid = os.getpid()
+    if connection_record.info["pid"] != pid:
+        connection_record.connection = connection_proxy.connection = None
+        raise exc.DisconnectionError(
+            "Connection record belongs to pid %s, attempting to check out in pid %s"
+            % (connection_record.info["pid"], pid)
+        )
+
+
+def pool_stats(engine):
+    """Return the occupancy and checkout totals of an engine's pool."""
+    pool = engine.pool
+    stats = {
+        "pool_class": type(pool).__name__,
+        "size": pool.size() if hasattr(pool, "size") else None,
+        "checked_out": pool.checkedout() if hasattr(pool, "checkedout") else None,
+        "checked_in": pool.checkedin() if hasattr(pool, "checkedin") else None,
+        "overflow": pool.overflow() if hasattr(pool, "overflow") else None,
+        "max_overflow": getattr(pool, "_max_overflow", None),
+    }
+    if isinstance(pool, InstrumentedQueuePool):
+        with pool.stats._lock:
+            stats.update(
+                checkouts=pool.stats.checkouts,
+                wait_seconds_total=pool.stats.wait_seconds_total,
+                wait_seconds_max=pool.stats.wait_seconds_max,
+                overflow_opened=pool.stats.overflow_opened,
+                timeouts=pool.stats.timeouts,
+            )
+    return stats
@@ -0,0 +1,264 @@
+import os
+import threading
+import time
+
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from instrumentation.metrics import Counter, Histogram, dump
+
+# endpoint names of the admin views -> action label
+ADMIN_ACTIONS = {
+    "index_view": "list",
+    "create_view": "create",
+    "edit_view": "edit",
+    "ajax_update": "edit",
+    "details_view": "details",
+    "delete_view": "delete",
+    "action_view": "action",
+    "export": "export",
+    "ajax_lookup": "lookup",
+}
+
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+# slowest statements logged for a slow request
+SLOW_STATEMENTS_LOGGED = 3
+
+# seconds between the writes of a process's metrics to METRICS_DIR
+METRICS_DUMP_SECONDS = 1.0
+
+
+class RequestSQL(object):
+    """The statements one request ran: how many times and for how long."""
+
+    __slots__ = ("queries", "seconds", "statements")
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+        # statement -> [runs, seconds]
+        self.statements = {}
+
+    def record(self, statement, seconds):
+        self.queries += 1
+        self.seconds += seconds
+        runs = self.statements.get(statement)
+        if runs is None:
+            self.statements[statement] = [1, seconds]
+        else:
+            runs[0] += 1
+            runs[1] += seconds
+
+    def repeated(self, threshold):
+        """(statement, runs) of the statements run at least `threshold`
+        times, the usual sign of a query issued once per row (N+1)."""
+        return [
+            (statement, runs)
+            for statement, (runs, _) in self.statements.items()
+            if runs >= threshold
+        ]
+
+    def slowest(self, n):
+        """(statement, runs, seconds) of the `n` statements the request
+        spent the most time in."""
+        return sorted(
+            (
+                (statement, runs, seconds)
+                for statement, (runs, seconds) in self.statements.items()
+            ),
+            key=lambda entry: entry[2],
+            reverse=True,
+        )[:n]
+
+
+def _labels():
+    endpoint = request.endpoint
+    if endpoint is None:
+        return "none", "unmatched"
+    view, _, name = endpoint.rpartition(".")
+    return view or "app", ADMIN_ACTIONS.get(name, name)
+
+
+def _statement(statement):
+    return " ".join(statement.split())[:500]
+
+
+class RequestMetrics(object):
+    """Request latency histograms per view and action, with the number and
+    total time of the SQL statements each request ran.
+
+    Every statement is timed through engine events into the current
+    request's RequestSQL. When a request is over, a statement it ran
+    `repeat_threshold` times or more is counted and logged as a likely N+1,
+    and the slowest statements of requests taking `slow_request_seconds` or
+    longer are logged. The request's SQL totals are also sent back in a
+    Server-Timing header.
+
+    With a `METRICS_DIR`, a thread of every process writes its metrics there
+    within METRICS_DUMP_SECONDS of a request, so that /metrics can add up
+    those of all the workers of a host.
+    """
+
+    def __init__(self, app=None):
+        labels = ("view", "action")
+        self.request_seconds = Histogram(
+            "flaskentory_request_duration_seconds",
+            "Time to handle a request, by view and action.",
+            labels,
+        )
+        self.sql_queries = Histogram(
+            "flaskentory_request_sql_queries",
+            "SQL statements run per request, by view and action.",
+            labels,
+            QUERY_COUNT_BUCKETS,
+        )
+        self.sql_seconds = Histogram(
+            "flaskentory_request_sql_seconds",
+            "Time per request spent in SQL statements, by view and action.",
+            labels,
+        )
+        self.repeated_statements = Counter(
+            "flaskentory_sql_repeated_statements_total",
+            "Statements a request ran at least SQL_REPEAT_THRESHOLD times "
+            "(likely N+1), by view and action.",
+            labels,
+        )
+        self.slow_requests = Counter(
+            "flaskentory_slow_requests_total",
+            "Requests taking at least SLOW_REQUEST_SECONDS, by view and action.",
+            labels,
+        )
+        self.metrics = [
+            self.request_seconds,
+            self.sql_queries,
+            self.sql_seconds,
+            self.repeated_statements,
+            self.slow_requests,
+        ]
+        self.repeat_threshold = 10
+        self.slow_request_seconds = 1.0
+        self.directory = None
+        # callables returning more metrics of this process to dump, read
+        # when they are dumped
+        self.collectors = []
+        self._dump_lock = threading.Lock()
+        self._changed = threading.Event()
+        # pid of the process whose writer thread is running; a forked
+        # worker starts its own
+        self._writer_pid = None
+        # the RequestSQL and start time of the request a thread is handling;
+        # cheaper to reach from the statement hooks than flask.g
+        self._current = threading.local()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.logger = app.logger
+        self.repeat_threshold = app.config["SQL_REPEAT_THRESHOLD"]
+        self.slow_request_seconds = app.config["SLOW_REQUEST_SECONDS"]
+        self.directory = app.config["METRICS_DIR"]
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+        event.listen(Engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", self._after_cursor_execute)
+
+    def process_metrics(self):
+        """The metrics of this process: the request metrics and those of the
+        collectors."""
+        metrics = list(self.metrics)
+        for collect in self.collectors:
+            metrics.extend(collect())
+        return metrics
+
+    def dump(self):
+        """Write the metrics of this process to METRICS_DIR now."""
+        with self._dump_lock:
+            dump(self.process_metrics(), self.directory)
+
+    def _write_changes(self):
+        while True:
+            self._changed.wait()
+            # one write for the requests of the next second, not one each
+            time.sleep(METRICS_DUMP_SECONDS)
+            self._changed.clear()
+            try:
+                self.dump()
+            except OSError:
+                self.logger.exception("could not write metrics to %s", self.directory)
+
+    def _metrics_changed(self):
+        if self._writer_pid != os.getpid():
+            with self._dump_lock:
+                if self._writer_pid != os.getpid():
+                    self._writer_pid = os.getpid()
+                    threading.Thread(
+                        target=self._write_changes, name="metrics-writer", daemon=True
+                    ).start()
+        self._changed.set()
+
+    def _before_cursor_execute(
+        self, conn, cursor, statement, parameters, context, executemany
+    ):
+        if context is not None:
+            context._metrics_start = time.perf_counter()
+
+    def _after_cursor_execute(
+        self, conn, cursor, statement, parameters, context, executemany
+    ):
+        sql = getattr(self._current, "sql", None)
+        if sql is not None and context is not None:
+            sql.record(statement, time.perf_counter() - context._metrics_start)
+
+    def _before_request(self):
+        self._current.sql = RequestSQL()
+        self._current.start = time.perf_counter()
+
+    def _after_request(self, response):
+        sql = getattr(self._current, "sql", None)
+        if sql is not None:
+            response.headers.add(
+                "Server-Timing",
+                'sql;dur=%.1f;desc="%d queries"' % (sql.seconds * 1000, sql.queries),
+            )
+        return response
+
+    def _teardown_request(self, exc):
+        sql = getattr(self._current, "sql", None)
+        if sql is None:
+            return
+        seconds = time.perf_counter() - self._current.start
+        self._current.sql = None
+        labels = _labels()
+        self.request_seconds.observe(labels, seconds)
+        self.sql_queries.observe(labels, sql.queries)
+        self.sql_seconds.observe(labels, sql.seconds)
+        for statement, runs in sql.repeated(self.repeat_threshold):
+            self.repeated_statements.inc(labels)
+            self.logger.warning(
+                "%s %s ran the same statement %d times (N+1?): %s",
+                request.method,
+                request.path,
+                runs,
+                _statement(statement),
+            )
+        if seconds >= self.slow_request_seconds:
+            self.slow_requests.inc(labels)
+            self.logger.warning(
+                "%s %s took %.3fs, %.3fs in %d statements; slowest: %s",
+                request.method,
+                request.path,
+                seconds,
+                sql.seconds,
+                sql.queries,
+                "; ".join(
+                    "%.3fs in %d runs of %s" % (spent, runs, _statement(statement))
+                    for statement, runs, spent in sql.slowest(SLOW_STATEMENTS_LOGGED)
+                ),
+            )
+        if self.directory:
+            self._metrics_changed()
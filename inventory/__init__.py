@@ -0,0 +1,3 @@
+from inventory.bom import bom_cache, recompute_bom_totals, refresh_bom
+from inventory.manufacturing import manufacture
+from inventory.stock import apply_delta, apply_deltas, move_stock, stock_balance
@@ -0,0 +1,125 @@
+import threading
+from collections import OrderedDict, namedtuple
+
+from app_init import db
+
+# The requirement vector of a product: raw material ids and the quantity of
+# each per batch, in raw_material_id order, and their total, as of one
+# bom_version of the product.
+Bom = namedtuple("Bom", "version total raw_material_ids quantities")
+
+query_load_bom = db.text(
+    """
+    SELECT product.bom_version,
+           COALESCE(array_agg(lines.raw_material_id ORDER BY lines.raw_material_id)
+                    FILTER (WHERE lines.raw_material_id IS NOT NULL), '{}'),
+           COALESCE(array_agg(lines.qty ORDER BY lines.raw_material_id)
+                    FILTER (WHERE lines.raw_material_id IS NOT NULL), '{}')
+    FROM product
+    LEFT JOIN (
+        SELECT raw_material_id, SUM(raw_material_quantity) AS qty
+        FROM product_raw_material
+        WHERE product_id = :product_id
+        GROUP BY raw_material_id
+    ) lines ON true
+    WHERE product.id = :product_id
+    GROUP BY product.id
+    """
+)
+
+
+class BomCache(object):
+    """Per-process LRU cache of product requirement vectors.
+
+    Entries carry the product's bom_version, which every change to its bill
+    of materials replaces with a new value from a sequence, so a reader
+    holding the product row can tell a stale entry from a current one
+    whichever process made the change. Sequence values are never handed out
+    twice, so an entry read inside a transaction that rolled back can never
+    pass for a later version.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, product_id):
+        with self._lock:
+            bom = self._entries.get(product_id)
+            if bom is not None:
+                self._entries.move_to_end(product_id)
+            return bom
+
+    def load(self, conn, product_id):
+        """Read the bill of materials of a product into the cache and return
+        it, or None if there is no such product."""
+        row = conn.execute(query_load_bom, product_id=product_id).fetchone()
+        if row is None:
+            self.discard(product_id)
+            return None
+        bom = Bom(row[0], sum(row[2]), tuple(row[1]), tuple(row[2]))
+        with self._lock:
+            self._entries[product_id] = bom
+            self._entries.move_to_end(product_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return bom
+
+    def discard(self, product_id):
+        with self._lock:
+            self._entries.pop(product_id, None)
+
+
+bom_cache = BomCache()
+
+
+def refresh_bom(conn, product_ids):
+    """Recompute the quantity of the given products from their bill of
+    materials and give them a new bom_version, invalidating every cached
+    copy. Call it in the transaction that changed their ProductRawMaterial
+    rows; products left without lines keep their quantity."""
+    product_ids = sorted({product_id for product_id in product_ids if product_id})
+    if not product_ids:
+        return
+    conn.execute(
+        db.text(
+            """
+            UPDATE product
+            SET quantity = COALESCE(
+                    (SELECT SUM(raw_material_quantity) FROM product_raw_material
+                     WHERE product_id = product.id),
+                    quantity),
+                bom_version = nextval('product_bom_version_seq')
+            WHERE id = ANY(CAST(:product_ids AS integer[]))
+            """
+        ),
+        product_ids=product_ids,
+    )
+    for product_id in product_ids:
+        bom_cache.discard(product_id)
+
+
+def recompute_bom_totals(conn):
+    """Recompute product.quantity for every product with a bill of materials
+    in one set-based pass, e.g. after a bulk import of ProductRawMaterial
+    rows. Returns the number of products whose quantity changed."""
+    return conn.execute(
+        db.text(
+            """
+            WITH totals AS (
+                SELECT product_id, SUM(raw_material_quantity) AS total
+                FROM product_raw_material
+                GROUP BY product_id
+            ), updated AS (
+                UPDATE product
+                SET quantity = totals.total,
+                    bom_version = nextval('product_bom_version_seq')
+                FROM totals, product old
+                WHERE product.id = totals.product_id AND old.id = product.id
+                RETURNING old.quantity <> totals.total AS changed
+            )
+            SELECT count(*) FILTER (WHERE changed) FROM updated
+            """
+        )
+    ).scalar()
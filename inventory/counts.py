@@ -0,0 +1,107 @@
+import json
+import random
+
+from app_init import db
+
+# tables whose exact row count is kept in row_count as rows are inserted
+COUNTED_TABLES = ["product_movement", "raw_material_movement"]
+
+# rows of row_count per table; writers add to a random one so concurrent
+# commits rarely wait on each other
+ROW_COUNT_SHARDS = 8
+
+
+def bump_row_count(conn, table, n=1):
+    """Add `n` to the cached row count of `table`, within the transaction
+    that inserted (or deleted) the rows."""
+    if not n:
+        return
+    conn.execute(
+        db.text(
+            """
+            INSERT INTO row_count (table_name, shard, row_count)
+            VALUES (:t, :s, :n)
+            ON CONFLICT (table_name, shard) DO UPDATE
+            SET row_count = row_count.row_count + EXCLUDED.row_count,
+                time_updated = now()
+            """
+        ),
+        t=table,
+        s=random.randrange(ROW_COUNT_SHARDS),
+        n=n,
+    )
+
+
+def cached_row_count(conn, table):
+    """Return the cached exact row count of `table`, or None if it is not
+    kept."""
+    count = conn.execute(
+        db.text("SELECT SUM(row_count) FROM row_count WHERE table_name = :t"), t=table
+    ).scalar()
+    return None if count is None else int(count)
+
+
+def refresh_row_count(conn, table):
+    """Recount `table` and reset its cached row count. Blocks writers to the
+    table until the transaction ends."""
+    conn.execute(db.text(f"LOCK TABLE {table} IN SHARE MODE"))
+    conn.execute(db.text("DELETE FROM row_count WHERE table_name = :t"), t=table)
+    return conn.execute(
+        db.text(
+            f"""
+            INSERT INTO row_count (table_name, shard, row_count)
+            SELECT :t, 0, count(*) FROM {table}
+            RETURNING row_count
+            """
+        ),
+        t=table,
+    ).scalar()
+
+
+def estimated_row_count(conn, table):
+    """Return the planner's estimate of the rows in `table` (summed over its
+    partitions), or None if it has never been analyzed."""
+    estimate = conn.execute(
+        db.text(
+            """
+            SELECT SUM(reltuples) FILTER (WHERE reltuples >= 0)
+            FROM pg_class
+            WHERE relkind = 'r' AND (
+                oid = to_regclass(:t)
+                OR oid IN (
+                    SELECT inhrelid FROM pg_inherits WHERE inhparent = to_regclass(:t)
+                )
+            )
+            """
+        ),
+        t=table,
+    ).scalar()
+    return None if estimate is None else int(estimate)
+
+
+def estimated_query_rows(conn, statement):
+    """Return the planner's row estimate for a select statement."""
+    compiled = statement.compile(dialect=conn.dialect)
+    plan = conn.execute(
+        "EXPLAIN (FORMAT JSON) " + str(compiled), compiled.params
+    ).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def counted_query_rows(conn, statement, limit):
+    """Count the rows of a select statement, stopping once past `limit`.
+
+    The statement keeps the plan it gets for all of its rows. Under a LIMIT
+    the planner prefers a scan that stops early, which reads the whole
+    table when the statement matches far fewer rows than estimated.
+    """
+    compiled = statement.compile(dialect=conn.dialect)
+    # a CTE is planned on its own, from PostgreSQL 12 only when MATERIALIZED
+    materialized = "MATERIALIZED " if conn.dialect.server_version_info >= (12,) else ""
+    return conn.execute(
+        f"WITH matched AS {materialized}({compiled}) "
+        "SELECT count(*) FROM (SELECT 1 FROM matched LIMIT %(count_limit)s) AS m",
+        dict(compiled.params, count_limit=limit + 1),
+    ).scalar()
@@ -0,0 +1,99 @@
+from app_init import db
+
+# materialized views behind the admin index page, see migration
+# 6f2b9d4e8a17; dashboard_refreshed goes last, so that it records when the
+# others were all up to date
+DASHBOARD_VIEWS = [
+    "dashboard_location_totals",
+    "dashboard_top_movers",
+    "dashboard_zero_stock",
+    "dashboard_manufacturing_daily",
+    "dashboard_refreshed",
+]
+
+# rows of each list the page shows
+DASHBOARD_ROWS = 10
+
+
+def refresh_dashboard_view(conn, view):
+    """Recompute one of the dashboard views. Done CONCURRENTLY, so the page
+    keeps reading the previous contents meanwhile."""
+    if view not in DASHBOARD_VIEWS:
+        raise ValueError(f"unknown dashboard view {view}")
+    conn.execute(db.text(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {view}"))
+
+
+def dashboard(conn, rows=DASHBOARD_ROWS):
+    """What the admin index page shows, as of the last refresh.
+
+    Every list is read from the dashboard views through their indexes and
+    cut at `rows`, so it takes the same few statements however long the
+    movement history is. Returns a dict of the time of the last refresh,
+    the totals per location (with the number of locations and the grand
+    totals), the top movers per kind and window, the zero stock rows per
+    kind (with their number) and the manufacturing output per day.
+    """
+    refreshed_at = conn.execute(
+        db.text("SELECT refreshed_at FROM dashboard_refreshed")
+    ).scalar()
+    totals = conn.execute(
+        db.text(
+            """
+            SELECT count(*) AS locations,
+                   COALESCE(SUM(product_items), 0) AS product_items,
+                   COALESCE(SUM(product_zero_items), 0) AS product_zero_items,
+                   COALESCE(SUM(product_units), 0) AS product_units,
+                   COALESCE(SUM(raw_material_items), 0) AS raw_material_items,
+                   COALESCE(SUM(raw_material_zero_items), 0) AS raw_material_zero_items,
+                   COALESCE(SUM(raw_material_units), 0) AS raw_material_units
+            FROM dashboard_location_totals
+            """
+        )
+    ).fetchone()
+    locations = conn.execute(
+        db.text(
+            """
+            SELECT * FROM dashboard_location_totals
+            ORDER BY location_name, location_id
+            LIMIT :rows
+            """
+        ),
+        rows=rows,
+    ).fetchall()
+    movers = {}
+    for row in conn.execute(
+        db.text(
+            """
+            SELECT * FROM dashboard_top_movers
+            WHERE rank <= :rows
+            ORDER BY kind, days, rank
+            """
+        ),
+        rows=rows,
+    ):
+        movers.setdefault((row.kind, row.days), []).append(row)
+    zero_stock = {}
+    for kind in ("product", "raw_material"):
+        zero_stock[kind] = conn.execute(
+            db.text(
+                """
+                SELECT * FROM dashboard_zero_stock
+                WHERE kind = :kind
+                ORDER BY time_updated DESC
+                LIMIT :rows
+                """
+            ),
+            kind=kind,
+            rows=rows,
+        ).fetchall()
+    manufacturing = conn.execute(
+        db.text("SELECT * FROM dashboard_manufacturing_daily ORDER BY day DESC")
+    ).fetchall()
+    return dict(
+        refreshed_at=refreshed_at,
+        totals=totals,
+        locations=locations,
+        movers=movers,
+        zero_stock=zero_stock,
+        manufacturing=manufacturing,
+    )
@@ -0,0 +1,206 @@
+import threading
+import time
+
+from app_init import db, lazy_import
+
+# loaded on the first feasibility request
+np = lazy_import("numpy")
+
+# products per block of the vectorized pass; bounds the temporary
+# (products, lines, locations) array to a few megabytes
+PRODUCT_BLOCK_SIZE = 64
+
+query_bom_lines = db.text(
+    """
+    SELECT product_id, raw_material_id, SUM(raw_material_quantity)
+    FROM product_raw_material
+    GROUP BY product_id, raw_material_id
+    HAVING SUM(raw_material_quantity) > 0
+    ORDER BY product_id, raw_material_id
+    """
+)
+
+query_raw_material_stock = db.text(
+    """
+    SELECT location_id, array_agg(raw_material_id), array_agg(available_stock)
+    FROM (
+        SELECT location_id, raw_material_id, SUM(available_stock) AS available_stock
+        FROM (
+            SELECT location_id, raw_material_id, available_stock
+            FROM raw_material_stock
+            UNION ALL
+            SELECT location_id, raw_material_id, available_stock
+            FROM raw_material_stock_shard
+        ) parts
+        GROUP BY location_id, raw_material_id
+        HAVING SUM(available_stock) > 0
+    ) stock
+    GROUP BY location_id
+    """
+)
+
+
+class Feasibility(object):
+    """Bills of materials and raw material stock as dense arrays, for
+    working out how many batches of every product each location can build.
+
+    Products are the rows of `raw_material_index` and `quantities`, one
+    column per bill of materials line, padded with a sentinel raw material
+    that is never limiting. `stock` has one row per raw material appearing
+    in a bill of materials (plus the sentinel) and one column per location.
+    Products without a bill of materials are left out; they are not built
+    from raw materials.
+    """
+
+    def __init__(
+        self, product_ids, location_ids, raw_material_ids, lines, stock, loaded_at
+    ):
+        self.product_ids = product_ids
+        self.location_ids = location_ids
+        self.raw_material_ids = raw_material_ids
+        self.raw_material_index, self.quantities, self.line_counts = lines
+        self.stock = stock
+        self.loaded_at = loaded_at
+        self.ratio_stock = stock.astype(np.float64)
+        self.ratio_stock[-1] = np.inf
+        self.inverse_quantities = 1 / self.quantities.astype(np.float64)
+
+    @classmethod
+    def load(cls, conn):
+        lines = np.array(conn.execute(query_bom_lines).fetchall(), dtype=np.int64)
+        lines = lines.reshape(-1, 3)
+        location_ids = np.array(
+            [row[0] for row in conn.execute(db.text("SELECT id FROM location"))],
+            dtype=np.int64,
+        )
+        location_ids.sort()
+
+        product_ids, first_line, line_counts = np.unique(
+            lines[:, 0], return_index=True, return_counts=True
+        )
+        raw_material_ids, line_raw = np.unique(lines[:, 1], return_inverse=True)
+        sentinel = len(raw_material_ids)
+        width = int(line_counts.max()) if len(line_counts) else 0
+        raw_material_index = np.full((len(product_ids), width), sentinel, np.intp)
+        quantities = np.ones((len(product_ids), width), np.int32)
+        column = np.arange(len(lines)) - np.repeat(first_line, line_counts)
+        row = np.repeat(np.arange(len(product_ids)), line_counts)
+        raw_material_index[row, column] = line_raw
+        quantities[row, column] = lines[:, 2]
+
+        stock = np.zeros((sentinel + 1, len(location_ids)), np.int32)
+        levels_by_location = conn.execute(query_raw_material_stock) if sentinel else ()
+        for location_id, item_ids, levels in levels_by_location:
+            item_ids = np.array(item_ids, dtype=np.int64)
+            levels = np.array(levels, dtype=np.int32)
+            rows = np.searchsorted(raw_material_ids, item_ids)
+            rows[rows == sentinel] = 0
+            used = raw_material_ids[rows] == item_ids
+            column = np.searchsorted(location_ids, location_id)
+            if column < len(location_ids) and location_ids[column] == location_id:
+                stock[rows[used], column] = levels[used]
+
+        return cls(
+            product_ids,
+            location_ids,
+            raw_material_ids,
+            (raw_material_index, quantities, line_counts),
+            stock,
+            time.time(),
+        )
+
+    def compute(self, product_ids=None, location_ids=None):
+        """Return (product_ids, location_ids, batches, limiting_raw_material_ids)
+        where batches[i, j] is how many whole batches of product i location j
+        has the raw materials for, and limiting_raw_material_ids[i, j] the
+        raw material that runs out first. Narrowed to the given ids when
+        passed; ids without a bill of materials or location are dropped."""
+        products = self._select(self.product_ids, product_ids)
+        locations = self._select(self.location_ids, location_ids)
+        ratio_stock = self.ratio_stock
+        if location_ids is not None:
+            ratio_stock = ratio_stock[:, locations]
+        batches = np.empty((len(products), len(locations)), np.int64)
+        limiting = np.empty((len(products), len(locations)), np.int64)
+        if not batches.size:
+            return (
+                self.product_ids[products],
+                self.location_ids[locations],
+                batches,
+                limiting,
+            )
+
+        # The limiting line is the one with the smallest stock / quantity.
+        # Non-negative float64s order like their bits read as uint64, so
+        # with the line number written into the lowest mantissa bits a
+        # single contiguous min finds both. The error this and the rounding
+        # of stock * (1 / quantity) add stays below 2 ** (line_bits - 46)
+        # relative, while a ratio just under a whole number n is short of
+        # it by at least 1 / quantity; scaling up by that much before the
+        # floor gives exact batch counts for any int32 stock level.
+        width = self.raw_material_index.shape[1]
+        line_bits = max(width - 1, 1).bit_length()
+        line_mask = np.uint64((1 << line_bits) - 1)
+        line_numbers = np.arange(width, dtype=np.uint64)[None, :, None]
+        slack = 1 + 2.0 ** (line_bits - 46)
+        for start in range(0, len(products), PRODUCT_BLOCK_SIZE):
+            block = products[start : start + PRODUCT_BLOCK_SIZE]
+            raw_material_index = self.raw_material_index[block]
+            # (products, lines, locations)
+            ratios = ratio_stock[raw_material_index]
+            ratios *= self.inverse_quantities[block, :, None]
+            keys = ratios.view(np.uint64)
+            keys &= ~line_mask
+            keys |= line_numbers
+            keys = keys.min(axis=1)
+            line = (keys & line_mask).astype(np.intp)
+            line += (np.arange(len(block)) * width)[:, None]
+            end = start + len(block)
+            limiting[start:end] = self.raw_material_ids.take(
+                raw_material_index.take(line)
+            )
+            ratio = keys.view(np.float64)
+            ratio *= slack
+            np.floor(ratio, out=ratio)
+            batches[start:end] = ratio
+        return (
+            self.product_ids[products],
+            self.location_ids[locations],
+            batches,
+            limiting,
+        )
+
+    @staticmethod
+    def _select(ids, wanted):
+        if wanted is None:
+            return np.arange(len(ids))
+        wanted = np.unique(np.asarray(wanted, dtype=np.int64))
+        if not len(ids):
+            return np.arange(0)
+        positions = np.minimum(np.searchsorted(ids, wanted), len(ids) - 1)
+        return positions[ids[positions] == wanted]
+
+
+class FeasibilityCache(object):
+    """Per-process copy of the Feasibility arrays, reloaded once it is older
+    than `max_age` seconds. Loading reads every bill of materials line and
+    stock level, so requests in between share one snapshot."""
+
+    def __init__(self, max_age=60):
+        self.max_age = max_age
+        self._feasibility = None
+        self._lock = threading.Lock()
+
+    def get(self, conn, refresh=False):
+        with self._lock:
+            feasibility = self._feasibility
+            if (
+                refresh
+                or feasibility is None
+                or time.time() - feasibility.loaded_at > self.max_age
+            ):
+                feasibility = self._feasibility = Feasibility.load(conn)
+            return feasibility
+
+
+feasibility_cache = FeasibilityCache()
@@ -0,0 +1,190 @@
+import csv
+import datetime
+import io
+import json
+from collections import defaultdict
+
+from app_init import db
+from db_models import (
+    Location,
+    Product,
+    ProductMovement,
+    RawMaterial,
+    RawMaterialMovement,
+)
+from inventory.counts import bump_row_count
+from inventory.stock import apply_deltas
+
+# movement model, item model and item column for each kind of movement
+MOVEMENT_KINDS = {
+    "product": (ProductMovement, Product, "product_id"),
+    "raw_material": (RawMaterialMovement, RawMaterial, "raw_material_id"),
+}
+
+# rows per multi-row INSERT statement
+INSERT_CHUNK_SIZE = 1000
+
+
+def parse_rows(text, fmt):
+    """Split a JSON lines or CSV payload into row dicts.
+
+    Rows that cannot be parsed are returned as strings holding the error.
+    """
+    if fmt == "csv":
+        return [dict(row) for row in csv.DictReader(io.StringIO(text))]
+    rows = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            rows.append(f"Invalid JSON: {e}")
+            continue
+        rows.append(row if isinstance(row, dict) else "Row is not a JSON object")
+    return rows
+
+
+def _optional_int(raw, field, errors):
+    value = raw.get(field)
+    if value is None or value == "":
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        errors.append(f'"{field}" must be an integer')
+        return None
+
+
+def _clean_row(raw, item_column):
+    errors = []
+    row = {
+        item_column: _optional_int(raw, item_column, errors),
+        "from_location_id": _optional_int(raw, "from_location_id", errors),
+        "to_location_id": _optional_int(raw, "to_location_id", errors),
+        "qty": _optional_int(raw, "qty", errors),
+        "description": raw.get("description") or None,
+        "movement_date": db.func.current_date(),
+    }
+    if raw.get("movement_date"):
+        try:
+            row["movement_date"] = datetime.datetime.strptime(
+                str(raw["movement_date"]), "%Y-%m-%d"
+            ).date()
+        except ValueError:
+            errors.append('"movement_date" must be a YYYY-MM-DD date')
+    for field in (item_column, "qty"):
+        if raw.get(field) is None or raw.get(field) == "":
+            errors.append(f'"{field}" is required')
+    if row["qty"] is not None and row["qty"] < 0:
+        errors.append('"qty" cannot be negative')
+    if not row["from_location_id"] and not row["to_location_id"]:
+        errors.append('Both "from_location_id" and "to_location_id" cannot be empty')
+    return row, errors
+
+
+def _existing_ids(conn, model, ids):
+    if not ids:
+        return set()
+    query = db.select([model.id]).where(model.id.in_(ids))
+    return {row[0] for row in conn.execute(query)}
+
+
+def _coalesce(rows, item_column):
+    deltas = defaultdict(int)
+    for row in rows:
+        if row["to_location_id"]:
+            deltas[(row["to_location_id"], row[item_column])] += row["qty"]
+        if row["from_location_id"]:
+            deltas[(row["from_location_id"], row[item_column])] -= row["qty"]
+    return deltas
+
+
+def ingest_batch(conn, kind, raw_rows, first_row_number=1):
+    """Validate and record a batch of movements of one kind.
+
+    Valid rows are inserted with multi-row INSERTs and their net stock delta
+    per (location, item) is applied in a single pass. Rows whose outflow
+    would take a balance below zero are rejected and the rest re-applied.
+    Returns one result dict per input row.
+    """
+    model, item_model, item_column = MOVEMENT_KINDS[kind]
+    results = []
+    candidates = []
+    for number, raw in enumerate(raw_rows, first_row_number):
+        if isinstance(raw, str):
+            results.append({"row": number, "status": "rejected", "errors": [raw]})
+            continue
+        row, errors = _clean_row(raw, item_column)
+        results.append(
+            {
+                "row": number,
+                "status": "rejected" if errors else "accepted",
+                "errors": errors,
+            }
+        )
+        if not errors:
+            candidates.append((results[-1], row))
+
+    location_ids = _existing_ids(
+        conn,
+        Location,
+        {
+            row[column]
+            for _, row in candidates
+            for column in ("from_location_id", "to_location_id")
+            if row[column]
+        },
+    )
+    item_ids = _existing_ids(
+        conn, item_model, {row[item_column] for _, row in candidates}
+    )
+    accepted = []
+    for result, row in candidates:
+        for column in ("from_location_id", "to_location_id"):
+            if row[column] and row[column] not in location_ids:
+                result["errors"].append(f'Unknown "{column}": {row[column]}')
+        if row[item_column] not in item_ids:
+            result["errors"].append(f'Unknown "{item_column}": {row[item_column]}')
+        if result["errors"]:
+            result["status"] = "rejected"
+        else:
+            accepted.append((result, row))
+
+    # Replay the rows of every short (location, item) in order, rejecting
+    # outflows the running balance cannot cover, as posting them one by one
+    # would. Each round rejects at least one row, so this ends.
+    while accepted:
+        shortfalls = apply_deltas(
+            conn,
+            kind,
+            _coalesce([row for _, row in accepted], item_column),
+            source=model.__tablename__,
+        )
+        if not shortfalls:
+            break
+        balances = dict(shortfalls)
+        still_accepted = []
+        for result, row in accepted:
+            to_key = (row["to_location_id"], row[item_column])
+            from_key = (row["from_location_id"], row[item_column])
+            if from_key in balances and balances[from_key] < row["qty"]:
+                result["status"] = "rejected"
+                result["errors"].append(
+                    f"Insufficient stock at location {from_key[0]}, available: {balances[from_key]}"
+                )
+                continue
+            if from_key in balances:
+                balances[from_key] -= row["qty"]
+            if to_key in balances:
+                balances[to_key] += row["qty"]
+            still_accepted.append((result, row))
+        accepted = still_accepted
+
+    rows = [row for _, row in accepted]
+    for start in range(0, len(rows), INSERT_CHUNK_SIZE):
+        conn.execute(
+            model.__table__.insert().values(rows[start : start + INSERT_CHUNK_SIZE])
+        )
+    bump_row_count(conn, model.__tablename__, len(rows))
+    return results
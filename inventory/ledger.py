@@ -0,0 +1,112 @@
+from app_init import db
+from inventory.stock import LEDGER_TABLES, STOCK_TABLES
+
+# snapshot table for each kind of stock
+SNAPSHOT_TABLES = {
+    "product": "product_stock_snapshot",
+    "raw_material": "raw_material_stock_snapshot",
+}
+
+# A snapshot run folds every ledger row up to its cutoff and writes a row
+# only for the (location, item) pairs that moved since the previous run, so
+# any pair without a row in a run kept the balance of its last snapshot.
+# The balance at time T is then the latest snapshot of the pair at or
+# before the last run R <= T, plus the ledger rows in (R, T].
+
+
+def take_snapshot(conn, kind, cutoff):
+    """Fold the ledger up to `cutoff` into a snapshot run.
+
+    `cutoff` should trail the current time by more than the longest
+    transaction, so that no ledger row stamped before it can still be
+    uncommitted. Returns the number of snapshot rows written.
+    """
+    _, item_column = STOCK_TABLES[kind]
+    snapshot_table = SNAPSHOT_TABLES[kind]
+    return conn.execute(
+        db.text(
+            f"""
+            WITH run AS (
+                SELECT COALESCE(MAX(snapshot_time), '-infinity') AS t
+                FROM {snapshot_table}
+            ), moved AS (
+                SELECT location_id, {item_column}, SUM(delta) AS delta
+                FROM {LEDGER_TABLES[kind]}
+                WHERE time_created > (SELECT t FROM run) AND time_created <= :cutoff
+                GROUP BY location_id, {item_column}
+            ), last AS (
+                SELECT DISTINCT ON (s.location_id, s.{item_column})
+                       s.location_id, s.{item_column}, s.balance
+                FROM {snapshot_table} s
+                JOIN moved ON moved.location_id = s.location_id
+                          AND moved.{item_column} = s.{item_column}
+                ORDER BY s.location_id, s.{item_column}, s.snapshot_time DESC
+            )
+            INSERT INTO {snapshot_table} (location_id, {item_column}, balance, snapshot_time)
+            SELECT moved.location_id, moved.{item_column},
+                   COALESCE(last.balance, 0) + moved.delta, :cutoff
+            FROM moved
+            LEFT JOIN last ON last.location_id = moved.location_id
+                          AND last.{item_column} = moved.{item_column}
+            WHERE :cutoff > (SELECT t FROM run)
+            """
+        ),
+        cutoff=cutoff,
+    ).rowcount
+
+
+def balances_as_of(conn, kind, as_of, location_id=None, item_id=None):
+    """Return {(location_id, item_id): balance} as it stood at `as_of`,
+    optionally for one location and/or item.
+
+    Reads the nearest snapshot run and only the ledger rows written after
+    it, so the delta scan is bounded by the snapshot interval rather than
+    the length of the history. The latest snapshot of each pair is found
+    through the (location, item, snapshot_time) index, one probe per stock
+    row, instead of reading every older run.
+    """
+    stock_table, item_column = STOCK_TABLES[kind]
+    snapshot_table = SNAPSHOT_TABLES[kind]
+    rows = conn.execute(
+        db.text(
+            f"""
+            WITH run AS (
+                SELECT COALESCE(MAX(snapshot_time), '-infinity') AS t
+                FROM {snapshot_table}
+                WHERE snapshot_time <= :as_of
+            ), snap AS (
+                -- every pair with a snapshot has a stock row
+                SELECT k.location_id, k.{item_column}, last.balance
+                FROM {stock_table} k
+                CROSS JOIN LATERAL (
+                    SELECT balance
+                    FROM {snapshot_table} s
+                    WHERE s.location_id = k.location_id
+                      AND s.{item_column} = k.{item_column}
+                      AND s.snapshot_time <= (SELECT t FROM run)
+                    ORDER BY s.snapshot_time DESC
+                    LIMIT 1
+                ) last
+                WHERE (CAST(:location_id AS integer) IS NULL OR k.location_id = :location_id)
+                  AND (CAST(:item_id AS integer) IS NULL OR k.{item_column} = :item_id)
+            ), moved AS (
+                SELECT location_id, {item_column}, SUM(delta) AS delta
+                FROM {LEDGER_TABLES[kind]}
+                WHERE time_created > (SELECT t FROM run) AND time_created <= :as_of
+                  AND (CAST(:location_id AS integer) IS NULL OR location_id = :location_id)
+                  AND (CAST(:item_id AS integer) IS NULL OR {item_column} = :item_id)
+                GROUP BY location_id, {item_column}
+            )
+            SELECT COALESCE(snap.location_id, moved.location_id) AS location_id,
+                   COALESCE(snap.{item_column}, moved.{item_column}) AS item_id,
+                   COALESCE(snap.balance, 0) + COALESCE(moved.delta, 0) AS balance
+            FROM snap
+            FULL OUTER JOIN moved ON moved.location_id = snap.location_id
+                                 AND moved.{item_column} = snap.{item_column}
+            """
+        ),
+        as_of=as_of,
+        location_id=location_id,
+        item_id=item_id,
+    )
+    return {(row.location_id, row.item_id): row.balance for row in rows}
@@ -0,0 +1,159 @@
+from app_init import db
+from inventory.bom import bom_cache
+from inventory.stock import fold_free_shards
+from inventory.stock_cache import stock_cache
+from wtforms import validators
+
+# Share-locks the product, so that its bill of materials cannot change
+# until the transaction ends, and locks every stock row the requirement
+# vector needs (in raw_material_id order, so concurrent runs cannot
+# deadlock). Returns the product's quantity and bom_version, with one row per
+# required raw material holding what is needed, what is available in the
+# stock row itself and whether it has shards.
+query_lock_required_raw_materials = db.text(
+    """
+    WITH product_row AS (
+        SELECT quantity, bom_version FROM product WHERE id = :product_id FOR SHARE
+    ), need AS (
+        SELECT raw_material_id, qty * :batch_size AS needed
+        FROM unnest(CAST(:raw_material_ids AS integer[]), CAST(:quantities AS integer[]))
+            AS bom(raw_material_id, qty)
+    ), locked AS (
+        SELECT raw_material_id, available_stock,
+               EXISTS (
+                   SELECT 1 FROM raw_material_stock_shard sh
+                   WHERE sh.location_id = raw_material_stock.location_id
+                     AND sh.raw_material_id = raw_material_stock.raw_material_id
+               ) AS sharded
+        FROM raw_material_stock
+        WHERE location_id = :location_id
+          AND raw_material_id IN (SELECT raw_material_id FROM need)
+        ORDER BY raw_material_id
+        FOR UPDATE
+    )
+    SELECT product_row.quantity AS batch_quantity,
+           product_row.bom_version,
+           need.raw_material_id,
+           raw_material.name,
+           need.needed,
+           COALESCE(locked.available_stock, 0) AS available,
+           COALESCE(locked.sharded, false) AS sharded
+    FROM product_row
+    LEFT JOIN need ON true
+    LEFT JOIN raw_material ON raw_material.id = need.raw_material_id
+    LEFT JOIN locked ON locked.raw_material_id = need.raw_material_id
+    ORDER BY need.raw_material_id
+    """
+)
+
+# Consumes the raw materials, upserts the manufactured quantity into
+# product_stock and records both in the stock ledgers in a single statement.
+query_apply_manufacturing = db.text(
+    """
+    WITH need AS (
+        SELECT raw_material_id, qty * :batch_size AS needed
+        FROM unnest(CAST(:raw_material_ids AS integer[]), CAST(:quantities AS integer[]))
+            AS bom(raw_material_id, qty)
+    ), consumed AS (
+        UPDATE raw_material_stock
+        SET available_stock = raw_material_stock.available_stock - need.needed,
+            time_updated = now()
+        FROM need
+        WHERE raw_material_stock.location_id = :location_id
+          AND raw_material_stock.raw_material_id = need.raw_material_id
+        RETURNING raw_material_stock.raw_material_id,
+                  raw_material_stock.available_stock,
+                  need.needed
+    ), consumed_ledger AS (
+        INSERT INTO raw_material_stock_ledger
+            (location_id, raw_material_id, delta, balance, source, source_id)
+        SELECT :location_id, raw_material_id, -needed, available_stock,
+               'product_manufacturing', :manufacturing_id
+        FROM consumed
+    ), produced AS (
+        INSERT INTO product_stock (location_id, product_id, available_stock)
+        VALUES (:location_id, :product_id, :produced)
+        ON CONFLICT (location_id, product_id) DO UPDATE
+        SET available_stock = product_stock.available_stock + EXCLUDED.available_stock,
+            time_updated = now()
+        RETURNING available_stock
+    )
+    INSERT INTO product_stock_ledger
+        (location_id, product_id, delta, balance, source, source_id)
+    SELECT :location_id, :product_id, :produced, available_stock,
+           'product_manufacturing', :manufacturing_id
+    FROM produced
+    """
+)
+
+
+def _lock_required_raw_materials(conn, bom, product_id, location_id, batch_size):
+    return conn.execute(
+        query_lock_required_raw_materials,
+        product_id=product_id,
+        location_id=location_id,
+        raw_material_ids=list(bom.raw_material_ids) if bom else [],
+        quantities=list(bom.quantities) if bom else [],
+        batch_size=batch_size,
+    ).fetchall()
+
+
+def manufacture(
+    conn, product_id, location_id, location_name, batch_size, manufacturing_id=None
+):
+    """Consume the bill of materials for `batch_size` batches of a product at
+    a location and add the output to its product stock.
+
+    Runs a constant number of statements whatever the size of the bill of
+    materials, two when the requirement vector is in the BOM cache. Every
+    shortfall is reported in a single ValidationError. Returns the
+    manufactured quantity.
+    """
+    bom = bom_cache.get(product_id) or bom_cache.load(conn, product_id)
+    rows = _lock_required_raw_materials(conn, bom, product_id, location_id, batch_size)
+    if rows and rows[0].bom_version != bom.version:
+        # the cached copy is stale; the product is share-locked now, so the
+        # bill of materials read next is the one this run will consume
+        bom = bom_cache.load(conn, product_id)
+        rows = _lock_required_raw_materials(
+            conn, bom, product_id, location_id, batch_size
+        )
+    sharded = [(location_id, row.raw_material_id) for row in rows if row.sharded]
+    if sharded:
+        # raw materials are consumed from the stock rows themselves, so fold
+        # the shards in first; the next shard fold spreads them out again
+        fold_free_shards(conn, "raw_material", sharded)
+        rows = _lock_required_raw_materials(
+            conn, bom, product_id, location_id, batch_size
+        )
+    if not bom or not bom.raw_material_ids:
+        raise validators.ValidationError(
+            "A product with no raw material cannot be manufactured."
+        )
+    shortfalls = [
+        f'"{row.name}" available: {row.available}, needed: {row.needed}'
+        for row in rows
+        if row.available < row.needed
+    ]
+    if shortfalls:
+        raise validators.ValidationError(
+            f'Insufficient raw materials at "{location_name}": ' + "; ".join(shortfalls)
+        )
+    produced = batch_size * (rows[0].batch_quantity or 0)
+    stock_cache.touch(
+        conn,
+        "raw_material",
+        [(location_id, raw_material_id) for raw_material_id in bom.raw_material_ids],
+    )
+    stock_cache.touch(conn, "product", [(location_id, product_id)])
+    conn.execute(
+        query_apply_manufacturing,
+        product_id=product_id,
+        location_id=location_id,
+        raw_material_ids=list(bom.raw_material_ids),
+        quantities=list(bom.quantities),
+        batch_size=batch_size,
+        produced=produced,
+        manufacturing_id=manufacturing_id,
+    )
+    return produced
@@ -0,0 +1,49 @@
+from app_init import db
+
+# movement tables that may be range partitioned by month on movement_date
+PARTITIONED_TABLES = ["product_movement", "raw_material_movement"]
+
+
+def is_partitioned(conn, table):
+    return (
+        conn.execute(
+            db.text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:t)"),
+            t=table,
+        ).scalar()
+        == "p"
+    )
+
+
+def create_monthly_partitions(conn, table, first_month, months):
+    """Create the monthly partitions of `table` for `months` months starting
+    at the month of `first_month`, skipping the ones that already exist.
+
+    Fails if the DEFAULT partition already holds rows of a new month; those
+    have to be moved out of it first. Returns the names of the partitions
+    created.
+    """
+    created = []
+    for offset in range(months):
+        start, end = conn.execute(
+            db.text(
+                """
+                SELECT CAST(date_trunc('month', CAST(:d AS date))
+                            + make_interval(months => :o) AS date),
+                       CAST(date_trunc('month', CAST(:d AS date))
+                            + make_interval(months => :o + 1) AS date)
+                """
+            ),
+            d=first_month,
+            o=offset,
+        ).fetchone()
+        name = f"{table}_y{start.year}m{start.month:02d}"
+        if conn.execute(db.text("SELECT to_regclass(:n)"), n=name).scalar():
+            continue
+        conn.execute(
+            db.text(
+                f"CREATE TABLE {name} PARTITION OF {table} "
+                f"FOR VALUES FROM ('{start}') TO ('{end}')"
+            )
+        )
+        created.append(name)
+    return created
@@ -0,0 +1,305 @@
+import multiprocessing
+
+from app_init import db
+from inventory.stock import LEDGER_TABLES, SHARD_TABLES, STOCK_TABLES, apply_deltas
+
+# ledger source of the corrections a repair writes
+RECONCILIATION_SOURCE = "stock_reconciliation"
+
+# ledger source of manufacturing runs, see inventory.manufacturing
+MANUFACTURING_SOURCE = "product_manufacturing"
+
+
+def _scope(location_column, item_column, by_keys):
+    if by_keys:
+        return (
+            f"({location_column}, {item_column}) IN "
+            f"(SELECT location_id, item_id FROM keys)"
+        )
+    return f"{location_column} = ANY(CAST(:location_ids AS integer[]))"
+
+
+def _manufacturing_sql(kind, by_keys):
+    """What manufacturing added to (product) or took from (raw material)
+    the stock. Runs recorded in the ledger count with what they actually
+    moved, since bills of materials and batch quantities change over time;
+    older runs with their current bill of materials."""
+    _, item_column = STOCK_TABLES[kind]
+    unlogged = f"""
+        NOT EXISTS (
+            SELECT 1 FROM product_stock_ledger l
+            WHERE l.location_id = m.to_location_id AND l.product_id = m.product_id
+              AND l.source = '{MANUFACTURING_SOURCE}' AND l.source_id = m.id
+        )
+    """
+    if kind == "product":
+        unlogged_runs = f"""
+            SELECT m.to_location_id, m.product_id, m.batch_size * p.quantity
+            FROM product_manufacturing m
+            JOIN product p ON p.id = m.product_id
+            WHERE {_scope('m.to_location_id', 'm.product_id', by_keys)}
+              AND {unlogged}
+        """
+    else:
+        unlogged_runs = f"""
+            SELECT m.to_location_id, b.raw_material_id,
+                   -m.batch_size * b.raw_material_quantity
+            FROM product_manufacturing m
+            JOIN product_raw_material b ON b.product_id = m.product_id
+            WHERE {_scope('m.to_location_id', 'b.raw_material_id', by_keys)}
+              AND {unlogged}
+        """
+    return f"""
+        SELECT location_id, {item_column}, delta
+        FROM {LEDGER_TABLES[kind]}
+        WHERE source = '{MANUFACTURING_SOURCE}'
+          AND {_scope('location_id', item_column, by_keys)}
+        UNION ALL
+        {unlogged_runs}
+    """
+
+
+def _compare_sql(kind, by_keys):
+    table, item_column = STOCK_TABLES[kind]
+    movement_table = f"{kind}_movement"
+    keys = (
+        """
+        keys AS (
+            SELECT * FROM unnest(
+                CAST(:location_ids AS integer[]), CAST(:item_ids AS integer[])
+            ) AS k(location_id, item_id)
+        ),
+        """
+        if by_keys
+        else ""
+    )
+    # pending queue rows have not changed the stock yet; rejected ones were
+    # taken back off their movements (see inventory.write_behind), so the
+    # movements alone already leave them out
+    return f"""
+        WITH {keys} changes (location_id, item_id, delta) AS (
+            SELECT to_location_id, {item_column}, qty
+            FROM {movement_table}
+            WHERE {_scope('to_location_id', item_column, by_keys)}
+            UNION ALL
+            SELECT from_location_id, {item_column}, -qty
+            FROM {movement_table}
+            WHERE {_scope('from_location_id', item_column, by_keys)}
+            UNION ALL
+            SELECT to_location_id, item_id, -qty
+            FROM movement_queue
+            WHERE kind = :kind AND status = 'pending'
+              AND {_scope('to_location_id', 'item_id', by_keys)}
+            UNION ALL
+            SELECT from_location_id, item_id, qty
+            FROM movement_queue
+            WHERE kind = :kind AND status = 'pending'
+              AND {_scope('from_location_id', 'item_id', by_keys)}
+            UNION ALL
+            {_manufacturing_sql(kind, by_keys)}
+        ), expected AS (
+            SELECT location_id, item_id, SUM(delta) AS balance
+            FROM changes
+            GROUP BY location_id, item_id
+        ), actual AS (
+            SELECT s.location_id, s.{item_column} AS item_id,
+                   s.available_stock + COALESCE(sh.available_stock, 0) AS balance
+            FROM {table} s
+            LEFT JOIN (
+                SELECT location_id, {item_column}, SUM(available_stock) AS available_stock
+                FROM {SHARD_TABLES[kind]}
+                WHERE {_scope('location_id', item_column, by_keys)}
+                GROUP BY location_id, {item_column}
+            ) sh ON sh.location_id = s.location_id AND sh.{item_column} = s.{item_column}
+            WHERE {_scope('s.location_id', f's.{item_column}', by_keys)}
+        ), compared AS (
+            SELECT COALESCE(e.location_id, a.location_id) AS location_id,
+                   COALESCE(e.item_id, a.item_id) AS item_id,
+                   COALESCE(e.balance, 0) AS expected,
+                   a.balance AS actual
+            FROM expected e
+            FULL OUTER JOIN actual a
+              ON a.location_id = e.location_id AND a.item_id = e.item_id
+        )
+        -- the differences, plus the first row for the number of pairs compared
+        SELECT location_id, item_id, expected, actual, checked
+        FROM (
+            SELECT compared.*, count(*) OVER () AS checked,
+                   row_number() OVER () AS n
+            FROM compared
+        ) c
+        WHERE expected <> COALESCE(actual, 0) OR n = 1
+        ORDER BY location_id, item_id
+    """
+
+
+def compare_stock(conn, kind, location_ids=None, keys=None):
+    """Recompute the balances of a kind of stock from the movements and
+    manufacturing runs, and compare them with the stock rows (and their
+    shards).
+
+    Covers every item at `location_ids`, or only the (location_id, item_id)
+    `keys`. Returns the number of pairs compared and a list of
+    (location_id, item_id, expected, actual) for the pairs that differ;
+    `actual` is None where there is no stock row.
+    """
+    params = {"kind": kind}
+    if keys is not None:
+        params["location_ids"] = [key[0] for key in keys]
+        params["item_ids"] = [key[1] for key in keys]
+    else:
+        params["location_ids"] = list(location_ids)
+    rows = conn.execute(db.text(_compare_sql(kind, keys is not None)), **params)
+    checked, differences = 0, []
+    for row in rows:
+        checked = row.checked
+        if row.expected != (row.actual or 0):
+            differences.append(
+                (row.location_id, row.item_id, int(row.expected), row.actual)
+            )
+    return checked, differences
+
+
+def repair_stock(conn, kind, keys):
+    """Set the stock of the (location_id, item_id) `keys` to the balances
+    their history gives, recording each correction in the stock ledger.
+
+    The stock rows and shards of the keys are locked before their history
+    is read again, so movements committing meanwhile are either part of
+    the history read or wait and apply their change on top of the repaired
+    balance. Returns the repaired differences, in compare_stock's format;
+    pairs whose history adds up to less than zero are left alone.
+    """
+    table, item_column = STOCK_TABLES[kind]
+    if not keys:
+        return []
+    params = dict(
+        location_ids=[key[0] for key in keys], item_ids=[key[1] for key in keys]
+    )
+    for locked in (table, SHARD_TABLES[kind]):
+        conn.execute(
+            db.text(
+                f"""
+                SELECT 1 FROM {locked}
+                WHERE (location_id, {item_column}) IN (
+                    SELECT * FROM unnest(
+                        CAST(:location_ids AS integer[]), CAST(:item_ids AS integer[])
+                    )
+                )
+                ORDER BY location_id, {item_column}
+                FOR UPDATE
+                """
+            ),
+            **params,
+        ).fetchall()
+    _, differences = compare_stock(conn, kind, keys=keys)
+    repairable = [row for row in differences if row[2] >= 0]
+    apply_deltas(
+        conn,
+        kind,
+        {
+            (location_id, item_id): expected - (actual or 0)
+            for location_id, item_id, expected, actual in repairable
+        },
+        source=RECONCILIATION_SOURCE,
+    )
+    return repairable
+
+
+def touched_keys(conn, kind, since):
+    """The (location_id, item_id) pairs whose stock was written, or that
+    got movements, after `since`."""
+    _, item_column = STOCK_TABLES[kind]
+    movement_table = f"{kind}_movement"
+    rows = conn.execute(
+        db.text(
+            f"""
+            SELECT location_id, {item_column} FROM {LEDGER_TABLES[kind]}
+            WHERE time_created > :since
+            UNION
+            SELECT to_location_id, {item_column} FROM {movement_table}
+            WHERE time_created > :since AND to_location_id IS NOT NULL
+            UNION
+            SELECT from_location_id, {item_column} FROM {movement_table}
+            WHERE time_created > :since AND from_location_id IS NOT NULL
+            """
+        ),
+        since=since,
+    )
+    return [tuple(row) for row in rows]
+
+
+def last_cutoff(conn, kind):
+    """Cutoff of the last completed reconciliation of a kind of stock, or
+    None if there was none."""
+    return conn.execute(
+        db.text("SELECT MAX(cutoff) FROM stock_reconciliation WHERE kind = :kind"),
+        kind=kind,
+    ).scalar()
+
+
+def record_reconciliation(conn, kind, cutoff, full, checked, differences, repaired):
+    conn.execute(
+        db.text(
+            """
+            INSERT INTO stock_reconciliation
+                (kind, cutoff, full_run, pairs_checked, differences, repaired)
+            VALUES (:kind, :cutoff, :full, :checked, :differences, :repaired)
+            """
+        ),
+        kind=kind,
+        cutoff=cutoff,
+        full=full,
+        checked=checked,
+        differences=differences,
+        repaired=repaired,
+    )
+
+
+def _init_worker():
+    # connections inherited from the parent must not be shared with it
+    db.engine.dispose()
+
+
+def _reconcile_chunk(task):
+    kind, location_ids, keys, repair = task
+    with db.engine.connect() as conn:
+        checked, differences = compare_stock(conn, kind, location_ids, keys)
+    repaired = []
+    if repair and differences:
+        with db.engine.begin() as conn:
+            repaired = repair_stock(conn, kind, [row[:2] for row in differences])
+    return checked, differences, repaired
+
+
+def reconcile_stock(kind, location_ids, keys=None, repair=False, workers=4):
+    """Compare (and with `repair`, correct) a kind of stock at
+    `location_ids`, or only at the given (location_id, item_id) `keys`,
+    spreading the locations over a pool of `workers` processes.
+
+    Yields (checked, differences, repaired) per group of locations, as
+    compare_stock and repair_stock return them.
+    """
+    # a few groups per worker, so that a location with a long history does
+    # not hold up the rest
+    groups = max(1, min(len(location_ids), workers * 4))
+    location_groups = [sorted(location_ids)[i::groups] for i in range(groups)]
+    tasks = []
+    for group in location_groups:
+        if keys is None:
+            tasks.append((kind, group, None, repair))
+        else:
+            group_locations = set(group)
+            group_keys = [key for key in keys if key[0] in group_locations]
+            if group_keys:
+                tasks.append((kind, None, group_keys, repair))
+    if not tasks:
+        return
+    db.engine.dispose()
+    pool = multiprocessing.Pool(min(workers, len(tasks)), initializer=_init_worker)
+    try:
+        for result in pool.imap_unordered(_reconcile_chunk, tasks):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
@@ -0,0 +1,158 @@
+from app_init import db
+
+# daily rollup table and item column of each kind of movement. Statement
+# triggers on the movement tables add every insert, update and delete to a
+# random shard row of its (day, location, item); see migration 9e2c4b7a1d05.
+ROLLUP_TABLES = {
+    "product": ("product_movement_daily", "product_id"),
+    "raw_material": ("raw_material_movement_daily", "raw_material_id"),
+}
+
+# periods a report can total the days over (date_trunc fields; weeks start
+# on Monday)
+PERIODS = ["day", "week", "month"]
+
+
+def movement_totals(
+    conn,
+    kind,
+    period,
+    first_day,
+    last_day,
+    location_ids=None,
+    item_ids=None,
+    limit=None,
+):
+    """Inflow and outflow of each item per location and `period` between
+    `first_day` and `last_day` inclusive, optionally for some locations and
+    items only.
+
+    Read from the daily rollups, so the rows read grow with the days and
+    items in the range, not with the movements. A week or month cut by the
+    range only counts its days within it. Returns the result, of rows of
+    (period_start, location_id, location_name, item_id, item_name, inflow,
+    outflow) ordered by period and names; on a connection with
+    stream_results, its rows are fetched as they are read.
+    """
+    if period not in PERIODS:
+        raise ValueError(f"unknown period {period}")
+    table, item_column = ROLLUP_TABLES[kind]
+    return conn.execute(
+        db.text(
+            f"""
+            SELECT CAST(date_trunc('{period}', r.day) AS date) AS period_start,
+                   r.location_id, location.name AS location_name,
+                   r.{item_column} AS item_id, item.name AS item_name,
+                   SUM(r.inflow) AS inflow, SUM(r.outflow) AS outflow
+            FROM {table} r
+            JOIN location ON location.id = r.location_id
+            JOIN {kind} item ON item.id = r.{item_column}
+            WHERE r.day BETWEEN :first_day AND :last_day
+              AND (CAST(:location_ids AS integer[]) IS NULL
+                   OR r.location_id = ANY(CAST(:location_ids AS integer[])))
+              AND (CAST(:item_ids AS integer[]) IS NULL
+                   OR r.{item_column} = ANY(CAST(:item_ids AS integer[])))
+            GROUP BY 1, r.location_id, location.name, r.{item_column}, item.name
+            HAVING SUM(r.inflow) <> 0 OR SUM(r.outflow) <> 0
+            ORDER BY 1, location.name, item.name
+            LIMIT :limit
+            """
+        ),
+        first_day=first_day,
+        last_day=last_day,
+        location_ids=location_ids or None,
+        item_ids=item_ids or None,
+        limit=limit,
+    )
+
+
+def compact_rollups(conn, kind):
+    """Fold the shard rows of every (day, location, item) into shard 0 and
+    drop the rows that add up to nothing. Returns the rows folded."""
+    table, item_column = ROLLUP_TABLES[kind]
+    folded, first_day = conn.execute(
+        db.text(
+            f"""
+            WITH folded AS (
+                DELETE FROM {table}
+                WHERE shard <> 0
+                RETURNING day, location_id, {item_column}, inflow, outflow
+            ), added AS (
+                INSERT INTO {table} (day, location_id, {item_column}, shard, inflow, outflow)
+                SELECT day, location_id, {item_column}, 0, SUM(inflow), SUM(outflow)
+                FROM folded
+                GROUP BY day, location_id, {item_column}
+                ORDER BY day, location_id, {item_column}
+                ON CONFLICT (day, location_id, {item_column}, shard) DO UPDATE
+                SET inflow = {table}.inflow + EXCLUDED.inflow,
+                    outflow = {table}.outflow + EXCLUDED.outflow
+            )
+            SELECT count(*), MIN(day) FROM folded
+            """
+        )
+    ).fetchone()
+    if not folded:
+        return 0
+    # a statement does not see the rows its own WITH queries wrote
+    conn.execute(
+        db.text(
+            f"""
+            DELETE FROM {table}
+            WHERE day >= :first_day AND inflow = 0 AND outflow = 0
+            """
+        ),
+        first_day=first_day,
+    )
+    return folded
+
+
+def rebuild_rollups(conn, kind, first_day, last_day):
+    """Recompute the daily rollups of the days between `first_day` and
+    `last_day` inclusive from the movements, e.g. after movements were
+    loaded with the triggers disabled. Returns the rows written.
+
+    Movements are blocked until the caller's transaction ends: one
+    committed between the delete and the recount would be added both by
+    its trigger and by the recount.
+    """
+    table, item_column = ROLLUP_TABLES[kind]
+    # as the migration that filled the rollups does
+    conn.execute(db.text(f"LOCK TABLE {kind}_movement IN SHARE MODE"))
+    day = "COALESCE(movement_date, CAST(time_created AS date), current_date)"
+    # spelled out so that the movement_date and time_created indexes apply
+    in_range = """(
+        movement_date BETWEEN :first_day AND :last_day
+        OR movement_date IS NULL
+           AND time_created >= :first_day AND time_created < :last_day + 1
+    )"""
+    conn.execute(
+        db.text(f"DELETE FROM {table} WHERE day BETWEEN :first_day AND :last_day"),
+        first_day=first_day,
+        last_day=last_day,
+    )
+    return conn.execute(
+        db.text(
+            f"""
+            INSERT INTO {table} (day, location_id, {item_column}, shard, inflow, outflow)
+            SELECT day, location_id, item_id, 0, SUM(inflow), SUM(outflow)
+            FROM (
+                SELECT {day} AS day, to_location_id AS location_id,
+                       {item_column} AS item_id, qty AS inflow, 0 AS outflow
+                FROM {kind}_movement
+                WHERE to_location_id IS NOT NULL AND {in_range}
+                UNION ALL
+                SELECT {day}, from_location_id, {item_column}, 0, qty
+                FROM {kind}_movement
+                WHERE from_location_id IS NOT NULL AND {in_range}
+            ) l
+            GROUP BY day, location_id, item_id
+            HAVING SUM(inflow) <> 0 OR SUM(outflow) <> 0
+            ORDER BY day, location_id, item_id
+            ON CONFLICT (day, location_id, {item_column}, shard) DO UPDATE
+            SET inflow = {table}.inflow + EXCLUDED.inflow,
+                outflow = {table}.outflow + EXCLUDED.outflow
+            """
+        ),
+        first_day=first_day,
+        last_day=last_day,
+    ).rowcount
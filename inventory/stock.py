@@ -0,0 +1,516 @@
+from app_init import db
+from inventory.stock_cache import stock_cache
+
+# stock table and item column for each kind of stock
+STOCK_TABLES = {
+    "product": ("product_stock", "product_id"),
+    "raw_material": ("raw_material_stock", "raw_material_id"),
+}
+
+# append-only ledger every stock write also records into
+LEDGER_TABLES = {
+    "product": "product_stock_ledger",
+    "raw_material": "raw_material_stock_ledger",
+}
+
+
+# sub-rows of sharded stock rows. A stock row with `shards` > 0 spreads its
+# stock over up to that many shard rows plus its own available_stock, so
+# writers of a hot item pick a shard at random instead of all queueing on
+# one row lock. Every part is kept non-negative, so their sum is too.
+SHARD_TABLES = {
+    "product": "product_stock_shard",
+    "raw_material": "raw_material_stock_shard",
+}
+
+
+def total_stock_sql(kind):
+    """SQL for the stock of the item :i at location :l, summed over its
+    stock row and shards."""
+    table, item_column = STOCK_TABLES[kind]
+    return f"""
+        COALESCE((SELECT available_stock FROM {table}
+                  WHERE location_id = :l AND {item_column} = :i), 0)
+      + COALESCE((SELECT SUM(available_stock) FROM {SHARD_TABLES[kind]}
+                  WHERE location_id = :l AND {item_column} = :i), 0)
+    """
+
+
+def stock_balance(conn, kind, location_id, item_id):
+    """Return the available stock of an item at a location, summed over its
+    shards, or None if the location has never held it."""
+    table, item_column = STOCK_TABLES[kind]
+    return conn.execute(
+        db.text(
+            f"""
+            SELECT CASE WHEN EXISTS (
+                       SELECT 1 FROM {table} WHERE location_id = :l AND {item_column} = :i
+                   ) THEN {total_stock_sql(kind)} END
+            """
+        ),
+        l=location_id,
+        i=item_id,
+    ).scalar()
+
+
+def stock_balances(conn, kind, keys, cached=True):
+    """Return {(location_id, item_id): balance} for the given keys, with the
+    same balances as stock_balance.
+
+    Balances come from the stock cache unless `cached` is False. A cached
+    balance can trail a commit made on another host by up to
+    STOCK_CACHE_TTL seconds. Never decide whether stock can be taken on a
+    cached read; the guarded writes of apply_delta and apply_deltas make
+    that check.
+    """
+    if not cached:
+        return _load_stock_balances(conn, kind, list(keys))
+    return stock_cache.get_many(conn, "stock", kind, keys, _load_stock_balances)
+
+
+def _load_stock_balances(conn, kind, keys):
+    table, item_column = STOCK_TABLES[kind]
+    rows = conn.execute(
+        db.text(
+            f"""
+            SELECT k.location_id, k.item_id,
+                   s.available_stock + COALESCE((
+                       SELECT SUM(sh.available_stock) FROM {SHARD_TABLES[kind]} sh
+                       WHERE sh.location_id = k.location_id
+                         AND sh.{item_column} = k.item_id
+                   ), 0)
+            FROM unnest(CAST(:location_ids AS integer[]), CAST(:item_ids AS integer[]))
+                AS k(location_id, item_id)
+            JOIN {table} s
+              ON s.location_id = k.location_id AND s.{item_column} = k.item_id
+            """
+        ),
+        location_ids=[key[0] for key in keys],
+        item_ids=[key[1] for key in keys],
+    )
+    balances = dict.fromkeys(keys)
+    balances.update(((row[0], row[1]), row[2]) for row in rows)
+    return balances
+
+
+def apply_delta(conn, kind, location_id, item_id, delta, source=None, source_id=None):
+    """Add a signed delta to the stock of an item at a location and return
+    the new balance.
+
+    Positive deltas upsert the stock row through its unique constraint.
+    Negative deltas only update an existing row that can cover them; when it
+    cannot, nothing is written and None is returned. The change is recorded
+    in the stock ledger against `source` and `source_id`.
+
+    Unsharded rows take a single statement. A sharded row takes inflows
+    into a random shard and outflows from a random shard that can cover
+    them, skipping shards other writers hold. When none can, its shards are
+    folded into the stock row under lock, the outflow is taken from the
+    total and the rest is spread over the shards again. The balance
+    recorded in the ledger for a sharded row is read without locking the
+    other shards, so concurrent writers can leave it slightly off; the
+    deltas are exact.
+    """
+    stock_cache.touch(conn, kind, [(location_id, item_id)])
+    balance, sharded = _apply_delta(
+        conn, kind, location_id, item_id, delta, source, source_id
+    )
+    if balance is None and sharded:
+        keys = [(location_id, item_id)]
+        fold_stock_shards(conn, kind, keys, spread=False)
+        balance, _ = _apply_delta(
+            conn, kind, location_id, item_id, delta, source, source_id, unsharded=True
+        )
+        fold_stock_shards(conn, kind, keys)
+    return balance
+
+
+def _apply_delta(
+    conn, kind, location_id, item_id, delta, source, source_id, unsharded=False
+):
+    table, item_column = STOCK_TABLES[kind]
+    shard_table = SHARD_TABLES[kind]
+    if delta >= 0:
+        change = f"""
+            to_shard AS (
+                INSERT INTO {shard_table} (location_id, {item_column}, shard, available_stock)
+                SELECT :l, :i, floor(random() * shards), :delta FROM config WHERE shards > 0
+                ON CONFLICT (location_id, {item_column}, shard) DO UPDATE
+                SET available_stock = {shard_table}.available_stock + EXCLUDED.available_stock,
+                    time_updated = now()
+                RETURNING 1
+            ), to_row AS (
+                INSERT INTO {table} (location_id, {item_column}, available_stock)
+                SELECT :l, :i, :delta FROM config WHERE shards = 0
+                ON CONFLICT (location_id, {item_column}) DO UPDATE
+                SET available_stock = {table}.available_stock + EXCLUDED.available_stock,
+                    time_updated = now()
+                RETURNING available_stock
+            ), changed AS (
+                SELECT available_stock FROM to_row
+                UNION ALL
+                SELECT {total_stock_sql(kind)} + :delta FROM to_shard
+            )
+            """
+    else:
+        change = f"""
+            from_shard AS (
+                UPDATE {shard_table}
+                SET available_stock = available_stock + :delta, time_updated = now()
+                WHERE location_id = :l AND {item_column} = :i
+                  AND available_stock + :delta >= 0
+                  AND shard = (
+                      SELECT shard FROM {shard_table}
+                      WHERE location_id = :l AND {item_column} = :i
+                        AND available_stock + :delta >= 0
+                        AND (SELECT shards FROM config) > 0
+                      ORDER BY random()
+                      LIMIT 1
+                      FOR UPDATE SKIP LOCKED
+                  )
+                RETURNING 1
+            ), from_row AS (
+                UPDATE {table}
+                SET available_stock = available_stock + :delta, time_updated = now()
+                WHERE location_id = :l AND {item_column} = :i
+                  AND available_stock + :delta >= 0
+                  AND (SELECT shards FROM config) = 0
+                RETURNING available_stock
+            ), changed AS (
+                SELECT available_stock FROM from_row
+                UNION ALL
+                SELECT {total_stock_sql(kind)} + :delta FROM from_shard
+            )
+            """
+    query = f"""
+        WITH config AS (
+            SELECT CASE WHEN :unsharded THEN 0 ELSE COALESCE((
+                       SELECT shards FROM {table}
+                       WHERE location_id = :l AND {item_column} = :i
+                   ), 0) END AS shards
+        ), {change}, ledger AS (
+            INSERT INTO {LEDGER_TABLES[kind]}
+                (location_id, {item_column}, delta, balance, source, source_id)
+            SELECT :l, :i, :delta, available_stock, :source, :source_id FROM changed
+        )
+        SELECT (SELECT available_stock FROM changed), (SELECT shards FROM config) > 0
+        """
+    return conn.execute(
+        db.text(query),
+        l=location_id,
+        i=item_id,
+        delta=delta,
+        source=source,
+        source_id=source_id,
+        unsharded=unsharded,
+    ).fetchone()
+
+
+def fold_stock_shards(conn, kind, keys, spread=True):
+    """Fold the shards of the stock rows keyed by (location_id, item_id)
+    into the rows themselves, then, with `spread`, split the stock of every
+    row with `shards` > 0 evenly over that many shards again. Returns the
+    number of rows that were sharded or had shards.
+
+    Works one row at a time in key order, locking the stock row and then
+    its shards, so it cannot deadlock with writers that hold a shard of one
+    row while they wait for a later one. Inflows can still create shards
+    meanwhile, which the spread adds to.
+    """
+    table, item_column = STOCK_TABLES[kind]
+    shard_table = SHARD_TABLES[kind]
+    folded = 0
+    for location_id, item_id in sorted(set(keys)):
+        sharded = conn.execute(
+            db.text(
+                f"""
+                SELECT shards > 0 OR EXISTS (
+                           SELECT 1 FROM {shard_table}
+                           WHERE location_id = :l AND {item_column} = :i
+                       )
+                FROM {table}
+                WHERE location_id = :l AND {item_column} = :i
+                FOR UPDATE
+                """
+            ),
+            l=location_id,
+            i=item_id,
+        ).scalar()
+        if not sharded:
+            continue
+        folded += 1
+        shards = [
+            row[0]
+            for row in conn.execute(
+                db.text(
+                    f"""
+                    SELECT shard FROM {shard_table}
+                    WHERE location_id = :l AND {item_column} = :i
+                    ORDER BY shard
+                    FOR UPDATE
+                    """
+                ),
+                l=location_id,
+                i=item_id,
+            )
+        ]
+        _merge_shards(conn, kind, [(location_id, item_id, shard) for shard in shards])
+        if spread:
+            conn.execute(
+                db.text(
+                    f"""
+                    WITH t AS (
+                        SELECT shards, available_stock FROM {table}
+                        WHERE location_id = :l AND {item_column} = :i
+                          AND shards > 0 AND available_stock >= shards
+                    ), kept AS (
+                        UPDATE {table} s
+                        SET available_stock = t.available_stock % t.shards,
+                            time_updated = now()
+                        FROM t
+                        WHERE s.location_id = :l AND s.{item_column} = :i
+                    )
+                    INSERT INTO {shard_table}
+                        (location_id, {item_column}, shard, available_stock)
+                    SELECT :l, :i, n, t.available_stock / t.shards
+                    FROM t, generate_series(0, t.shards - 1) n
+                    ON CONFLICT (location_id, {item_column}, shard) DO UPDATE
+                    SET available_stock = {shard_table}.available_stock
+                                        + EXCLUDED.available_stock,
+                        time_updated = now()
+                    """
+                ),
+                l=location_id,
+                i=item_id,
+            )
+    return folded
+
+
+def fold_free_shards(conn, kind, keys):
+    """Fold the shards of the given stock rows that no other transaction
+    holds into the rows themselves, for callers that already hold the stock
+    rows. Held shards are left alone, which only ever understates the
+    stock, so a caller never waits on a shard while holding a stock row."""
+    _, item_column = STOCK_TABLES[kind]
+    keys = sorted(set(keys))
+    if not keys:
+        return
+    shards = conn.execute(
+        db.text(
+            f"""
+            SELECT location_id, {item_column}, shard FROM {SHARD_TABLES[kind]}
+            WHERE (location_id, {item_column}) IN (
+                SELECT * FROM unnest(CAST(:location_ids AS integer[]),
+                                     CAST(:item_ids AS integer[]))
+            )
+            ORDER BY location_id, {item_column}, shard
+            FOR UPDATE SKIP LOCKED
+            """
+        ),
+        location_ids=[key[0] for key in keys],
+        item_ids=[key[1] for key in keys],
+    ).fetchall()
+    _merge_shards(conn, kind, [tuple(row) for row in shards])
+
+
+def _merge_shards(conn, kind, shards):
+    # move the stock of the given locked (location_id, item_id, shard) rows
+    # into their stock rows and delete them
+    if not shards:
+        return
+    table, item_column = STOCK_TABLES[kind]
+    conn.execute(
+        db.text(
+            f"""
+            WITH folded AS (
+                DELETE FROM {SHARD_TABLES[kind]}
+                WHERE (location_id, {item_column}, shard) IN (
+                    SELECT * FROM unnest(CAST(:location_ids AS integer[]),
+                                         CAST(:item_ids AS integer[]),
+                                         CAST(:shards AS smallint[]))
+                )
+                RETURNING location_id, {item_column}, available_stock
+            ), sums AS (
+                SELECT location_id, {item_column}, SUM(available_stock) AS total
+                FROM folded
+                GROUP BY location_id, {item_column}
+            )
+            UPDATE {table} s
+            SET available_stock = s.available_stock + sums.total, time_updated = now()
+            FROM sums
+            WHERE s.location_id = sums.location_id
+              AND s.{item_column} = sums.{item_column}
+            """
+        ),
+        location_ids=[shard[0] for shard in shards],
+        item_ids=[shard[1] for shard in shards],
+        shards=[shard[2] for shard in shards],
+    )
+
+
+def set_stock_shards(conn, kind, location_id, item_id, shards):
+    """Spread the stock of an item at a location over `shards` shards, or
+    fold it back into a single row with 0."""
+    table, item_column = STOCK_TABLES[kind]
+    stock_cache.touch(conn, kind, [(location_id, item_id)])
+    conn.execute(
+        db.text(
+            f"""
+            INSERT INTO {table} (location_id, {item_column}, available_stock, shards)
+            VALUES (:l, :i, 0, :shards)
+            ON CONFLICT (location_id, {item_column}) DO UPDATE
+            SET shards = EXCLUDED.shards, time_updated = now()
+            """
+        ),
+        l=location_id,
+        i=item_id,
+        shards=shards,
+    )
+    fold_stock_shards(conn, kind, [(location_id, item_id)])
+
+
+def sharded_stock_keys(conn, kind):
+    """Return the (location_id, item_id) keys of every stock row that is
+    sharded or still has shards."""
+    table, item_column = STOCK_TABLES[kind]
+    return [
+        tuple(row)
+        for row in conn.execute(
+            db.text(
+                f"""
+                SELECT location_id, {item_column} FROM {table} WHERE shards > 0
+                UNION
+                SELECT DISTINCT location_id, {item_column} FROM {SHARD_TABLES[kind]}
+                ORDER BY 1, 2
+                """
+            )
+        )
+    ]
+
+
+def move_stock(
+    conn,
+    kind,
+    item_id,
+    from_location_id,
+    to_location_id,
+    qty,
+    source=None,
+    source_id=None,
+):
+    """Move `qty` of an item between two locations, either of which may be
+    None. A negative `qty` moves stock back.
+
+    The two rows are written in location_id order so that opposite moves
+    cannot deadlock. Returns None on success, or the (location_id,
+    available) pair that could not cover its outflow; the caller must then
+    roll back.
+    """
+    deltas = {}
+    if from_location_id:
+        deltas[from_location_id] = -qty
+    if to_location_id:
+        deltas[to_location_id] = deltas.get(to_location_id, 0) + qty
+    for location_id in sorted(deltas):
+        if not deltas[location_id]:
+            continue
+        balance = apply_delta(
+            conn, kind, location_id, item_id, deltas[location_id], source, source_id
+        )
+        if balance is None:
+            available = stock_balance(conn, kind, location_id, item_id)
+            return location_id, available or 0
+    return None
+
+
+def apply_deltas(conn, kind, deltas, source=None, source_id=None):
+    """Apply net stock deltas keyed by (location_id, item_id) in one pass.
+
+    The affected stock rows are locked in (location_id, item_id) order. If
+    any delta would take a balance below zero nothing is written and the
+    offending keys are returned as {(location_id, item_id): available};
+    otherwise an empty dict is returned.
+    """
+    table, item_column = STOCK_TABLES[kind]
+    keys = sorted(key for key, delta in deltas.items() if delta)
+    if not keys:
+        return {}
+    params = dict(
+        location_ids=[key[0] for key in keys],
+        item_ids=[key[1] for key in keys],
+        deltas=[deltas[key] for key in keys],
+    )
+    query_lock = db.text(
+        f"""
+        SELECT s.location_id, s.{item_column} AS item_id, s.available_stock,
+               EXISTS (
+                   SELECT 1 FROM {SHARD_TABLES[kind]} sh
+                   WHERE sh.location_id = s.location_id
+                     AND sh.{item_column} = s.{item_column}
+               ) AS sharded
+        FROM {table} s
+        JOIN unnest(CAST(:location_ids AS integer[]), CAST(:item_ids AS integer[]))
+            AS d(location_id, item_id)
+          ON s.location_id = d.location_id AND s.{item_column} = d.item_id
+        ORDER BY s.location_id, s.{item_column}
+        FOR UPDATE OF s
+        """
+    )
+    locked = conn.execute(query_lock, **params).fetchall()
+    sharded = [(row.location_id, row.item_id) for row in locked if row.sharded]
+    if sharded:
+        # deltas are applied to the stock rows themselves, so fold the
+        # shards in first; the next shard fold spreads them out again
+        fold_free_shards(conn, kind, sharded)
+        locked = conn.execute(query_lock, **params).fetchall()
+    available = {(row.location_id, row.item_id): row.available_stock for row in locked}
+    shortfalls = {
+        key: available.get(key, 0)
+        for key in keys
+        if available.get(key, 0) + deltas[key] < 0
+    }
+    if shortfalls:
+        return shortfalls
+    stock_cache.touch(conn, kind, keys)
+    conn.execute(
+        db.text(
+            f"""
+            WITH d AS (
+                SELECT * FROM unnest(
+                    CAST(:location_ids AS integer[]),
+                    CAST(:item_ids AS integer[]),
+                    CAST(:deltas AS integer[])
+                ) AS d(location_id, item_id, delta)
+            ), updated AS (
+                UPDATE {table} s
+                SET available_stock = s.available_stock + d.delta, time_updated = now()
+                FROM d
+                WHERE s.location_id = d.location_id AND s.{item_column} = d.item_id
+                RETURNING s.location_id, s.{item_column} AS item_id, s.available_stock
+            ), inserted AS (
+                INSERT INTO {table} (location_id, {item_column}, available_stock)
+                SELECT d.location_id, d.item_id, d.delta
+                FROM d
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM updated u
+                    WHERE u.location_id = d.location_id AND u.item_id = d.item_id
+                )
+                ORDER BY d.location_id, d.item_id
+                ON CONFLICT (location_id, {item_column}) DO UPDATE
+                SET available_stock = {table}.available_stock + EXCLUDED.available_stock,
+                    time_updated = now()
+                RETURNING location_id, {item_column} AS item_id, available_stock
+            )
+            INSERT INTO {LEDGER_TABLES[kind]}
+                (location_id, {item_column}, delta, balance, source, source_id)
+            SELECT changed.location_id, changed.item_id, d.delta,
+                   changed.available_stock, :source, :source_id
+            FROM (SELECT * FROM updated UNION ALL SELECT * FROM inserted) changed
+            JOIN d ON d.location_id = changed.location_id AND d.item_id = changed.item_id
+            """
+        ),
+        source=source,
+        source_id=source_id,
+        **params,
+    )
+    return {}
@@ -0,0 +1,283 @@
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from app_init import app
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import Pool
+
+# Stock reads cached by (kind, location_id, item_id).
+#
+# Each process keeps an LRU of recent reads. It shares them with the other
+# processes on the host through a file-backed memory segment (in /dev/shm
+# where there is one) that holds:
+#
+#   - a generation per hash slot of (kind, location_id, item_id). A
+#     transaction that writes stock records the keys it wrote on its
+#     connection. Once it has committed, their generations are replaced with
+#     fresh random values. A read takes the generation before it goes to
+#     the database, and its result is only served while that generation
+#     stands. So a value read before a commit is never served after it.
+#   - a direct-mapped table of read results that any process can serve
+#     from. Slots are written without locks. Each one carries a checksum,
+#     so a torn or interleaved write reads as a miss.
+#
+# Writers on other hosts cannot reach the segment, so entries also expire
+# after STOCK_CACHE_TTL seconds.
+
+_HEADER = struct.Struct("<2Q")  # magic, slots
+_MAGIC = 0x31304B434F545346
+_GENERATION = struct.Struct("<Q")
+_VALUE = struct.Struct("<5Q")  # key hash, value, generation, expiry ms, check
+_CHECK_SALT = 0x9E3779B97F4A7C15
+_NONE = 1 << 63
+_MASK = (1 << 64) - 1
+
+# connection.info key of the (kind, location_id, item_id) keys written in
+# the connection's transaction
+_WRITTEN = "stock_cache_written"
+
+
+def _hash(*parts):
+    # hash() of strings differs between processes
+    digest = hashlib.blake2b(repr(parts).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def _encode(value):
+    return _NONE if value is None else value & _MASK
+
+
+def _decode(raw):
+    if raw == _NONE:
+        return None
+    return raw - (1 << 64) if raw > _NONE else raw
+
+
+def default_path():
+    """The segment file of this database, in /dev/shm if the host has it."""
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    database = hashlib.blake2b(
+        app.config["SQLALCHEMY_DATABASE_URI"].encode(), digest_size=6
+    ).hexdigest()
+    return os.path.join(directory, f"flaskentory-stock-cache-{database}")
+
+
+class _Segment(object):
+    def __init__(self, path, slots):
+        size = _HEADER.size + slots * (_GENERATION.size + _VALUE.size)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            if os.fstat(fd).st_size == 0:
+                os.ftruncate(fd, size)
+                os.pwrite(fd, _HEADER.pack(_MAGIC, slots), 0)
+            elif os.pread(fd, _HEADER.size, 0) != _HEADER.pack(_MAGIC, slots):
+                raise RuntimeError(f"{path} is not a stock cache of {slots} slots")
+            self.map = mmap.mmap(fd, size)
+        finally:
+            # the map holds a duplicate of fd, which would keep the lock
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+        self.slots = slots
+        self._values = _HEADER.size + slots * _GENERATION.size
+
+    def generation(self, key_hash):
+        offset = _HEADER.size + key_hash % self.slots * _GENERATION.size
+        return _GENERATION.unpack_from(self.map, offset)[0]
+
+    def renew(self, key_hash):
+        offset = _HEADER.size + key_hash % self.slots * _GENERATION.size
+        _GENERATION.pack_into(self.map, offset, int.from_bytes(os.urandom(8), "little"))
+
+    def get(self, key_hash, generation, now_ms):
+        offset = self._values + key_hash % self.slots * _VALUE.size
+        stored_hash, raw, stored_generation, expires, check = _VALUE.unpack_from(
+            self.map, offset
+        )
+        if (
+            check == stored_hash ^ raw ^ stored_generation ^ expires ^ _CHECK_SALT
+            and stored_hash == key_hash
+            and stored_generation == generation
+            and expires > now_ms
+        ):
+            return True, _decode(raw), expires
+        return False, None, None
+
+    def put(self, key_hash, value, generation, expires):
+        raw = _encode(value)
+        _VALUE.pack_into(
+            self.map,
+            self._values + key_hash % self.slots * _VALUE.size,
+            key_hash,
+            raw,
+            generation,
+            expires,
+            key_hash ^ raw ^ generation ^ expires ^ _CHECK_SALT,
+        )
+
+
+class StockCache(object):
+    """Per-process LRU cache of stock reads, backed by a memory segment
+    shared by the processes on the host that open the same `path`.
+
+    Values are served only while the generation of their key is the one
+    read before they were loaded, and for at most `ttl` seconds. A
+    `maxsize` of 0 turns the cache off.
+    """
+
+    def __init__(self, maxsize=10000, slots=65536, ttl=10.0, path=None):
+        self.maxsize = maxsize
+        self.slots = slots
+        self.ttl = ttl
+        self.path = path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._segment = None
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.invalidations = 0
+
+    def _open(self):
+        with self._lock:
+            if self._segment is None:
+                # the slot count is part of the file name, so processes with
+                # other settings never map the file at another size
+                self._segment = _Segment(
+                    f"{self.path or default_path()}.{self.slots}", self.slots
+                )
+            return self._segment
+
+    def get_many(self, conn, name, kind, keys, load):
+        """Return {(location_id, item_id): value} for the keys of a kind,
+        reading the ones not cached under `name` with load(conn, kind, keys),
+        which must return a value for each.
+
+        Keys the open transaction on `conn` has written are always loaded
+        and never cached, so a transaction sees its own writes.
+        """
+        keys = list(dict.fromkeys(keys))
+        if not self.maxsize:
+            return load(conn, kind, keys)
+        segment = self._open()
+        written = conn.info.get(_WRITTEN, ())
+        now_ms = int(time.time() * 1000)
+        values, missing, generations = {}, [], {}
+        hits = shared_hits = bypassed = 0
+        for key in keys:
+            if (kind,) + key in written:
+                missing.append(key)
+                bypassed += 1
+                continue
+            generation = segment.generation(_hash(kind, *key))
+            value_hash = _hash(name, kind, *key)
+            with self._lock:
+                entry = self._entries.get(value_hash)
+                if entry and entry[1] == generation and entry[2] > now_ms:
+                    self._entries.move_to_end(value_hash)
+                    values[key] = entry[0]
+                    hits += 1
+                    continue
+            found, value, expires = segment.get(value_hash, generation, now_ms)
+            if found:
+                self._remember(value_hash, value, generation, expires)
+                values[key] = value
+                shared_hits += 1
+            else:
+                missing.append(key)
+                generations[key] = generation
+        if missing:
+            loaded = load(conn, kind, missing)
+            expires = now_ms + int(self.ttl * 1000)
+            for key in missing:
+                values[key] = loaded[key]
+                if key in generations:
+                    value_hash = _hash(name, kind, *key)
+                    segment.put(value_hash, loaded[key], generations[key], expires)
+                    self._remember(value_hash, loaded[key], generations[key], expires)
+        with self._lock:
+            self.hits += hits
+            self.shared_hits += shared_hits
+            self.bypassed += bypassed
+            self.misses += len(missing) - bypassed
+        return values
+
+    def _remember(self, value_hash, value, generation, expires):
+        with self._lock:
+            self._entries[value_hash] = (value, generation, expires)
+            self._entries.move_to_end(value_hash)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def touch(self, conn, kind, keys):
+        """Record that the transaction on `conn` writes the stock of the
+        (location_id, item_id) keys of a kind. Their cached values are
+        invalidated once it commits."""
+        if self.maxsize:
+            conn.info.setdefault(_WRITTEN, set()).update(
+                (kind,) + tuple(key) for key in keys
+            )
+
+    def invalidate(self, written):
+        """Stop serving the values of (kind, location_id, item_id) keys read
+        so far, in every process sharing the segment."""
+        segment = self._open()
+        for key in written:
+            segment.renew(_hash(*key))
+        with self._lock:
+            self.invalidations += len(written)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "entries": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "invalidations": self.invalidations,
+            }
+
+
+stock_cache = StockCache(
+    maxsize=app.config["STOCK_CACHE_SIZE"],
+    slots=app.config["STOCK_CACHE_SLOTS"],
+    ttl=app.config["STOCK_CACHE_TTL"],
+    path=app.config["STOCK_CACHE_PATH"],
+)
+
+
+def _invalidate_written(info):
+    written = info.pop(_WRITTEN, None)
+    if written:
+        stock_cache.invalidate(written)
+
+
+# The keys a transaction wrote are invalidated once it is over: when the
+# connection begins its next transaction or goes back to the pool, both of
+# which only happen after the commit. A rollback forgets them.
+@event.listens_for(Engine, "begin")
+def _on_begin(conn):
+    _invalidate_written(conn.info)
+
+
+@event.listens_for(Engine, "rollback")
+def _on_rollback(conn):
+    conn.info.pop(_WRITTEN, None)
+
+
+@event.listens_for(Pool, "checkin")
+def _on_checkin(dbapi_connection, connection_record):
+    _invalidate_written(connection_record.info)
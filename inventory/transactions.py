@@ -0,0 +1,54 @@
+import random
+import time
+
+from app_init import app, db
+from sqlalchemy.exc import DBAPIError
+
+# SQLSTATEs of failures that go away when the transaction is run again:
+# serialization_failure and deadlock_detected
+TRANSIENT_SQLSTATES = {"40001", "40P01"}
+
+# seconds before the first retry; doubled for every further one
+RETRY_BASE_DELAY = 0.02
+
+
+def is_transient(error):
+    """Whether `error` is a database failure worth retrying the whole
+    transaction for."""
+    return (
+        isinstance(error, DBAPIError)
+        and getattr(error.orig, "pgcode", None) in TRANSIENT_SQLSTATES
+    )
+
+
+def retry_transient(work, attempts=None, rollback=None):
+    """Return work(), calling it again while it fails with a transient
+    error, up to `attempts` times (TRANSACTION_RETRIES by default).
+
+    `work` must run a whole transaction, since a failed one is rolled back;
+    `rollback` is called before each retry for work done on a session. The
+    waits grow exponentially with some jitter, so that transactions that
+    collided do not collide again.
+    """
+    attempts = attempts or app.config["TRANSACTION_RETRIES"]
+    for attempt in range(attempts):
+        try:
+            return work()
+        except DBAPIError as e:
+            if not is_transient(e) or attempt == attempts - 1:
+                raise
+            app.logger.info("retrying transaction after %s", e.orig.pgcode)
+            if rollback is not None:
+                rollback()
+            time.sleep(RETRY_BASE_DELAY * 2 ** attempt * random.uniform(0.5, 1.5))
+
+
+def run_transaction(work, attempts=None):
+    """Run work(conn) in a transaction of its own and return its result,
+    running it again on transient failures as retry_transient does."""
+
+    def attempt():
+        with db.engine.begin() as conn:
+            return work(conn)
+
+    return retry_transient(attempt, attempts)
@@ -0,0 +1,194 @@
+from app_init import db
+from inventory.counts import bump_row_count
+from inventory.stock import STOCK_TABLES, apply_deltas
+from wtforms import validators
+
+# ledger source of the stock changes of a posted transfer order
+TRANSFER_SOURCE = "transfer_order"
+
+# kinds of stock a transfer order moves, in the order their stock rows are
+# locked: raw materials first, as manufacturing takes them, so that a
+# transfer and a manufacturing run at the same location cannot deadlock
+TRANSFER_KINDS = ["raw_material", "product"]
+
+
+def create_transfer_order(
+    conn, from_location_id, to_location_id, lines, description=None
+):
+    """Record a transfer order of (kind, item_id, qty) `lines` from one
+    location to another and post it. Returns the order's id.
+
+    Raises ValidationError for lines that are invalid or that the source
+    location cannot cover; the caller must then roll back.
+    """
+    if from_location_id == to_location_id:
+        raise validators.ValidationError(
+            '"From Location" and "To Location" must differ'
+        )
+    if not lines:
+        raise validators.ValidationError("A transfer order needs at least one line")
+    for kind, item_id, qty in lines:
+        if kind not in STOCK_TABLES:
+            raise validators.ValidationError(f'Unknown kind "{kind}"')
+        if qty <= 0:
+            raise validators.ValidationError("Quantities must be positive")
+    unknown = _missing_ids(conn, "location", {from_location_id, to_location_id})
+    for kind in TRANSFER_KINDS:
+        unknown += _missing_ids(
+            conn,
+            kind,
+            {item_id for line_kind, item_id, _ in lines if line_kind == kind},
+        )
+    if unknown:
+        raise validators.ValidationError("Unknown " + ", ".join(unknown))
+    order_id = conn.execute(
+        db.text(
+            """
+            INSERT INTO transfer_order (from_location_id, to_location_id, description)
+            VALUES (:from_location_id, :to_location_id, :description)
+            RETURNING id
+            """
+        ),
+        from_location_id=from_location_id,
+        to_location_id=to_location_id,
+        description=description,
+    ).scalar()
+    conn.execute(
+        db.text(
+            """
+            INSERT INTO transfer_order_line
+                (transfer_order_id, product_id, raw_material_id, qty)
+            SELECT :order_id,
+                   CASE WHEN l.kind = 'product' THEN l.item_id END,
+                   CASE WHEN l.kind = 'raw_material' THEN l.item_id END,
+                   l.qty
+            FROM unnest(
+                CAST(:kinds AS text[]), CAST(:item_ids AS integer[]),
+                CAST(:qtys AS integer[])
+            ) WITH ORDINALITY AS l(kind, item_id, qty, n)
+            ORDER BY l.n
+            """
+        ),
+        order_id=order_id,
+        kinds=[line[0] for line in lines],
+        item_ids=[line[1] for line in lines],
+        qtys=[line[2] for line in lines],
+    )
+    post_transfer_order(conn, order_id)
+    return order_id
+
+
+def post_transfer_order(conn, order_id):
+    """Move the stock of every line of a transfer order from its source
+    location to its destination, and record one movement per line.
+
+    Everything happens in the caller's transaction, in a constant number of
+    statements per kind of stock whatever the number of lines. Rows are
+    locked in the order the movement views and manufacturing lock them:
+    daily rollups, then stock rows kind by kind in TRANSFER_KINDS order and
+    within a kind in (location_id, item_id) order by apply_deltas, then row
+    counters. So transfer orders, movements and manufacturing runs over the
+    same rows queue behind one another instead of deadlocking. Raises
+    ValidationError listing every line the source cannot cover; the caller
+    must then roll back.
+    """
+    order = conn.execute(
+        db.text(
+            """
+            SELECT o.from_location_id, o.to_location_id, o.posted_at,
+                   location.name AS from_location_name
+            FROM transfer_order o
+            JOIN location ON location.id = o.from_location_id
+            WHERE o.id = :order_id
+            FOR UPDATE OF o
+            """
+        ),
+        order_id=order_id,
+    ).fetchone()
+    if order is None:
+        raise validators.ValidationError(f"No transfer order {order_id}")
+    if order.posted_at is not None:
+        raise validators.ValidationError(
+            f"Transfer order {order_id} was posted at {order.posted_at}"
+        )
+    # the movement rows go in first, as their triggers lock the rollups
+    movements = {}
+    for kind in TRANSFER_KINDS:
+        _, item_column = STOCK_TABLES[kind]
+        movements[kind] = conn.execute(
+            db.text(
+                f"""
+                INSERT INTO {kind}_movement
+                    (movement_date, from_location_id, to_location_id,
+                     {item_column}, qty, description)
+                SELECT current_date, :from_location_id, :to_location_id,
+                       {item_column}, qty, :description
+                FROM transfer_order_line
+                WHERE transfer_order_id = :order_id AND {item_column} IS NOT NULL
+                ORDER BY id
+                """
+            ),
+            from_location_id=order.from_location_id,
+            to_location_id=order.to_location_id,
+            description=f"Transfer order {order_id}",
+            order_id=order_id,
+        ).rowcount
+    shortfalls = []
+    for kind in TRANSFER_KINDS:
+        _, item_column = STOCK_TABLES[kind]
+        lines = conn.execute(
+            db.text(
+                f"""
+                SELECT {item_column}, SUM(qty)
+                FROM transfer_order_line
+                WHERE transfer_order_id = :order_id AND {item_column} IS NOT NULL
+                GROUP BY {item_column}
+                """
+            ),
+            order_id=order_id,
+        ).fetchall()
+        deltas = {}
+        for item_id, qty in lines:
+            deltas[(order.from_location_id, item_id)] = -qty
+            deltas[(order.to_location_id, item_id)] = qty
+        short = apply_deltas(
+            conn, kind, deltas, source=TRANSFER_SOURCE, source_id=order_id
+        )
+        if short:
+            shortfalls.extend(_describe_shortfalls(conn, kind, short, dict(lines)))
+    if shortfalls:
+        raise validators.ValidationError(
+            f'Insufficient stock at "{order.from_location_name}": '
+            + "; ".join(shortfalls)
+        )
+    for kind, inserted in movements.items():
+        bump_row_count(conn, f"{kind}_movement", inserted)
+    conn.execute(
+        db.text("UPDATE transfer_order SET posted_at = now() WHERE id = :order_id"),
+        order_id=order_id,
+    )
+
+
+def _missing_ids(conn, table, ids):
+    if not ids:
+        return []
+    found = {
+        row[0]
+        for row in conn.execute(
+            db.text(f"SELECT id FROM {table} WHERE id = ANY(:ids)"), ids=list(ids)
+        )
+    }
+    return [f"{table} {id}" for id in sorted(ids - found)]
+
+
+def _describe_shortfalls(conn, kind, shortfalls, needed):
+    names = dict(
+        conn.execute(
+            db.text(f"SELECT id, name FROM {kind} WHERE id = ANY(:ids)"),
+            ids=[item_id for _, item_id in shortfalls],
+        ).fetchall()
+    )
+    return [
+        f'"{names.get(item_id, item_id)}" available: {available}, needed: {needed[item_id]}'
+        for (_, item_id), available in sorted(shortfalls.items())
+    ]
@@ -0,0 +1,276 @@
+from collections import defaultdict
+
+from app_init import db
+from inventory.counts import COUNTED_TABLES, bump_row_count
+from inventory.stock import total_stock_sql, apply_deltas
+from inventory.stock_cache import stock_cache
+
+# In write-behind mode a movement only records itself and a movement_queue
+# row in the request's transaction; the stock rows are changed later by a
+# worker that drains the queue in batches and applies the net delta per
+# stock row. Claiming, applying and deleting a batch happen in one
+# transaction, so a worker that dies mid-batch leaves it pending for the
+# next drain and no queue row is applied twice.
+
+
+def _movement_deltas(item_id, from_location_id, to_location_id, qty):
+    deltas = defaultdict(int)
+    if from_location_id:
+        deltas[(from_location_id, item_id)] -= qty
+    if to_location_id:
+        deltas[(to_location_id, item_id)] += qty
+    return deltas
+
+
+def projected_balance(conn, kind, location_id, item_id):
+    """Return the committed stock of an item at a location plus the net
+    change of its pending queue rows, read without locking anything and
+    served from the stock cache when it can be."""
+    key = (location_id, item_id)
+    return stock_cache.get_many(
+        conn, "projected", kind, [key], _load_projected_balances
+    )[key]
+
+
+def _load_projected_balances(conn, kind, keys):
+    query = db.text(
+        f"""
+        SELECT {total_stock_sql(kind)}
+             + COALESCE((
+                   SELECT SUM(CASE WHEN to_location_id = :l THEN qty ELSE 0 END)
+                        - SUM(CASE WHEN from_location_id = :l THEN qty ELSE 0 END)
+                   FROM movement_queue
+                   WHERE status = 'pending' AND kind = :kind AND item_id = :i
+                     AND (from_location_id = :l OR to_location_id = :l)
+               ), 0)
+        """
+    )
+    return {
+        key: conn.execute(query, kind=kind, l=key[0], i=key[1]).scalar() for key in keys
+    }
+
+
+def enqueue_movement(
+    conn,
+    kind,
+    item_id,
+    from_location_id,
+    to_location_id,
+    qty,
+    source=None,
+    source_id=None,
+    creates_source=False,
+):
+    """Queue the stock change of a movement instead of applying it; takes
+    the same arguments as move_stock, and whether the change is that of
+    creating the source movement rather than editing it.
+
+    Outflows are checked against the projected balance, so a queue of
+    accepted movements never overdraws on its own. Returns None once
+    queued, or the (location_id, available) pair that could not cover its
+    outflow. Concurrent requests can still both pass the check; the worker
+    then rejects whichever comes later in the queue.
+    """
+    deltas = _movement_deltas(item_id, from_location_id, to_location_id, qty)
+    for (location_id, _), delta in sorted(deltas.items()):
+        if delta < 0:
+            available = projected_balance(conn, kind, location_id, item_id)
+            if available + delta < 0:
+                return location_id, available
+    if any(deltas.values()):
+        # the projected balances of both locations change once this commits
+        stock_cache.touch(conn, kind, deltas)
+        conn.execute(
+            db.text(
+                """
+                INSERT INTO movement_queue
+                    (kind, item_id, from_location_id, to_location_id, qty,
+                     source, source_id, creates_source)
+                VALUES (:kind, :i, :from_l, :to_l, :qty, :source, :source_id,
+                        :creates_source)
+                """
+            ),
+            kind=kind,
+            i=item_id,
+            from_l=from_location_id,
+            to_l=to_location_id,
+            qty=qty,
+            source=source,
+            source_id=source_id,
+            creates_source=creates_source,
+        )
+    return None
+
+
+def _coalesce(entries):
+    deltas = defaultdict(int)
+    for entry in entries:
+        for key, delta in _movement_deltas(
+            entry.item_id, entry.from_location_id, entry.to_location_id, entry.qty
+        ).items():
+            deltas[key] += delta
+    return deltas
+
+
+def _apply_kind(conn, kind, source, entries):
+    # Replay the entries of every short stock row in queue order, rejecting
+    # the ones the running balance cannot cover, as applying them one by one
+    # would. Each round rejects at least one entry, so this ends.
+    rejected = []
+    while entries:
+        shortfalls = apply_deltas(conn, kind, _coalesce(entries), source=source)
+        if not shortfalls:
+            break
+        balances = dict(shortfalls)
+        still_applied = []
+        for entry in entries:
+            deltas = _movement_deltas(
+                entry.item_id, entry.from_location_id, entry.to_location_id, entry.qty
+            )
+            short = [
+                key
+                for key, delta in deltas.items()
+                if key in balances and balances[key] + delta < 0
+            ]
+            if short:
+                location_id = short[0][0]
+                rejected.append(
+                    (
+                        entry,
+                        f"Insufficient stock at location {location_id}, "
+                        f"available: {balances[short[0]]}",
+                    )
+                )
+                continue
+            for key, delta in deltas.items():
+                if key in balances:
+                    balances[key] += delta
+            still_applied.append(entry)
+        entries = still_applied
+    return [entry.id for entry in entries], rejected
+
+
+def _undo_movements(conn, entries):
+    """Take the quantities of rejected queue rows back off the movements
+    that queued them, so that a movement only records the stock it moved.
+    A movement whose creation was rejected is deleted; one whose edit was
+    rejected goes back to its quantity before the edit."""
+    qty = defaultdict(int)
+    created = set()
+    for entry in entries:
+        if entry.source in COUNTED_TABLES and entry.source_id is not None:
+            qty[(entry.source, entry.source_id)] += entry.qty
+            if entry.creates_source:
+                created.add((entry.source, entry.source_id))
+    for table in sorted({table for table, _ in qty}):
+        ids = sorted(
+            source_id
+            for t, source_id in qty
+            if t == table and (t, source_id) not in created
+        )
+        if ids:
+            conn.execute(
+                db.text(
+                    f"""
+                    UPDATE {table} SET qty = {table}.qty - r.qty, time_updated = now()
+                    FROM unnest(CAST(:ids AS integer[]), CAST(:qty AS integer[]))
+                        AS r(id, qty)
+                    WHERE {table}.id = r.id
+                    """
+                ),
+                ids=ids,
+                qty=[qty[(table, source_id)] for source_id in ids],
+            )
+        created_ids = sorted(source_id for t, source_id in created if t == table)
+        if created_ids:
+            deleted = conn.execute(
+                db.text(f"DELETE FROM {table} WHERE id = ANY(CAST(:ids AS integer[]))"),
+                ids=created_ids,
+            ).rowcount
+            bump_row_count(conn, table, -deleted)
+
+
+def drain_movement_queue(conn, batch_size=1000):
+    """Apply up to `batch_size` pending queue rows, oldest first, and return
+    (applied, rejected) counts.
+
+    Rows locked by another worker are skipped. The net delta per stock row
+    is applied with apply_deltas, so the ledger gets one row per stock row
+    and batch, against the movement table the rows came from.
+    Applied rows are deleted. Rows whose outflow can no longer be covered
+    are kept with status 'rejected' and the reason in `error`, and their
+    quantity is taken back off the movement that queued them (see
+    _undo_movements).
+    """
+    entries = conn.execute(
+        db.text(
+            """
+            SELECT id, kind, item_id, from_location_id, to_location_id, qty,
+                   source, source_id, creates_source
+            FROM movement_queue
+            WHERE status = 'pending'
+            ORDER BY id
+            LIMIT :n
+            FOR UPDATE SKIP LOCKED
+            """
+        ),
+        n=batch_size,
+    ).fetchall()
+    by_kind = defaultdict(list)
+    for entry in entries:
+        by_kind[entry.kind].append(entry)
+    for kind, kind_entries in by_kind.items():
+        # applied or rejected, the entries leave the projected balances
+        stock_cache.touch(conn, kind, _coalesce(kind_entries))
+    applied, rejected = [], []
+    # one pass per kind, in a fixed order, so that concurrent workers lock
+    # stock rows in the same order and cannot deadlock
+    for kind in sorted(by_kind):
+        sources = {entry.source for entry in by_kind[kind]}
+        source = sources.pop() if len(sources) == 1 else "movement_queue"
+        kind_applied, kind_rejected = _apply_kind(conn, kind, source, by_kind[kind])
+        applied.extend(kind_applied)
+        rejected.extend(kind_rejected)
+    if applied:
+        conn.execute(
+            db.text(
+                "DELETE FROM movement_queue WHERE id = ANY(CAST(:ids AS bigint[]))"
+            ),
+            ids=applied,
+        )
+    if rejected:
+        conn.execute(
+            db.text(
+                """
+                UPDATE movement_queue
+                SET status = 'rejected', error = r.error, time_updated = now()
+                FROM unnest(CAST(:ids AS bigint[]), CAST(:errors AS text[]))
+                    AS r(id, error)
+                WHERE movement_queue.id = r.id
+                """
+            ),
+            ids=[entry.id for entry, _ in rejected],
+            errors=[error for _, error in rejected],
+        )
+        # the movement triggers lock their rollups after the stock rows
+        # here, against the order transfer orders take them; the worker
+        # runs the drain again if the two deadlock
+        _undo_movements(conn, [entry for entry, _ in rejected])
+    return len(applied), len(rejected)
+
+
+def queue_stats(conn):
+    """Pending and rejected queue rows, and the age in seconds of the oldest
+    pending one (the worker's lag, 0 when the queue is drained)."""
+    row = conn.execute(
+        db.text(
+            """
+            SELECT count(*) FILTER (WHERE status = 'pending'),
+                   count(*) FILTER (WHERE status = 'rejected'),
+                   COALESCE(EXTRACT(EPOCH FROM now() - MIN(time_created)
+                                    FILTER (WHERE status = 'pending')), 0)
+            FROM movement_queue
+            """
+        )
+    ).fetchone()
+    return {"pending": row[0], "rejected": row[1], "lag_seconds": float(row[2])}
@@ -0,0 +1,155 @@
+"""Rows the stock tests seed, and their removal afterwards.
+
+The tests need a migrated PostgreSQL database in DATABASE_URL and skip
+without one.
+"""
+import os
+import unittest
+import uuid
+
+needs_postgres = unittest.skipUnless(
+    os.environ.get("DATABASE_URL", "").startswith("postgres"),
+    "needs a PostgreSQL DATABASE_URL",
+)
+
+
+class StockTestCase(unittest.TestCase):
+    """Seeds locations, raw materials and products named after a per-test
+    tag, and deletes them with every row that refers to them afterwards."""
+
+    @classmethod
+    def setUpClass(cls):
+        global app, db, bump_row_count, stock_balance
+        from app import app
+        from app_init import db
+        from inventory.counts import bump_row_count
+        from inventory.stock import stock_balance
+
+    def setUp(self):
+        self.tag = f"test-{uuid.uuid4().hex[:8]}"
+        self.location_ids = []
+        self.item_ids = {"product": [], "raw_material": []}
+
+    def tearDown(self):
+        product_ids = self.item_ids["product"]
+        raw_material_ids = self.item_ids["raw_material"]
+        with db.engine.begin() as conn:
+            for kind, ids in self.item_ids.items():
+                conn.execute(
+                    db.text(
+                        "DELETE FROM movement_queue "
+                        "WHERE kind = :kind AND item_id = ANY(:ids)"
+                    ),
+                    kind=kind,
+                    ids=ids,
+                )
+                deleted = conn.execute(
+                    db.text(f"DELETE FROM {kind}_movement WHERE {kind}_id = ANY(:ids)"),
+                    ids=ids,
+                ).rowcount
+                bump_row_count(conn, f"{kind}_movement", -deleted)
+                for table in (
+                    f"{kind}_movement_daily",
+                    f"{kind}_stock_ledger",
+                    f"{kind}_stock_snapshot",
+                    f"{kind}_stock_shard",
+                    f"{kind}_stock",
+                ):
+                    conn.execute(
+                        db.text(f"DELETE FROM {table} WHERE {kind}_id = ANY(:ids)"),
+                        ids=ids,
+                    )
+            conn.execute(
+                db.text("DELETE FROM product_manufacturing WHERE product_id = ANY(:p)"),
+                p=product_ids,
+            )
+            conn.execute(
+                db.text(
+                    "DELETE FROM product_raw_material "
+                    "WHERE product_id = ANY(:p) OR raw_material_id = ANY(:r)"
+                ),
+                p=product_ids,
+                r=raw_material_ids,
+            )
+            conn.execute(
+                db.text("DELETE FROM product WHERE id = ANY(:p)"), p=product_ids
+            )
+            conn.execute(
+                db.text("DELETE FROM raw_material WHERE id = ANY(:r)"),
+                r=raw_material_ids,
+            )
+            conn.execute(
+                db.text("DELETE FROM location WHERE id = ANY(:l)"), l=self.location_ids
+            )
+
+    def add_locations(self, n):
+        with db.engine.begin() as conn:
+            ids = [
+                row[0]
+                for row in conn.execute(
+                    db.text(
+                        "INSERT INTO location (name) "
+                        "SELECT :tag || '-location-' || (:start + i) "
+                        "FROM generate_series(1, :n) i ORDER BY i RETURNING id"
+                    ),
+                    tag=self.tag,
+                    start=len(self.location_ids),
+                    n=n,
+                )
+            ]
+        self.location_ids.extend(ids)
+        return ids
+
+    def add_raw_material(self):
+        with db.engine.begin() as conn:
+            raw_material_id = conn.execute(
+                db.text(
+                    "INSERT INTO raw_material (name) "
+                    "VALUES (:tag || '-raw-material-' || :n) RETURNING id"
+                ),
+                tag=self.tag,
+                n=len(self.item_ids["raw_material"]),
+            ).scalar()
+        self.item_ids["raw_material"].append(raw_material_id)
+        return raw_material_id
+
+    def add_product(self, bom):
+        """A product made from the {raw_material_id: quantity} `bom`; like
+        the admin, its quantity per batch is the total of the bom."""
+        from inventory import refresh_bom
+
+        with db.engine.begin() as conn:
+            product_id = conn.execute(
+                db.text(
+                    "INSERT INTO product (name, quantity) "
+                    "VALUES (:tag || '-product-' || :n, 0) RETURNING id"
+                ),
+                tag=self.tag,
+                n=len(self.item_ids["product"]),
+            ).scalar()
+            for raw_material_id, raw_material_quantity in sorted(bom.items()):
+                conn.execute(
+                    db.text(
+                        """
+                        INSERT INTO product_raw_material
+                            (name, product_id, raw_material_id, raw_material_quantity)
+                        VALUES (:tag || '-bom-' || :p || '-' || :r, :p, :r, :q)
+                        """
+                    ),
+                    tag=self.tag,
+                    p=product_id,
+                    r=raw_material_id,
+                    q=raw_material_quantity,
+                )
+            refresh_bom(conn, [product_id])
+        self.item_ids["product"].append(product_id)
+        return product_id
+
+    def balances(self, kind, item_id):
+        """The stock of an item at each seeded location, None where it has
+        none."""
+        with db.engine.connect() as conn:
+            return [
+                stock_balance(conn, kind, location_id, item_id)
+                for location_id in self.location_ids
+            ]
@@ -0,0 +1,135 @@
+"""Bulk movement ingestion (inventory.ingest, POST /api/movements/<kind>/bulk).
+
+Needs a migrated PostgreSQL database in DATABASE_URL:
+
+    DATABASE_URL=postgresql://... python -m unittest discover tests
+"""
+import json
+import unittest
+
+from tests.support import StockTestCase, needs_postgres
+
+# a location id no test creates
+UNKNOWN_ID = 2 ** 31 - 1
+
+
+@needs_postgres
+class IngestTest(StockTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(IngestTest, cls).setUpClass()
+        global app, db, compare_stock
+        from app import app
+        from app_init import db
+        from inventory.reconciliation import compare_stock
+
+    def setUp(self):
+        super(IngestTest, self).setUp()
+        self.l1, self.l2 = self.add_locations(2)
+        self.raw_material_id = self.add_raw_material()
+        self.client = app.test_client()
+
+    def post(self, rows, **args):
+        response = self.client.post(
+            "/api/movements/raw-material/bulk",
+            query_string=args,
+            data="\n".join(
+                row if isinstance(row, str) else json.dumps(row) for row in rows
+            ),
+            content_type="application/x-ndjson",
+        )
+        self.assertEqual(response.status_code, 200, response.get_data())
+        return response.get_json()
+
+    def move(self, from_location_id, to_location_id, qty):
+        return {
+            "raw_material_id": self.raw_material_id,
+            "from_location_id": from_location_id,
+            "to_location_id": to_location_id,
+            "qty": qty,
+        }
+
+    def movements(self):
+        with db.engine.connect() as conn:
+            return conn.execute(
+                db.text(
+                    "SELECT from_location_id, to_location_id, qty "
+                    "FROM raw_material_movement WHERE raw_material_id = :r ORDER BY id"
+                ),
+                r=self.raw_material_id,
+            ).fetchall()
+
+    def differences(self):
+        with db.engine.connect() as conn:
+            _, differences = compare_stock(conn, "raw_material", self.location_ids)
+        return differences
+
+    def test_bad_rows_are_rejected_and_the_rest_committed(self):
+        result = self.post(
+            [
+                self.move(None, self.l1, 10),
+                "{not json",
+                dict(self.move(None, self.l1, 5), qty="five"),
+                self.move(UNKNOWN_ID, self.l2, 1),
+                self.move(self.l1, self.l2, 6),
+            ]
+        )
+
+        self.assertEqual((result["accepted"], result["rejected"]), (2, 3))
+        self.assertEqual(
+            [row["status"] for row in result["results"]],
+            ["accepted", "rejected", "rejected", "rejected", "accepted"],
+        )
+        self.assertIn("Invalid JSON", result["results"][1]["errors"][0])
+        self.assertEqual(result["results"][2]["errors"], ['"qty" must be an integer'])
+        self.assertEqual(
+            result["results"][3]["errors"],
+            [f'Unknown "from_location_id": {UNKNOWN_ID}'],
+        )
+        self.assertEqual(self.movements(), [(None, self.l1, 10), (self.l1, self.l2, 6)])
+        self.assertEqual(self.balances("raw_material", self.raw_material_id), [4, 6])
+        self.assertEqual(self.differences(), [])
+
+    def test_outflows_are_replayed_in_order(self):
+        # the second 6 no longer fits once the first is taken; the 3 after
+        # it still does
+        result = self.post(
+            [
+                self.move(None, self.l1, 10),
+                self.move(self.l1, self.l2, 6),
+                self.move(self.l1, self.l2, 6),
+                self.move(self.l1, self.l2, 3),
+            ]
+        )
+
+        self.assertEqual(
+            [row["status"] for row in result["results"]],
+            ["accepted", "accepted", "rejected", "accepted"],
+        )
+        self.assertEqual(
+            result["results"][2]["errors"],
+            [f"Insufficient stock at location {self.l1}, available: 4"],
+        )
+        self.assertEqual(self.balances("raw_material", self.raw_material_id), [1, 9])
+        self.assertEqual(len(self.movements()), 3)
+        self.assertEqual(self.differences(), [])
+
+    def test_each_batch_commits_on_its_own(self):
+        result = self.post(
+            [
+                self.move(None, self.l1, 3),
+                self.move(self.l1, self.l2, 5),
+                self.move(None, self.l1, 2),
+            ],
+            batch_size=2,
+        )
+
+        self.assertEqual(
+            [(row["row"], row["status"]) for row in result["results"]],
+            [(1, "accepted"), (2, "rejected"), (3, "accepted")],
+        )
+        self.assertEqual(self.balances("raw_material", self.raw_material_id), [5, None])
+
+
+if __name__ == "__main__":
+    unittest.main()
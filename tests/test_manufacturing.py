@@ -0,0 +1,107 @@
+"""Set-based manufacturing runs (inventory.manufacturing).
+
+Needs a migrated PostgreSQL database in DATABASE_URL:
+
+    DATABASE_URL=postgresql://... python -m unittest discover tests
+"""
+import unittest
+
+from tests.support import StockTestCase, needs_postgres
+
+
+@needs_postgres
+class ManufactureTest(StockTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(ManufactureTest, cls).setUpClass()
+        global db, apply_deltas, manufacture, validators
+        from app_init import db
+        from inventory import manufacture
+        from inventory.stock import apply_deltas
+        from wtforms import validators
+
+    def setUp(self):
+        super(ManufactureTest, self).setUp()
+        [self.location_id] = self.add_locations(1)
+        self.flour, self.sugar = self.add_raw_material(), self.add_raw_material()
+        # 5 cakes a batch, from 3 flour and 2 sugar
+        self.cake = self.add_product({self.flour: 3, self.sugar: 2})
+        with db.engine.begin() as conn:
+            apply_deltas(
+                conn,
+                "raw_material",
+                {(self.location_id, self.flour): 10, (self.location_id, self.sugar): 5},
+            )
+
+    def manufacture(self, conn, batch_size):
+        return manufacture(
+            conn,
+            product_id=self.cake,
+            location_id=self.location_id,
+            location_name=self.tag,
+            batch_size=batch_size,
+        )
+
+    def stock(self):
+        return (
+            self.balances("raw_material", self.flour)
+            + self.balances("raw_material", self.sugar)
+            + self.balances("product", self.cake)
+        )
+
+    def ledger(self, conn, kind, item_id):
+        return conn.execute(
+            db.text(
+                f"SELECT delta, balance, source FROM {kind}_stock_ledger "
+                f"WHERE {kind}_id = :i ORDER BY id"
+            ),
+            i=item_id,
+        ).fetchall()
+
+    def test_consumes_the_bill_of_materials(self):
+        with db.engine.begin() as conn:
+            self.assertEqual(self.manufacture(conn, 2), 10)
+
+        self.assertEqual(self.stock(), [4, 1, 10])
+        with db.engine.connect() as conn:
+            self.assertEqual(
+                self.ledger(conn, "raw_material", self.flour)[-1],
+                (-6, 4, "product_manufacturing"),
+            )
+            self.assertEqual(
+                self.ledger(conn, "product", self.cake),
+                [(10, 10, "product_manufacturing")],
+            )
+
+    def test_shortfall_leaves_stock_unchanged(self):
+        # 4 batches need 12 flour and 8 sugar: both short
+        with db.engine.connect() as conn:
+            with conn.begin():
+                with self.assertRaises(validators.ValidationError) as raised:
+                    self.manufacture(conn, 4)
+                # nothing was written before the shortfall was found, even
+                # in the transaction that found it
+                self.assertEqual(self.ledger(conn, "product", self.cake), [])
+
+        message = str(raised.exception)
+        self.assertIn("available: 10, needed: 12", message)
+        self.assertIn("available: 5, needed: 8", message)
+        self.assertEqual(self.stock(), [10, 5, None])
+
+    def test_product_without_raw_materials_is_refused(self):
+        empty = self.add_product({})
+        with db.engine.begin() as conn:
+            with self.assertRaises(validators.ValidationError):
+                manufacture(
+                    conn,
+                    product_id=empty,
+                    location_id=self.location_id,
+                    location_name=self.tag,
+                    batch_size=1,
+                )
+
+        self.assertEqual(self.balances("product", empty), [None])
+
+
+if __name__ == "__main__":
+    unittest.main()
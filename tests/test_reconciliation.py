@@ -0,0 +1,112 @@
+"""Stock reconciliation (inventory.reconciliation).
+
+Needs a migrated PostgreSQL database in DATABASE_URL:
+
+    DATABASE_URL=postgresql://... python -m unittest discover tests
+"""
+import unittest
+
+from tests.support import StockTestCase, needs_postgres
+
+
+@needs_postgres
+class ReconciliationTest(StockTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(ReconciliationTest, cls).setUpClass()
+        global app, db, compare_stock, repair_stock, RECONCILIATION_SOURCE
+        from app import app
+        from app_init import db
+        from inventory.reconciliation import (
+            RECONCILIATION_SOURCE,
+            compare_stock,
+            repair_stock,
+        )
+
+    def setUp(self):
+        super(ReconciliationTest, self).setUp()
+        self.l1, self.l2 = self.add_locations(2)
+        self.flour = self.add_raw_material()
+        self.bread = self.add_product({self.flour: 2})
+        self.client = app.test_client()
+        self.write_behind = app.config["MOVEMENT_WRITE_BEHIND"]
+        app.config["MOVEMENT_WRITE_BEHIND"] = False
+        # 20 flour in, 5 of it moved on, 3 batches of bread made from 6
+        for from_location_id, to_location_id, qty in [
+            (None, self.l1, 20),
+            (self.l1, self.l2, 5),
+        ]:
+            response = self.client.post(
+                "/rawmaterialmovement/new/",
+                data={
+                    "raw_material": self.flour,
+                    "from_location": from_location_id or "",
+                    "to_location": to_location_id,
+                    "qty": qty,
+                },
+            )
+            self.assertEqual(response.status_code, 302)
+        response = self.client.post(
+            "/productmanufacturing/new/",
+            data={"product": self.bread, "to_location": self.l1, "batch_size": 3},
+        )
+        self.assertEqual(response.status_code, 302)
+
+    def tearDown(self):
+        app.config["MOVEMENT_WRITE_BEHIND"] = self.write_behind
+        super(ReconciliationTest, self).tearDown()
+
+    def compare(self, kind, keys=None):
+        with db.engine.connect() as conn:
+            return compare_stock(conn, kind, self.location_ids, keys)
+
+    def drift(self, location_id, delta):
+        # a write that bypassed the movements
+        with db.engine.begin() as conn:
+            conn.execute(
+                db.text(
+                    "UPDATE raw_material_stock "
+                    "SET available_stock = available_stock + :delta "
+                    "WHERE location_id = :l AND raw_material_id = :r"
+                ),
+                delta=delta,
+                l=location_id,
+                r=self.flour,
+            )
+
+    def test_history_and_stock_agree(self):
+        self.assertEqual(self.balances("raw_material", self.flour), [9, 5])
+        self.assertEqual(self.balances("product", self.bread), [6, None])
+        self.assertEqual(self.compare("raw_material"), (2, []))
+        self.assertEqual(self.compare("product"), (1, []))
+
+    def test_drift_is_reported_and_repaired(self):
+        self.drift(self.l2, 4)
+
+        self.assertEqual(
+            self.compare("raw_material"), (2, [(self.l2, self.flour, 5, 9)])
+        )
+        self.assertEqual(
+            self.compare("raw_material", keys=[(self.l2, self.flour)]),
+            (1, [(self.l2, self.flour, 5, 9)]),
+        )
+        with db.engine.begin() as conn:
+            repaired = repair_stock(conn, "raw_material", [(self.l2, self.flour)])
+
+        self.assertEqual(repaired, [(self.l2, self.flour, 5, 9)])
+        self.assertEqual(self.balances("raw_material", self.flour), [9, 5])
+        self.assertEqual(self.compare("raw_material"), (2, []))
+        with db.engine.connect() as conn:
+            correction = conn.execute(
+                db.text(
+                    "SELECT location_id, delta, balance FROM raw_material_stock_ledger "
+                    "WHERE raw_material_id = :r AND source = :source"
+                ),
+                r=self.flour,
+                source=RECONCILIATION_SOURCE,
+            ).fetchall()
+        self.assertEqual(correction, [(self.l2, -4, 5)])
+
+
+if __name__ == "__main__":
+    unittest.main()
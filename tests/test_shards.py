@@ -0,0 +1,90 @@
+"""Sharded stock rows (inventory.stock set_stock_shards, fold_stock_shards).
+
+Needs a migrated PostgreSQL database in DATABASE_URL:
+
+    DATABASE_URL=postgresql://... python -m unittest discover tests
+"""
+import unittest
+
+from tests.support import StockTestCase, needs_postgres
+
+
+@needs_postgres
+class StockShardTest(StockTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(StockShardTest, cls).setUpClass()
+        global db, apply_delta, apply_deltas, fold_stock_shards, set_stock_shards
+        from app_init import db
+        from inventory.stock import (
+            apply_delta,
+            apply_deltas,
+            fold_stock_shards,
+            set_stock_shards,
+        )
+
+    def setUp(self):
+        super(StockShardTest, self).setUp()
+        [self.location_id] = self.add_locations(1)
+        self.raw_material_id = self.add_raw_material()
+        self.key = (self.location_id, self.raw_material_id)
+        with db.engine.begin() as conn:
+            apply_deltas(conn, "raw_material", {self.key: 103})
+            set_stock_shards(conn, "raw_material", *self.key, 4)
+
+    def parts(self):
+        """The stock left in the row itself, and in each shard."""
+        with db.engine.connect() as conn:
+            row = conn.execute(
+                db.text(
+                    "SELECT available_stock FROM raw_material_stock "
+                    "WHERE location_id = :l AND raw_material_id = :r"
+                ),
+                l=self.location_id,
+                r=self.raw_material_id,
+            ).scalar()
+            shards = conn.execute(
+                db.text(
+                    "SELECT available_stock FROM raw_material_stock_shard "
+                    "WHERE location_id = :l AND raw_material_id = :r ORDER BY shard"
+                ),
+                l=self.location_id,
+                r=self.raw_material_id,
+            ).fetchall()
+        return row, [shard[0] for shard in shards]
+
+    def test_sharding_spreads_the_stock_evenly(self):
+        self.assertEqual(self.parts(), (3, [25, 25, 25, 25]))
+        self.assertEqual(self.balances("raw_material", self.raw_material_id), [103])
+
+    def test_folding_keeps_the_total(self):
+        with db.engine.begin() as conn:
+            # inflows land in one shard, and unbalance them
+            for _ in range(5):
+                apply_delta(conn, "raw_material", *self.key, 7)
+        self.assertEqual(sum(self.parts()[1]) + self.parts()[0], 138)
+
+        with db.engine.begin() as conn:
+            self.assertEqual(fold_stock_shards(conn, "raw_material", [self.key]), 1)
+
+        self.assertEqual(self.parts(), (2, [34, 34, 34, 34]))
+        self.assertEqual(self.balances("raw_material", self.raw_material_id), [138])
+
+    def test_outflow_larger_than_any_shard_folds_them(self):
+        with db.engine.begin() as conn:
+            self.assertEqual(apply_delta(conn, "raw_material", *self.key, -90), 13)
+            self.assertIsNone(apply_delta(conn, "raw_material", *self.key, -14))
+
+        row, shards = self.parts()
+        self.assertEqual(row + sum(shards), 13)
+        self.assertEqual(len(shards), 4)
+
+    def test_unsharding_folds_everything_into_the_row(self):
+        with db.engine.begin() as conn:
+            set_stock_shards(conn, "raw_material", *self.key, 0)
+
+        self.assertEqual(self.parts(), (103, []))
+
+
+if __name__ == "__main__":
+    unittest.main()
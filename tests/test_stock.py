@@ -0,0 +1,132 @@
+"""Guarded stock writes (inventory.stock apply_delta and apply_deltas).
+
+Needs a migrated PostgreSQL database in DATABASE_URL:
+
+    DATABASE_URL=postgresql://... python -m unittest discover tests
+"""
+import threading
+import time
+import unittest
+
+from tests.support import StockTestCase, needs_postgres
+
+
+@needs_postgres
+class StockWriteTest(StockTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(StockWriteTest, cls).setUpClass()
+        global db, apply_delta, apply_deltas
+        from app_init import db
+        from inventory.stock import apply_delta, apply_deltas
+
+    def setUp(self):
+        super(StockWriteTest, self).setUp()
+        self.l1, self.l2 = self.add_locations(2)
+        self.raw_material_id = self.add_raw_material()
+
+    def key(self, location_id):
+        return (location_id, self.raw_material_id)
+
+    def stock(self):
+        return self.balances("raw_material", self.raw_material_id)
+
+    def ledger(self):
+        with db.engine.connect() as conn:
+            return conn.execute(
+                db.text(
+                    "SELECT location_id, delta, balance, source "
+                    "FROM raw_material_stock_ledger "
+                    "WHERE raw_material_id = :r ORDER BY id"
+                ),
+                r=self.raw_material_id,
+            ).fetchall()
+
+    def test_apply_delta_upserts_and_guards_outflows(self):
+        with db.engine.begin() as conn:
+            self.assertEqual(
+                apply_delta(conn, "raw_material", self.l1, self.raw_material_id, 5), 5,
+            )
+            self.assertEqual(
+                apply_delta(conn, "raw_material", self.l1, self.raw_material_id, -2), 3,
+            )
+            # neither more than there is, nor anything from a location
+            # without a stock row
+            self.assertIsNone(
+                apply_delta(conn, "raw_material", self.l1, self.raw_material_id, -4)
+            )
+            self.assertIsNone(
+                apply_delta(conn, "raw_material", self.l2, self.raw_material_id, -1)
+            )
+
+        self.assertEqual(self.stock(), [3, None])
+        self.assertEqual(self.ledger(), [(self.l1, 5, 5, None), (self.l1, -2, 3, None)])
+
+    def test_apply_deltas_writes_nothing_on_a_shortfall(self):
+        with db.engine.begin() as conn:
+            self.assertEqual(
+                apply_deltas(conn, "raw_material", {self.key(self.l1): 4}), {}
+            )
+            shortfalls = apply_deltas(
+                conn,
+                "raw_material",
+                {self.key(self.l1): -5, self.key(self.l2): 5},
+                source="test",
+            )
+
+        self.assertEqual(shortfalls, {self.key(self.l1): 4})
+        self.assertEqual(self.stock(), [4, None])
+        self.assertEqual(self.ledger(), [(self.l1, 4, 4, None)])
+
+    def test_apply_deltas_locks_in_key_order(self):
+        with db.engine.begin() as conn:
+            apply_deltas(
+                conn, "raw_material", {self.key(self.l1): 10, self.key(self.l2): 10}
+            )
+        second = {}
+
+        def batch():
+            with db.engine.begin() as conn:
+                second["pid"] = conn.execute(
+                    db.text("SELECT pg_backend_pid()")
+                ).scalar()
+                # keys in the reverse of their order
+                second["shortfalls"] = apply_deltas(
+                    conn, "raw_material", {self.key(self.l2): 1, self.key(self.l1): 1}
+                )
+
+        with db.engine.connect() as conn:
+            with conn.begin():
+                conn.execute(db.text("SET LOCAL lock_timeout = '5s'"))
+                apply_delta(conn, "raw_material", self.l1, self.raw_material_id, -1)
+                thread = threading.Thread(target=batch)
+                thread.start()
+                self.wait_for_lock(conn, second)
+                # the batch waits on l1 before it locks l2, so l2 is free;
+                # locking in the order given would deadlock here
+                apply_delta(conn, "raw_material", self.l2, self.raw_material_id, -1)
+            thread.join(10)
+
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(second["shortfalls"], {})
+        self.assertEqual(self.stock(), [10, 10])
+
+    def wait_for_lock(self, conn, second):
+        for _ in range(500):
+            if (
+                "pid" in second
+                and conn.execute(
+                    db.text(
+                        "SELECT wait_event_type = 'Lock' FROM pg_stat_activity "
+                        "WHERE pid = :pid"
+                    ),
+                    pid=second["pid"],
+                ).scalar()
+            ):
+                return
+            time.sleep(0.01)
+        self.fail("the second batch never waited for the first")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,193 @@
+"""Retries of the stock-changing admin views (view_models.transactions).
+
+Needs a migrated PostgreSQL database in DATABASE_URL; the rows it seeds are
+deleted afterwards:
+
+    DATABASE_URL=postgresql://... python -m unittest discover tests
+"""
+import os
+import unittest
+import uuid
+from unittest import mock
+
+from sqlalchemy.exc import DBAPIError
+
+
+@unittest.skipUnless(
+    os.environ.get("DATABASE_URL", "").startswith("postgres"),
+    "needs a PostgreSQL DATABASE_URL",
+)
+class TransactionalMixinTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        global app, db, ModelViewRawMaterialMovement
+        global apply_deltas, bump_row_count, stock_balance
+        from app import app
+        from app_init import db
+        from inventory.counts import bump_row_count
+        from inventory.stock import apply_deltas, stock_balance
+        from view_models import ModelViewRawMaterialMovement
+
+        app.config["MOVEMENT_WRITE_BEHIND"] = False
+
+    def setUp(self):
+        self.tag = f"test-{uuid.uuid4().hex[:8]}"
+        with db.engine.begin() as conn:
+            self.location_ids = [
+                row[0]
+                for row in conn.execute(
+                    db.text(
+                        "INSERT INTO location (name) SELECT :tag || '-' || i "
+                        "FROM generate_series(1, 2) i ORDER BY i RETURNING id"
+                    ),
+                    tag=self.tag,
+                )
+            ]
+            self.raw_material_id = conn.execute(
+                db.text("INSERT INTO raw_material (name) VALUES (:tag) RETURNING id"),
+                tag=self.tag,
+            ).scalar()
+            apply_deltas(
+                conn,
+                "raw_material",
+                {(self.location_ids[0], self.raw_material_id): 100},
+            )
+        self.client = app.test_client()
+        # what each call of on_model_change found in the session
+        self.sessions = []
+
+    def tearDown(self):
+        with db.engine.begin() as conn:
+            deleted = conn.execute(
+                db.text("DELETE FROM raw_material_movement WHERE raw_material_id = :r"),
+                r=self.raw_material_id,
+            ).rowcount
+            bump_row_count(conn, "raw_material_movement", -deleted)
+            for table in (
+                "raw_material_movement_daily",
+                "raw_material_stock_ledger",
+                "raw_material_stock",
+            ):
+                conn.execute(
+                    db.text(f"DELETE FROM {table} WHERE raw_material_id = :r"),
+                    r=self.raw_material_id,
+                )
+            conn.execute(
+                db.text("DELETE FROM raw_material WHERE id = :r"),
+                r=self.raw_material_id,
+            )
+            conn.execute(
+                db.text("DELETE FROM location WHERE id = ANY(:l)"), l=self.location_ids
+            )
+
+    def deadlock(self, failures):
+        """Patch on_model_change to do its work and then fail with a
+        deadlock, the first `failures` times it is called."""
+        on_model_change = ModelViewRawMaterialMovement.on_model_change
+
+        class Deadlock(Exception):
+            pgcode = "40P01"
+
+        def failing(view, form, model, is_created):
+            self.sessions.append(
+                (
+                    sorted(str(o) for o in db.session.new),
+                    sorted(str(o) for o in db.session.dirty),
+                    sorted(str(o) for o in db.session.deleted),
+                )
+            )
+            on_model_change(view, form, model, is_created)
+            if len(self.sessions) <= failures:
+                raise DBAPIError("UPDATE raw_material_stock ...", {}, Deadlock())
+
+        return mock.patch.object(
+            ModelViewRawMaterialMovement, "on_model_change", failing
+        )
+
+    def create(self, qty):
+        return self.client.post(
+            "/rawmaterialmovement/new/",
+            data={
+                "raw_material": self.raw_material_id,
+                "from_location": self.location_ids[0],
+                "to_location": self.location_ids[1],
+                "qty": qty,
+            },
+        )
+
+    def balances(self):
+        with db.engine.connect() as conn:
+            return [
+                stock_balance(conn, "raw_material", location_id, self.raw_material_id)
+                for location_id in self.location_ids
+            ]
+
+    def movements(self):
+        with db.engine.connect() as conn:
+            return conn.execute(
+                db.text(
+                    "SELECT id, qty FROM raw_material_movement "
+                    "WHERE raw_material_id = :r ORDER BY id"
+                ),
+                r=self.raw_material_id,
+            ).fetchall()
+
+    def ledger_rows(self):
+        with db.engine.connect() as conn:
+            return conn.execute(
+                db.text(
+                    "SELECT count(*) FROM raw_material_stock_ledger "
+                    "WHERE raw_material_id = :r"
+                ),
+                r=self.raw_material_id,
+            ).scalar()
+
+    def test_create_is_retried_after_a_deadlock(self):
+        with self.deadlock(failures=1):
+            response = self.create(30)
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(len(self.sessions), 2)
+        # the retry starts from a clean session: nothing of the rolled back
+        # attempt is left pending in it
+        self.assertEqual(self.sessions[0], self.sessions[1])
+        self.assertEqual([qty for _, qty in self.movements()], [30])
+        self.assertEqual(self.balances(), [70, 30])
+        # the seed, and the two sides of the one committed movement
+        self.assertEqual(self.ledger_rows(), 3)
+        self.assertEqual(db.engine.pool.checkedout(), 0)
+
+    def test_update_is_retried_after_a_deadlock(self):
+        self.assertEqual(self.create(30).status_code, 302)
+        [(movement_id, _)] = self.movements()
+
+        with self.deadlock(failures=1):
+            response = self.client.post(
+                "/rawmaterialmovement/ajax/update/",
+                data={"list_form_pk": movement_id, "qty": 45},
+            )
+
+        self.assertEqual(response.status_code, 200, response.get_data())
+        self.assertEqual(len(self.sessions), 2)
+        self.assertEqual(self.sessions[0], self.sessions[1])
+        self.assertEqual(self.movements(), [(movement_id, 45)])
+        # the retry moves the difference to the stored quantity again, not
+        # nothing because the rollback expired the model
+        self.assertEqual(self.balances(), [55, 45])
+        self.assertEqual(db.engine.pool.checkedout(), 0)
+
+    def test_gives_up_after_the_configured_attempts(self):
+        with self.deadlock(failures=100):
+            response = self.create(30)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b"Failed to save record", response.get_data())
+        self.assertEqual(len(self.sessions), app.config["TRANSACTION_RETRIES"])
+        self.assertEqual(self.movements(), [])
+        self.assertEqual(self.balances(), [100, None])
+        self.assertEqual(self.ledger_rows(), 1)
+        self.assertEqual(db.engine.pool.checkedout(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,134 @@
+"""The movement queue of write-behind mode (inventory.write_behind).
+
+Needs a migrated PostgreSQL database in DATABASE_URL:
+
+    DATABASE_URL=postgresql://... python -m unittest discover tests
+"""
+import unittest
+from unittest import mock
+
+from tests.support import StockTestCase, needs_postgres
+
+
+@needs_postgres
+class WriteBehindTest(StockTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(WriteBehindTest, cls).setUpClass()
+        global app, db, compare_stock, drain_movement_queue, stock_balance
+        from app import app
+        from app_init import db
+        from inventory.reconciliation import compare_stock
+        from inventory.stock import stock_balance
+        from inventory.write_behind import drain_movement_queue
+
+    def setUp(self):
+        super(WriteBehindTest, self).setUp()
+        self.l1, self.l2 = self.add_locations(2)
+        self.raw_material_id = self.add_raw_material()
+        self.client = app.test_client()
+        self.write_behind = app.config["MOVEMENT_WRITE_BEHIND"]
+        # the opening stock is a movement too, for reconciliation to count
+        app.config["MOVEMENT_WRITE_BEHIND"] = False
+        self.assertEqual(self.create(None, self.l1, 10).status_code, 302)
+        app.config["MOVEMENT_WRITE_BEHIND"] = True
+
+    def tearDown(self):
+        app.config["MOVEMENT_WRITE_BEHIND"] = self.write_behind
+        super(WriteBehindTest, self).tearDown()
+
+    def create(self, from_location_id, to_location_id, qty):
+        return self.client.post(
+            "/rawmaterialmovement/new/",
+            data={
+                "raw_material": self.raw_material_id,
+                "from_location": from_location_id or "",
+                "to_location": to_location_id or "",
+                "qty": qty,
+            },
+        )
+
+    def racing(self):
+        """Have the queue check see only the committed stock, as two
+        requests queueing at the same time do."""
+        return mock.patch(
+            "inventory.write_behind.projected_balance",
+            lambda conn, kind, location_id, item_id: stock_balance(
+                conn, kind, location_id, item_id
+            )
+            or 0,
+        )
+
+    def drain(self):
+        with db.engine.begin() as conn:
+            return drain_movement_queue(conn)
+
+    def movements(self):
+        with db.engine.connect() as conn:
+            return conn.execute(
+                db.text(
+                    "SELECT from_location_id, to_location_id, qty "
+                    "FROM raw_material_movement WHERE raw_material_id = :r ORDER BY id"
+                ),
+                r=self.raw_material_id,
+            ).fetchall()
+
+    def differences(self):
+        with db.engine.connect() as conn:
+            _, differences = compare_stock(conn, "raw_material", self.location_ids)
+        return differences
+
+    def test_rejected_entry_leaves_stock_and_movements_consistent(self):
+        with self.racing():
+            self.assertEqual(self.create(self.l1, self.l2, 10).status_code, 302)
+            self.assertEqual(self.create(self.l1, self.l2, 10).status_code, 302)
+
+        self.assertEqual(self.drain(), (1, 1))
+        self.assertEqual(self.balances("raw_material", self.raw_material_id), [0, 10])
+        # the rejected movement is gone, the applied one is kept
+        self.assertEqual(
+            self.movements(), [(None, self.l1, 10), (self.l1, self.l2, 10)]
+        )
+        self.assertEqual(self.differences(), [])
+
+    def test_rejected_edit_restores_the_quantity(self):
+        # a movement saved with nothing to move yet is kept as it is
+        self.assertEqual(self.create(self.l1, self.l2, 0).status_code, 302)
+        with db.engine.connect() as conn:
+            movement_id = conn.execute(
+                db.text(
+                    "SELECT id FROM raw_material_movement "
+                    "WHERE raw_material_id = :r AND qty = 0"
+                ),
+                r=self.raw_material_id,
+            ).scalar()
+        with self.racing():
+            self.assertEqual(self.create(self.l1, self.l2, 10).status_code, 302)
+            response = self.client.post(
+                "/rawmaterialmovement/ajax/update/",
+                data={"list_form_pk": movement_id, "qty": 8},
+            )
+            self.assertEqual(response.status_code, 200, response.get_data())
+
+        self.assertEqual(self.drain(), (1, 1))
+        self.assertEqual(self.balances("raw_material", self.raw_material_id), [0, 10])
+        self.assertEqual(
+            self.movements(),
+            [(None, self.l1, 10), (self.l1, self.l2, 0), (self.l1, self.l2, 10)],
+        )
+        self.assertEqual(self.differences(), [])
+
+    def test_pending_entries_are_not_drift(self):
+        self.assertEqual(self.create(self.l1, self.l2, 4).status_code, 302)
+
+        self.assertEqual(
+            self.balances("raw_material", self.raw_material_id), [10, None]
+        )
+        self.assertEqual(self.differences(), [])
+        self.assertEqual(self.drain(), (1, 0))
+        self.assertEqual(self.balances("raw_material", self.raw_material_id), [6, 4])
+        self.assertEqual(self.differences(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
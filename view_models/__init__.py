@@ -1,10 +1,60 @@
-from app_init import db, engine
+from app_init import app, db
 from db_models import *
 from flask_admin import Admin
 from flask_admin.contrib.sqla import ModelView
+from inventory import manufacture, move_stock, refresh_bom
+from inventory.counts import bump_row_count
+from inventory.transfers import post_transfer_order
+from inventory.write_behind import enqueue_movement
+from view_models.counts import CountStrategyMixin
+from view_models.dashboard import DashboardView
+from view_models.export import StreamingExportMixin
+from view_models.keyset import KeysetPaginationMixin
+from view_models.lookups import LookupCacheMixin, prefix_lookups
+from view_models.reports import MovementReportView
+from view_models.search import SearchMixin
+from view_models.transactions import TransactionalMixin
+from wtforms import validators
 
 
-class ModelViewProductManufacturing(ModelView):
+def move_stock_or_raise(
+    conn, kind, movement, item, from_location, to_location, qty, is_created
+):
+    args = (
+        conn,
+        kind,
+        item.id,
+        from_location.id if from_location else None,
+        to_location.id if to_location else None,
+        qty,
+    )
+    source = dict(source=movement.__tablename__, source_id=movement.id)
+    if app.config["MOVEMENT_WRITE_BEHIND"]:
+        # the stock rows are left to the movement queue worker, so hot items
+        # do not serialize requests on their row locks
+        shortfall = enqueue_movement(*args, creates_source=is_created, **source)
+    else:
+        shortfall = move_stock(*args, **source)
+    if shortfall:
+        location_id, available = shortfall
+        location = (
+            from_location
+            if from_location and from_location.id == location_id
+            else to_location
+        )
+        raise validators.ValidationError(
+            f'Stock of "{item.name}" available at "{location.name}" is {available}'
+        )
+
+
+def total_stock_formatter(view, context, model, name):
+    # a sharded stock row holds part of its stock in its shards
+    return model.total_stock
+
+
+class ModelViewProductManufacturing(
+    TransactionalMixin, StreamingExportMixin, ModelView
+):
     can_delete = False
     can_edit = False
     can_view_details = True
@@ -14,105 +64,67 @@ class ModelViewProductManufacturing(ModelView):
     can_set_page_size = True
     column_exclude_list = ["time_created", "time_updated"]
     form_excluded_columns = ["time_created", "time_updated"]
+    form_ajax_refs = prefix_lookups(product=Product, to_location=Location)
 
     def on_model_change(self, form, model, is_created):
-        conn = engine.connect()
-        trans = conn.begin()
-        query_needed_qty_of_raw_materials = db.text(
-            "select raw_material_id,raw_material_quantity from product_raw_material where product_id= :product_id"
-        )
-        batch_size = form.data["batch_size"]
-        query_for_actual_raw_materials = db.text(
-            "select raw_material_id,available_stock from raw_material_stock where location_id=:location_id AND raw_material_id = ANY(:raw_material_ids)"
-        )
-        res = conn.execute(
-            query_needed_qty_of_raw_materials, product_id=form.product.data.id
-        )
-        rows_needed_material_qty = res.fetchall()
-        if len(rows_needed_material_qty) == 0:
-            trans.rollback()
-            conn.close()
-            raise validators.ValidationError(
-                "A product with no raw material cannot be manufactured."
-            )
-        res = conn.execute(
-            query_for_actual_raw_materials,
+        db.session.flush()
+        manufacture(
+            db.session.connection(),
+            product_id=form.product.data.id,
             location_id=form.to_location.data.id,
-            raw_material_ids=[x[0] for x in rows_needed_material_qty],
+            location_name=form.to_location.data.name,
+            batch_size=form.data["batch_size"],
+            manufacturing_id=model.id,
         )
-        rows_actual_material_qty = res.fetchall()
-        if len(rows_actual_material_qty) == 0:
-            conn.close()
-            raise validators.ValidationError("No Raw Material present in the location.")
-        product_diff_map = {}
-        for i in rows_actual_material_qty:
-            product_diff_map[i[0]] = i[1]
-        for i in rows_needed_material_qty:
-            if i[0] not in product_diff_map.keys():
-                conn.close()
-                raise validators.ValidationError(
-                    f"All Raw Materials not present at location: {form.to_location.data.name}, Missing: i[0]"
-                )
-            product_diff_map[i[0]] -= i[1] * batch_size
-            select_st = db.text(
-                "SELECT * FROM raw_material_stock WHERE location_id = :l AND raw_material_id = :p"
-            )
-            res = conn.execute(select_st, p=i[0], l=form.to_location.data.id)
-            row_from = res.fetchone()
-            if row_from:
-                if row_from.available_stock < i[1] * batch_size:
-                    conn.close()
-                    raise validators.ValidationError(
-                        f"Stock of Raw Material:{i[0]} Available is:{row_from.available_stock} Needed:{i[1] * batch_size}"
-                    )
-                update_query_for_raw_material = db.text(
-                    "UPDATE raw_material_stock SET available_stock = raw_material_stock.available_stock - :qty WHERE id = :row_id"
-                )
-                conn.execute(
-                    update_query_for_raw_material,
-                    qty=i[1] * batch_size,
-                    row_id=row_from.id,
-                )
-            else:
-                conn.close()
+
+
+class ModelViewTransferOrder(TransactionalMixin, ModelView):
+    can_delete = False
+    can_edit = False
+    can_view_details = True
+    column_default_sort = ("id", True)
+    column_exclude_list = ["time_created", "time_updated"]
+    column_details_list = [
+        "id",
+        "from_location",
+        "to_location",
+        "description",
+        "lines",
+        "posted_at",
+    ]
+    form_excluded_columns = ["posted_at", "time_created", "time_updated"]
+    form_ajax_refs = prefix_lookups(from_location=Location, to_location=Location)
+    inline_models = [
+        (
+            TransferOrderLine,
+            dict(
+                form_columns=["id", "product", "raw_material", "qty"],
+                form_ajax_refs=prefix_lookups(
+                    product=Product, raw_material=RawMaterial
+                ),
+            ),
+        )
+    ]
+
+    def on_model_change(self, form, model, is_created):
+        if not model.lines:
+            raise validators.ValidationError("A transfer order needs at least one line")
+        for line in model.lines:
+            if (line.product is None) == (line.raw_material is None):
                 raise validators.ValidationError(
-                    f"Zero Stock of Raw Material:{i[0]} Available, Needed:{i[1] * batch_size}"
+                    "Each line moves either a product or a raw material"
                 )
+        db.session.flush()
+        post_transfer_order(db.session.connection(), model.id)
 
-        query_for_qty_of_one_batch = db.text(
-            "select quantity from product where id=:product_id"
-        )
-        res = conn.execute(query_for_qty_of_one_batch, product_id=form.product.data.id)
-        qty_in_one_batch = res.fetchone()
-        qty_in_one_batch = qty_in_one_batch[0] if qty_in_one_batch else 0
-        manufactured_stock = batch_size * qty_in_one_batch
-        select_st = db.text(
-            "SELECT * FROM product_stock WHERE location_id = :l AND product_id = :p"
-        )
-        res = conn.execute(
-            select_st, p=form.product.data.id, l=form.to_location.data.id
-        )
-        row_to = res.fetchone()
-        if row_to:
-            q = db.text(
-                "UPDATE product_stock SET available_stock = product_stock.available_stock + :qty WHERE id = :id"
-            )
-            conn.execute(q, qty=manufactured_stock, id=row_to.id)
-        else:
-            q = db.text(
-                "INSERT INTO product_stock (location_id, product_id, available_stock) VALUES (:l,:p,:qty)"
-            )
-            conn.execute(
-                q,
-                qty=manufactured_stock,
-                l=form.to_location.data.id,
-                p=form.product.data.id,
-            )
-        trans.commit()
-        conn.close()
-
-
-class ModelViewProductMovement(ModelView):
+
+class ModelViewProductMovement(
+    TransactionalMixin,
+    CountStrategyMixin,
+    KeysetPaginationMixin,
+    StreamingExportMixin,
+    ModelView,
+):
     can_delete = False
     can_edit = False
     can_view_details = True
@@ -120,146 +132,48 @@ class ModelViewProductMovement(ModelView):
     export_types = ["csv"]
     page_size = 20
     can_set_page_size = True
+    column_default_sort = ("movement_date", True)
     column_exclude_list = ["time_created", "time_updated"]
     form_excluded_columns = ["time_created", "time_updated"]
+    form_ajax_refs = prefix_lookups(
+        product=Product, from_location=Location, to_location=Location
+    )
 
     def on_model_change(self, form, model, is_created):
         if is_created:
-            conn = engine.connect()
-            trans = conn.begin()
             if not form.from_location.data and not form.to_location.data:
-                conn.close()
                 raise validators.ValidationError(
                     'Both "From Location" and "To Location" cannot be empty'
                 )
-            if form.to_location.data:
-                select_st = db.text(
-                    "SELECT * FROM product_stock WHERE location_id = :l AND product_id = :p"
-                )
-                res = conn.execute(
-                    select_st, p=form.product.data.id, l=form.to_location.data.id
-                )
-                row_to = res.fetchone()
-                if row_to:
-                    q = db.text(
-                        "UPDATE product_stock SET available_stock = product_stock.available_stock + (1*:qty) WHERE id = :id"
-                    )
-                    conn.execute(q, qty=form.qty.data, id=row_to.id)
-                else:
-                    q = db.text(
-                        "INSERT INTO product_stock (location_id, product_id, available_stock) VALUES (:l,:p,:qty)"
-                    )
-                    conn.execute(
-                        q,
-                        qty=form.qty.data,
-                        l=form.to_location.data.id,
-                        p=form.product.data.id,
-                    )
-            if form.from_location.data:
-                select_st = db.text(
-                    "SELECT * FROM product_stock WHERE location_id = :l AND product_id = :p"
-                )
-                res = conn.execute(
-                    select_st, p=form.product.data.id, l=form.from_location.data.id
-                )
-                row_from = res.fetchone()
-                if row_from:
-                    if row_from.available_stock < form.qty.data:
-                        raise validators.ValidationError(
-                            'Stock of "'
-                            + form.product.data.name
-                            + '" available at "'
-                            + form.from_location.data.name
-                            + '" is '
-                            + str(row_from.available_stock)
-                        )
-                    q = db.text(
-                        "UPDATE product_stock SET available_stock = product_stock.available_stock + (1*:qty) WHERE id = :id"
-                    )
-                    conn.execute(q, qty=-form.qty.data, id=row_from.id)
-                else:
-                    raise validators.ValidationError(
-                        'Zero Stock of "'
-                        + form.product.data.name
-                        + '" available at "'
-                        + form.from_location.data.name
-                        + '"'
-                    )
-            trans.commit()
-            conn.close()
+            if model.movement_date is None:
+                # an empty date field would otherwise insert NULL over the
+                # server default; movement_date is also the partition key
+                model.movement_date = db.func.current_date()
+            qty = model.qty
         else:
-            conn = engine.connect()
-            trans = conn.begin()
-            select_st = db.select([RawMaterialMovement]).where(
-                RawMaterialMovement.id == model.list_form_pk
-            )
-            res = conn.execute(select_st)
-            row = res.fetchone()
-            q = db.text(
-                "UPDATE product_stock SET available_stock = product_stock.available_stock + (1*:qty) WHERE location_id = :l AND product_id = :p"
-            )
-            if row.from_location_id:
-                select_st = db.text(
-                    "SELECT * FROM product_stock WHERE location_id = :l AND product_id = :p"
-                )
-                res = conn.execute(select_st, p=row.product_id, l=row.from_location_id)
-                row_from = res.fetchone()
-                if row_from:
-                    if (
-                        row_from.available_stock + (int(row.qty) - int(form.qty.data))
-                        < 0
-                    ):
-                        raise validators.ValidationError(
-                            'Insufficient stock at "from_location". Stock available is: '
-                            + str(row_from.available_stock)
-                        )
-                    conn.execute(
-                        q,
-                        qty=(int(row.qty) - int(form.qty.data)),
-                        l=row.from_location_id,
-                        p=row.product_id,
-                    )
-                else:
-                    raise validators.ValidationError(
-                        'Insufficient stock at "from_location". Stock available is: 0'
-                    )
-            if row.to_location_id:
-                select_st = db.text(
-                    "SELECT * FROM product_stock WHERE location_id = :l AND product_id = :p"
-                )
-                res = conn.execute(select_st, p=row.product_id, l=row.to_location_id)
-                row_to = res.fetchone()
-                if row_to:
-                    if (row_to.available_stock + int(form.qty.data) - int(row.qty)) < 0:
-                        raise validators.ValidationError(
-                            'Insufficient stock at "to_location". Stock available is: '
-                            + str(row_to.available_stock)
-                        )
-                    conn.execute(
-                        q,
-                        qty=(int(form.qty.data) - int(row.qty)),
-                        l=row.to_location_id,
-                        p=row.product_id,
-                    )
-                else:
-                    if int(form.qty.data) - int(row.qty) < 0:
-                        raise validators.ValidationError(
-                            'Insufficient stock at "to_location". Stock available is: 0'
-                        )
-                    q = db.text(
-                        "INSERT INTO product_stock (location_id, product_id, available_stock) VALUES (:l,:p,:qty)"
-                    )
-                    conn.execute(
-                        q,
-                        qty=(int(form.qty.data) - int(row.qty)),
-                        l=row.to_location_id,
-                        p=row.product_id,
-                    )
-            trans.commit()
-            conn.close()
-
-
-class ModelViewRawMaterial(ModelView):
+            # only the quantity is editable, so move the difference
+            history = db.inspect(model).attrs.qty.history
+            qty = model.qty - (history.deleted[0] if history.deleted else model.qty)
+        db.session.flush()
+        move_stock_or_raise(
+            db.session.connection(),
+            "product",
+            model,
+            model.product,
+            model.from_location,
+            model.to_location,
+            qty,
+            is_created,
+        )
+        if is_created:
+            # counters after the stock rows, in the order transfer orders
+            # lock them, so the two cannot deadlock
+            bump_row_count(db.session.connection(), model.__tablename__)
+
+
+class ModelViewRawMaterial(
+    CountStrategyMixin, SearchMixin, LookupCacheMixin, ModelView
+):
     can_delete = False
     can_view_details = True
     can_export = True
@@ -280,7 +194,9 @@ class ModelViewRawMaterial(ModelView):
     form_widget_args = {"description": {"rows": 10, "style": "color: black"}}
 
 
-class ModelViewProductRawMaterial(ModelView):
+class ModelViewProductRawMaterial(
+    TransactionalMixin, CountStrategyMixin, SearchMixin, ModelView
+):
     can_delete = False
     can_view_details = True
     can_export = True
@@ -293,53 +209,25 @@ class ModelViewProductRawMaterial(ModelView):
         "name",
     ]
     form_excluded_columns = ["time_created", "time_updated"]
+    form_ajax_refs = prefix_lookups(product=Product, raw_material=RawMaterial)
     form_args = {
         "name": {"label": "Mapping Name"},
     }
 
     def on_model_change(self, form, model, is_created):
-        if is_created:
-            conn = engine.connect()
-            trans = conn.begin()
-            if form.product:
-                q = db.text(
-                    "select sum(raw_material_quantity) as total from product_raw_material where product_id = :r"
-                )
-                res = conn.execute(q, r=form.product.data.id)
-                row_to = res.fetchone()[0] or 0
-                quantity = row_to + form.raw_material_quantity.data
-                q = db.text("UPDATE product SET quantity = :quantity WHERE id = :id")
-                conn.execute(q, quantity=quantity, id=form.product.data.id)
-            trans.commit()
-            conn.close()
-        else:
-            conn = engine.connect()
-            trans = conn.begin()
-            if form.product:
-                q = db.text(
-                    "select sum(raw_material_quantity) as total from product_raw_material where product_id = :r"
-                )
-                res = conn.execute(q, r=form.product.data.id)
-                row_to = res.fetchone()[0] or 0
-                if row_to:
-                    q = db.text(
-                        "select sum(raw_material_quantity) as total from product_raw_material where product_id = :rid and raw_material_id = :pid"
-                    )
-                    res = conn.execute(
-                        q, pid=form.raw_material.data.id, rid=form.product.data.id
-                    )
-                    old_quantity = res.fetchone()[0]
-                    assert old_quantity is not None
-                    quantity = row_to + form.raw_material_quantity.data - old_quantity
-                    q = db.text(
-                        "UPDATE product SET quantity = :quantity WHERE id = :id"
-                    )
-                    conn.execute(q, quantity=quantity, id=form.product.data.id)
-            trans.commit()
-            conn.close()
-
-
-class ModelViewLocation(ModelView):
+        attrs = db.inspect(model).attrs
+        if not is_created and not any(
+            attrs[name].history.has_changes()
+            for name in ("product", "raw_material", "raw_material_quantity")
+        ):
+            return
+        # a line moved to another product changes both bills of materials
+        product_ids = [p.id for p in attrs.product.history.deleted or () if p]
+        db.session.flush()
+        refresh_bom(db.session.connection(), product_ids + [model.product_id])
+
+
+class ModelViewLocation(CountStrategyMixin, SearchMixin, LookupCacheMixin, ModelView):
     can_delete = False
     can_view_details = True
     can_export = True
@@ -360,22 +248,28 @@ class ModelViewLocation(ModelView):
     form_widget_args = {"other_details": {"rows": 10, "style": "color: black"}}
 
 
-class ModelViewProduct(ModelView):
+class ModelViewProduct(CountStrategyMixin, SearchMixin, LookupCacheMixin, ModelView):
     can_delete = False
     can_view_details = True
     can_export = True
     export_types = ["csv", "xls"]
     column_filters = ["id", "name", "time_created", "time_updated"]
     page_size = 20
-    column_exclude_list = ["time_created", "time_updated"]
+    column_exclude_list = ["time_created", "time_updated", "bom_version"]
     column_searchable_list = ["name"]
     column_editable_list = [
         "name",
     ]
-    form_excluded_columns = ["time_created", "time_updated"]
+    form_excluded_columns = ["time_created", "time_updated", "bom_version"]
 
 
-class ModelViewRawMaterialMovement(ModelView):
+class ModelViewRawMaterialMovement(
+    TransactionalMixin,
+    CountStrategyMixin,
+    KeysetPaginationMixin,
+    StreamingExportMixin,
+    ModelView,
+):
     can_delete = False
     can_edit = False
     can_view_details = True
@@ -383,173 +277,111 @@ class ModelViewRawMaterialMovement(ModelView):
     export_types = ["csv"]
     page_size = 20
     can_set_page_size = True
+    column_default_sort = ("movement_date", True)
     column_exclude_list = ["time_created", "time_updated"]
     column_editable_list = ["qty"]
     form_excluded_columns = ["time_created", "time_updated"]
+    form_ajax_refs = prefix_lookups(
+        raw_material=RawMaterial, from_location=Location, to_location=Location
+    )
 
     def on_model_change(self, form, model, is_created):
         if is_created:
-            conn = engine.connect()
-            trans = conn.begin()
             if not form.from_location.data and not form.to_location.data:
-                conn.close()
                 raise validators.ValidationError(
                     'Both "From Location" and "To Location" cannot be empty'
                 )
-            if form.to_location.data:
-                select_st = db.text(
-                    "SELECT * FROM raw_material_stock WHERE location_id = :l AND raw_material_id = :p"
-                )
-                res = conn.execute(
-                    select_st, p=form.raw_material.data.id, l=form.to_location.data.id
-                )
-                row_to = res.fetchone()
-                if row_to:
-                    q = db.text(
-                        "UPDATE raw_material_stock SET available_stock = raw_material_stock.available_stock + (1*:qty) WHERE id = :id"
-                    )
-                    conn.execute(q, qty=form.qty.data, id=row_to.id)
-                else:
-                    q = db.text(
-                        "INSERT INTO raw_material_stock (location_id, raw_material_id, available_stock) VALUES (:l,:p,:qty)"
-                    )
-                    conn.execute(
-                        q,
-                        qty=form.qty.data,
-                        l=form.to_location.data.id,
-                        p=form.raw_material.data.id,
-                    )
-            if form.from_location.data:
-                select_st = db.text(
-                    "SELECT * FROM raw_material_stock WHERE location_id = :l AND raw_material_id = :p"
-                )
-                res = conn.execute(
-                    select_st, p=form.raw_material.data.id, l=form.from_location.data.id
-                )
-                row_from = res.fetchone()
-                if row_from:
-                    if row_from.available_stock < form.qty.data:
-                        raise validators.ValidationError(
-                            'Stock of "'
-                            + form.raw_material.data.name
-                            + '" available at "'
-                            + form.from_location.data.name
-                            + '" is '
-                            + str(row_from.available_stock)
-                        )
-                    q = db.text(
-                        "UPDATE raw_material_stock SET available_stock = raw_material_stock.available_stock + (1*:qty) WHERE id = :id"
-                    )
-                    conn.execute(q, qty=-form.qty.data, id=row_from.id)
-                else:
-                    raise validators.ValidationError(
-                        'Zero Stock of "'
-                        + form.raw_material.data.name
-                        + '" available at "'
-                        + form.from_location.data.name
-                        + '"'
-                    )
-            trans.commit()
-            conn.close()
+            if model.movement_date is None:
+                # an empty date field would otherwise insert NULL over the
+                # server default; movement_date is also the partition key
+                model.movement_date = db.func.current_date()
+            qty = model.qty
         else:
-            conn = engine.connect()
-            trans = conn.begin()
-            select_st = db.select([RawMaterialMovement]).where(
-                RawMaterialMovement.id == model.list_form_pk
-            )
-            res = conn.execute(select_st)
-            row = res.fetchone()
-            q = db.text(
-                "UPDATE raw_material_stock SET available_stock = raw_material_stock.available_stock + (1*:qty) WHERE location_id = :l AND raw_material_id = :p"
-            )
-            if row.from_location_id:
-                select_st = db.text(
-                    "SELECT * FROM raw_material_stock WHERE location_id = :l AND raw_material_id = :p"
-                )
-                res = conn.execute(
-                    select_st, p=row.raw_material_id, l=row.from_location_id
-                )
-                row_from = res.fetchone()
-                if row_from:
-                    if (
-                        row_from.available_stock + (int(row.qty) - int(form.qty.data))
-                        < 0
-                    ):
-                        raise validators.ValidationError(
-                            'Insufficient stock at "from_location". Stock available is: '
-                            + str(row_from.available_stock)
-                        )
-                    conn.execute(
-                        q,
-                        qty=(int(row.qty) - int(form.qty.data)),
-                        l=row.from_location_id,
-                        p=row.raw_material_id,
-                    )
-                else:
-                    raise validators.ValidationError(
-                        'Insufficient stock at "from_location". Stock available is: 0'
-                    )
-            if row.to_location_id:
-                select_st = db.text(
-                    "SELECT * FROM raw_material_stock WHERE location_id = :l AND raw_material_id = :p"
-                )
-                res = conn.execute(
-                    select_st, p=row.raw_material_id, l=row.to_location_id
-                )
-                row_to = res.fetchone()
-                if row_to:
-                    if (row_to.available_stock + int(form.qty.data) - int(row.qty)) < 0:
-                        raise validators.ValidationError(
-                            'Insufficient stock at "to_location". Stock available is: '
-                            + str(row_to.available_stock)
-                        )
-                    conn.execute(
-                        q,
-                        qty=(int(form.qty.data) - int(row.qty)),
-                        l=row.to_location_id,
-                        p=row.raw_material_id,
-                    )
-                else:
-                    if int(form.qty.data) - int(row.qty) < 0:
-                        raise validators.ValidationError(
-                            'Insufficient stock at "to_location". Stock available is: 0'
-                        )
-                    q = db.text(
-                        "INSERT INTO raw_material_stock (location_id, raw_material_id, available_stock) VALUES (:l,:p,:qty)"
-                    )
-                    conn.execute(
-                        q,
-                        qty=(int(form.qty.data) - int(row.qty)),
-                        l=row.to_location_id,
-                        p=row.raw_material_id,
-                    )
-            trans.commit()
-            conn.close()
-
-
-class ModelViewProductStock(ModelView):
+            # only the quantity is editable, so move the difference
+            history = db.inspect(model).attrs.qty.history
+            qty = model.qty - (history.deleted[0] if history.deleted else model.qty)
+        db.session.flush()
+        move_stock_or_raise(
+            db.session.connection(),
+            "raw_material",
+            model,
+            model.raw_material,
+            model.from_location,
+            model.to_location,
+            qty,
+            is_created,
+        )
+        if is_created:
+            # counters after the stock rows, in the order transfer orders
+            # lock them, so the two cannot deadlock
+            bump_row_count(db.session.connection(), model.__tablename__)
+
+
+class ModelViewProductStock(
+    CountStrategyMixin, KeysetPaginationMixin, StreamingExportMixin, ModelView
+):
     can_delete = False
     can_edit = False
     can_create = False
-    column_exclude_list = ["time_created", "time_updated"]
+    column_exclude_list = ["time_created", "time_updated", "shards", "total_stock"]
+    column_export_exclude_list = ["shards", "total_stock"]
+    column_formatters = {"available_stock": total_stock_formatter}
+    column_formatters_export = column_formatters
     column_sortable_list = ("available_stock",)
     column_default_sort = "product_id"
     page_size = 35
     can_export = True
     export_types = ["csv", "xlsx"]
 
+    def get_sortable_columns(self):
+        columns = super(ModelViewProductStock, self).get_sortable_columns()
+        # sort on the total the column shows, shards included
+        columns["available_stock"] = self.model.total_stock
+        return columns
+
 
-class ModelViewRawMaterialStock(ModelView):
+class ModelViewRawMaterialStock(
+    CountStrategyMixin, KeysetPaginationMixin, StreamingExportMixin, ModelView
+):
     can_delete = False
     can_edit = False
     can_create = False
-    column_exclude_list = ["time_created", "time_updated"]
+    column_exclude_list = ["time_created", "time_updated", "shards", "total_stock"]
+    column_export_exclude_list = ["shards", "total_stock"]
+    column_formatters = {"available_stock": total_stock_formatter}
+    column_formatters_export = column_formatters
     column_sortable_list = ("available_stock",)
     column_default_sort = "raw_material_id"
     page_size = 35
     can_export = True
     export_types = ["csv", "xlsx"]
 
+    def get_sortable_columns(self):
+        columns = super(ModelViewRawMaterialStock, self).get_sortable_columns()
+        # sort on the total the column shows, shards included
+        columns["available_stock"] = self.model.total_stock
+        return columns
+
+
+class ModelViewMovementQueue(ModelView):
+    can_delete = False
+    can_edit = False
+    can_create = False
+    can_view_details = True
+    column_default_sort = ("id", True)
+    column_filters = ["status", "kind", "source", "time_created"]
+    page_size = 35
+
+
+class ModelViewStockLedger(StreamingExportMixin, ModelView):
+    can_delete = False
+    can_edit = False
+    can_create = False
+    column_default_sort = ("id", True)
+    page_size = 35
+    can_export = True
+    export_types = ["csv"]
+
 
 def register(app):
     admin = Admin(
@@ -558,6 +390,7 @@ def register(app):
         template_mode="bootstrap3",
         url="/",
         base_template="admin/custombase.html",
+        index_view=DashboardView(url="/"),
     )
     admin.add_view(
         ModelViewRawMaterialMovement(
@@ -572,6 +405,16 @@ def register(app):
             ProductMovement, db.session, name="Product Movement", category="Movement",
         )
     )
+    admin.add_view(
+        MovementReportView(
+            name="Movement Report", endpoint="movementreport", category="Movement"
+        )
+    )
+    admin.add_view(
+        ModelViewTransferOrder(
+            TransferOrder, db.session, name="Transfer Order", category="Movement"
+        )
+    )
     admin.add_view(
         ModelViewRawMaterialStock(
             RawMaterialStock, db.session, name="Raw Material Stock", category="Stock"
@@ -582,6 +425,27 @@ def register(app):
             ProductStock, db.session, name="Product Stock", category="Stock"
         )
     )
+    admin.add_view(
+        ModelViewStockLedger(
+            RawMaterialStockLedger,
+            db.session,
+            name="Raw Material Stock Ledger",
+            category="Stock",
+        )
+    )
+    admin.add_view(
+        ModelViewStockLedger(
+            ProductStockLedger,
+            db.session,
+            name="Product Stock Ledger",
+            category="Stock",
+        )
+    )
+    admin.add_view(
+        ModelViewMovementQueue(
+            MovementQueue, db.session, name="Movement Queue", category="Stock"
+        )
+    )
     admin.add_view(
         ModelViewProductManufacturing(
             ProductManufacturing, db.session, name="Product Manufacturing"
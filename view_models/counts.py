@@ -0,0 +1,101 @@
+from flask import g, request
+from sqlalchemy import literal_column
+
+from inventory.counts import (
+    cached_row_count,
+    counted_query_rows,
+    estimated_query_rows,
+    estimated_row_count,
+)
+
+# a filtered list the planner expects this many times `limit` rows of is
+# not counted
+ESTIMATE_MARGIN = 10
+
+
+def bounded_count(session, query, limit):
+    """Return (count, is_estimate) for the rows of `query`: the exact count
+    if at most `limit`, the planner's estimate otherwise.
+
+    Rows are only counted when the estimate is within ESTIMATE_MARGIN times
+    `limit`, and then through the plan for all of them, so the count costs
+    about as much as the matching rows' index entries. Results are kept
+    for the request, so the mixins of a view share one count.
+    """
+    statement = query.with_entities(literal_column("1")).order_by(None).statement
+    compiled = statement.compile(dialect=session.get_bind().dialect)
+    key = (str(compiled), repr(sorted(compiled.params.items())), limit)
+    counts = g.setdefault("_bounded_counts", {})
+    if key not in counts:
+        conn = session.connection()
+        estimate = estimated_query_rows(conn, statement)
+        count = None
+        if estimate <= limit * ESTIMATE_MARGIN:
+            count = counted_query_rows(conn, statement, limit)
+        if count is not None and count <= limit:
+            counts[key] = count, False
+        else:
+            counts[key] = max(estimate, limit + 1), True
+    return counts[key]
+
+
+class CountStrategyMixin(object):
+    """Avoid a full `SELECT count(*)` on every render of a large list.
+
+    Without search or filters the count comes from the row_count cache when
+    the table is in it, or from the planner's statistics otherwise. With
+    search or filters the matching rows are counted exactly up to
+    `exact_count_limit`; past it the planner's estimate for the filtered
+    query is shown instead. Estimates are marked approximate in the pager.
+    """
+
+    simple_list_pager = True
+    exact_count_limit = 1000
+
+    def _filtered_query(self, search, filters):
+        query, joins = self.get_query(), {}
+        if self._search_supported and search:
+            query, _, joins, _ = self._apply_search(query, None, joins, {}, search)
+        if filters and self._filters:
+            query, _, joins, _ = self._apply_filters(query, None, joins, {}, filters)
+        return query.with_entities(literal_column("1")).order_by(None)
+
+    def get_cheap_count(self, search, filters):
+        """Return (count, is_estimate) for the list with this search and
+        filters; count is None if nothing cheap is known."""
+        if self.session.get_bind().dialect.name != "postgresql":
+            # no planner statistics to go by, as in SQLite test databases
+            return self._filtered_query(search, filters).count(), False
+        conn = self.session.connection()
+        table = self.model.__tablename__
+        if not search and not filters:
+            count = cached_row_count(conn, table)
+            if count is not None:
+                return count, False
+            return estimated_row_count(conn, table), True
+        return bounded_count(
+            self.session, self._filtered_query(search, filters), self.exact_count_limit
+        )
+
+    def get_list(
+        self,
+        page,
+        sort_column,
+        sort_desc,
+        search,
+        filters,
+        execute=True,
+        page_size=None,
+    ):
+        count, data = super(CountStrategyMixin, self).get_list(
+            page, sort_column, sort_desc, search, filters, execute, page_size
+        )
+        if count is None and request.endpoint == f"{self.endpoint}.index_view":
+            count, g._count_is_estimate = self.get_cheap_count(search, filters)
+        return count, data
+
+    def render(self, template, **kwargs):
+        if getattr(g, "_count_is_estimate", False) and kwargs.get("count"):
+            # the pages are already worked out, so the count is only shown
+            kwargs["count"] = "~{}".format(kwargs["count"])
+        return super(CountStrategyMixin, self).render(template, **kwargs)
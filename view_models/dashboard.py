@@ -0,0 +1,15 @@
+from app_init import db
+from flask_admin import AdminIndexView, expose
+from inventory.dashboard import dashboard
+
+
+class DashboardView(AdminIndexView):
+    """The admin index page: stock totals, top movers, zero stock and
+    manufacturing output, read from the dashboard views that `flask
+    refresh-dashboard` keeps up to date."""
+
+    @expose("/")
+    def index(self):
+        with db.engine.connect() as conn:
+            data = dashboard(conn)
+        return self.render(self._template, **data)
@@ -0,0 +1,172 @@
+import base64
+import datetime
+import json
+
+from flask import g, request
+from sqlalchemy import and_, or_, tuple_
+
+
+def _encode_cursor(state, row):
+    value = getattr(row, state["column"].key)
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        value = value.isoformat()
+    payload = [state["name"], state["desc"], value, getattr(row, state["pk"].key)]
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+def _decode_cursor(cursor, column):
+    """Return the (sort name, descending, value, id) held by a cursor, or None
+    if it cannot be read."""
+    try:
+        name, desc, value, pk = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        python_type = column.type.python_type
+        if value is not None and python_type is datetime.datetime:
+            value = datetime.datetime.fromisoformat(value)
+        elif value is not None and python_type is datetime.date:
+            value = datetime.date.fromisoformat(value)
+        return name, bool(desc), value, pk
+    except (ValueError, TypeError, NotImplementedError):
+        return None
+
+
+class KeysetPaginationMixin(object):
+    """Page a sqla ModelView list on (sort column, primary key) instead of
+    OFFSET, so that every page costs the same as the first.
+
+    The list links to the neighbouring pages with `after` / `before` cursors
+    holding the sort key of the last / first row shown. Sorts through a
+    relation fall back to the usual OFFSET pages.
+    """
+
+    list_template = "admin/model/keyset_list.html"
+    simple_list_pager = True
+
+    def _keyset_order(self, sort_column, sort_desc):
+        if sort_column is not None:
+            if sort_column not in self._sortable_columns:
+                return None
+            if self._sortable_joins.get(sort_column):
+                return None
+            name, column = sort_column, self._sortable_columns[sort_column]
+        else:
+            order = self._get_default_order()
+            if order is None:
+                name, column, sort_desc = None, None, True
+            else:
+                column, joins, sort_desc = order
+                if joins:
+                    return None
+                name = column.key
+        pk = getattr(self.model, self._primary_key)
+        if column is None or column.key == pk.key:
+            column = pk
+        if isinstance(column, tuple) or not hasattr(column, "key"):
+            return None
+        return {"name": name, "column": column, "pk": pk, "desc": bool(sort_desc)}
+
+    def _keyset_state(self, sort_column, sort_desc):
+        if not hasattr(g, "_keyset_state"):
+            state = None
+            if request.endpoint == f"{self.endpoint}.index_view":
+                state = self._keyset_order(sort_column, sort_desc)
+            if state is not None:
+                state["reverse"] = False
+                state["seek"] = None
+                for arg, reverse in (("after", False), ("before", True)):
+                    cursor = request.args.get(arg)
+                    decoded = cursor and _decode_cursor(cursor, state["column"])
+                    if decoded and decoded[:2] == (state["name"], state["desc"]):
+                        state["reverse"] = reverse
+                        state["seek"] = decoded[2:]
+                        break
+            g._keyset_state = state
+        return g._keyset_state
+
+    def _seek_condition(self, state):
+        column, pk = state["column"], state["pk"]
+        value, pk_value = state["seek"]
+        # rows that come after the cursor in the direction being read;
+        # Postgres sorts NULL above every value
+        descending = state["desc"] != state["reverse"]
+        if column is pk:
+            return pk < pk_value if descending else pk > pk_value
+        if value is None:
+            if descending:
+                return or_(and_(column.is_(None), pk < pk_value), column.isnot(None))
+            return and_(column.is_(None), pk > pk_value)
+        if descending:
+            return tuple_(column, pk) < tuple_(value, pk_value)
+        return or_(tuple_(column, pk) > tuple_(value, pk_value), column.is_(None))
+
+    def _apply_sorting(self, query, joins, sort_column, sort_desc):
+        state = self._keyset_state(sort_column, sort_desc)
+        if state is None:
+            return super(KeysetPaginationMixin, self)._apply_sorting(
+                query, joins, sort_column, sort_desc
+            )
+        if state["seek"] is not None:
+            query = query.filter(self._seek_condition(state))
+        descending = state["desc"] != state["reverse"]
+        columns = [state["column"]]
+        if state["column"] is not state["pk"]:
+            columns.append(state["pk"])
+        return (
+            query.order_by(*(c.desc() if descending else c.asc() for c in columns)),
+            joins,
+        )
+
+    def _apply_pagination(self, query, page, page_size):
+        if getattr(g, "_keyset_state", None) is None:
+            return super(KeysetPaginationMixin, self)._apply_pagination(
+                query, page, page_size
+            )
+        # one extra row tells whether there is a further page
+        return query.limit((page_size or self.page_size) + 1)
+
+    def get_list(
+        self,
+        page,
+        sort_column,
+        sort_desc,
+        search,
+        filters,
+        execute=True,
+        page_size=None,
+    ):
+        count, query = super(KeysetPaginationMixin, self).get_list(
+            page, sort_column, sort_desc, search, filters, False, page_size
+        )
+        state = getattr(g, "_keyset_state", None)
+        if state is None or not execute:
+            return count, query.all() if execute else query
+        rows = query.all()
+        page_size = page_size or self.page_size
+        more = len(rows) > page_size
+        rows = rows[:page_size]
+        if state["reverse"]:
+            rows.reverse()
+            state["has_prev"], state["has_next"] = more, True
+        else:
+            state["has_prev"], state["has_next"] = state["seek"] is not None, more
+        state["first"] = _encode_cursor(state, rows[0]) if rows else None
+        state["last"] = _encode_cursor(state, rows[-1]) if rows else None
+        return count, rows
+
+    def render(self, template, **kwargs):
+        state = getattr(g, "_keyset_state", None)
+        if template == self.list_template and state is not None:
+            view_args = self._get_list_extra_args()
+
+            def cursor_url(**extra_args):
+                return self._get_list_url(
+                    view_args.clone(page=None, extra_args=extra_args)
+                )
+
+            kwargs["keyset_first_url"] = cursor_url()
+            kwargs["keyset_prev_url"] = (
+                cursor_url(before=state["first"]) if state.get("has_prev") else None
+            )
+            kwargs["keyset_next_url"] = (
+                cursor_url(after=state["last"]) if state.get("has_next") else None
+            )
+        return super(KeysetPaginationMixin, self).render(template, **kwargs)
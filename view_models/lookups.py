@@ -0,0 +1,112 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from app_init import app, db
+from flask_admin.contrib.sqla.ajax import QueryAjaxModelLoader
+from flask_admin.model.ajax import DEFAULT_PAGE_SIZE
+
+# largest page a lookup may ask for; the admin's select2 asks for 10
+MAX_PAGE_SIZE = 50
+
+
+class Reference(namedtuple("Reference", "id name")):
+    """The id and name of a row, which is all a lookup page shows."""
+
+    __slots__ = ()
+
+    def __str__(self):
+        return self.name
+
+
+class LookupCache(object):
+    """Per-process LRU cache of lookup pages, each served for `ttl` seconds
+    at most."""
+
+    def __init__(self, ttl=30, maxsize=4096):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, page):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, page)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self, table):
+        """Drop the cached pages of a table."""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == table]:
+                del self._entries[key]
+
+
+lookup_cache = LookupCache(app.config["LOOKUP_CACHE_TTL"])
+
+
+def _like_prefix(term):
+    escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return escaped + "%"
+
+
+class PrefixAjaxModelLoader(QueryAjaxModelLoader):
+    """Ajax loader for the relation fields of the admin forms.
+
+    Offers the rows whose name starts with the typed text, ignoring case,
+    in name order, read through the (lower(name) COLLATE "C", id) index of
+    the model's table, so a page costs the same whatever the table size.
+    Pages are kept in lookup_cache.
+    """
+
+    def __init__(self, name, session, model, **options):
+        options.setdefault("fields", ["name"])
+        super(PrefixAjaxModelLoader, self).__init__(name, session, model, **options)
+
+    def get_list(self, term, offset=0, limit=DEFAULT_PAGE_SIZE):
+        table = self.model.__table__
+        offset = max(offset or 0, 0)
+        limit = min(max(limit or DEFAULT_PAGE_SIZE, 1), MAX_PAGE_SIZE)
+        key = (table.name, (term or "").lower(), offset, limit)
+        page = lookup_cache.get(key)
+        if page is None:
+            sort_key = db.func.lower(table.c.name).collate("C")
+            rows = self.session.execute(
+                db.select([table.c.id, table.c.name])
+                .where(
+                    sort_key.like(db.func.lower(_like_prefix(term or "")), escape="\\")
+                )
+                .order_by(sort_key, table.c.id)
+                .offset(offset)
+                .limit(limit)
+            )
+            page = [Reference(*row) for row in rows]
+            lookup_cache.put(key, page)
+        return page
+
+
+def prefix_lookups(**models):
+    """form_ajax_refs for relation fields named after their target models."""
+    return {
+        field: PrefixAjaxModelLoader(field, db.session, model)
+        for field, model in models.items()
+    }
+
+
+class LookupCacheMixin(object):
+    """Drops the cached lookup pages of the model's table once one of its
+    rows is saved, so this process offers the new name straight away;
+    other processes catch up within LOOKUP_CACHE_TTL seconds."""
+
+    def after_model_change(self, form, model, is_created):
+        super(LookupCacheMixin, self).after_model_change(form, model, is_created)
+        lookup_cache.clear(model.__tablename__)
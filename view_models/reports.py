@@ -0,0 +1,154 @@
+import csv
+import datetime
+import json
+
+from app_init import db
+from db_models import Location
+from flask import Response, abort, request, stream_with_context
+from flask_admin import BaseView, expose
+from inventory.rollups import PERIODS, ROLLUP_TABLES, movement_totals
+from view_models.lookups import PrefixAjaxModelLoader
+from werkzeug.utils import secure_filename
+
+# rows a report page shows; the CSV download has them all
+REPORT_PAGE_ROWS = 1000
+
+# days a report covers when no range is given
+DEFAULT_REPORT_DAYS = 30
+
+# ids are integer columns
+MAX_ID = 2 ** 31 - 1
+
+
+def _day(name, default):
+    try:
+        return datetime.datetime.strptime(request.args[name], "%Y-%m-%d").date()
+    except (KeyError, ValueError):
+        return default
+
+
+def _location_ids():
+    # the select2 lookup sends the chosen ids comma separated
+    ids = []
+    for value in request.args.getlist("location_id"):
+        for part in value.split(","):
+            try:
+                location_id = int(part)
+            except ValueError:
+                continue
+            if 0 < location_id <= MAX_ID:
+                ids.append(location_id)
+    return ids
+
+
+class Echo(object):
+    """Returns what a csv.writer writes, for it to be yielded."""
+
+    def write(self, value):
+        return value
+
+
+class MovementReportView(BaseView):
+    """Inflow and outflow of every item per location and day, week or month
+    over a date range, read from the daily movement rollups.
+
+    Locations are picked through a type-ahead lookup like those of the admin
+    forms, and the CSV is streamed from a server-side cursor, so neither
+    grows with the number of locations or rows."""
+
+    location_loader = PrefixAjaxModelLoader("location", db.session, Location)
+
+    @expose("/")
+    def index(self):
+        kind = request.args.get("kind")
+        if kind not in ROLLUP_TABLES:
+            kind = "product"
+        period = request.args.get("period")
+        if period not in PERIODS:
+            period = "day"
+        last_day = _day("end", datetime.date.today())
+        first_day = _day(
+            "start", last_day - datetime.timedelta(days=DEFAULT_REPORT_DAYS - 1)
+        )
+        location_ids = _location_ids()
+        if request.args.get("format") == "csv":
+            return self._csv(kind, period, first_day, last_day, location_ids)
+        with db.engine.connect() as conn:
+            rows = movement_totals(
+                conn,
+                kind,
+                period,
+                first_day,
+                last_day,
+                location_ids=location_ids,
+                limit=REPORT_PAGE_ROWS + 1,
+            ).fetchall()
+            # only the chosen locations, to show them in the lookup
+            locations = conn.execute(
+                db.text(
+                    "SELECT id, name FROM location "
+                    "WHERE id = ANY(CAST(:ids AS integer[])) ORDER BY name"
+                ),
+                ids=location_ids,
+            ).fetchall()
+        return self.render(
+            "admin/movement_report.html",
+            kind=kind,
+            kinds=sorted(ROLLUP_TABLES),
+            period=period,
+            periods=PERIODS,
+            first_day=first_day,
+            last_day=last_day,
+            location_ids=",".join(str(location.id) for location in locations),
+            locations_json=json.dumps([list(location) for location in locations]),
+            rows=rows[:REPORT_PAGE_ROWS],
+            truncated=len(rows) > REPORT_PAGE_ROWS,
+        )
+
+    @expose("/ajax/lookup/")
+    def ajax_lookup(self):
+        if request.args.get("name") != "location":
+            abort(404)
+        page = self.location_loader.get_list(
+            request.args.get("query"),
+            request.args.get("offset", type=int),
+            request.args.get("limit", 10, type=int),
+        )
+        return Response(
+            json.dumps([self.location_loader.format(row) for row in page]),
+            mimetype="application/json",
+        )
+
+    def _csv(self, kind, period, first_day, last_day, location_ids):
+        writer = csv.writer(Echo())
+
+        def generate():
+            yield writer.writerow(
+                [
+                    period,
+                    "location_id",
+                    "location",
+                    f"{kind}_id",
+                    kind,
+                    "inflow",
+                    "outflow",
+                    "net",
+                ]
+            )
+            # stream_results makes psycopg2 use a named (server-side) cursor
+            with db.engine.connect().execution_options(stream_results=True) as conn:
+                rows = movement_totals(
+                    conn, kind, period, first_day, last_day, location_ids=location_ids
+                )
+                for row in rows:
+                    yield writer.writerow(list(row) + [row.inflow - row.outflow])
+
+        filename = f"{kind}_movements_{period}_{first_day}_{last_day}.csv"
+        return Response(
+            stream_with_context(generate()),
+            mimetype="text/csv",
+            headers={
+                "Content-Disposition": "attachment; filename=%s"
+                % secure_filename(filename)
+            },
+        )
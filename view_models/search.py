@@ -0,0 +1,95 @@
+import re
+
+from flask import g
+from flask_admin.contrib.sqla.tools import parse_like_term
+from sqlalchemy import Text, false, func, literal_column, or_
+
+from view_models.counts import bounded_count
+
+# text search configuration of the tsvector columns: no stemming and no
+# stop words, so codes and part numbers match as typed
+TS_CONFIG = literal_column("'simple'")
+
+
+def _tsquery(term):
+    # whole words rather than prefixes: the planner estimates how many rows
+    # a word matches from the column statistics, but not a prefix, and a
+    # misestimate sends the bounded counts of the list down a full scan
+    if not re.search(r"\w", term):
+        return None
+    return func.plainto_tsquery(TS_CONFIG, term)
+
+
+def _tsvector(column):
+    # kept up to date by a trigger, see the search indexes migration
+    return literal_column(f"{column.table.name}.{column.name}_tsv")
+
+
+class SearchMixin(object):
+    """Search `column_searchable_list` through indexes instead of Flask-Admin's
+    `ILIKE '%term%'` on every column.
+
+    On PostgreSQL, String columns are matched by substring through their
+    pg_trgm GIN index, and TEXT columns by whole words through the GIN
+    index of their `<column>_tsv` column; both come from the search indexes
+    migration. Unless the list is sorted by a column, a search with at most
+    `rank_limit` matches (as the planner expects, and counted) lists the
+    best ones first: by trigram similarity of the String columns to the
+    search plus the text search rank of the TEXT columns. Broader searches
+    are listed in primary key order, which the database can page through
+    without scoring every match. Other databases, such as the SQLite ones
+    of tests, keep Flask-Admin's search.
+    """
+
+    rank_limit = 1000
+
+    def _indexed_search(self):
+        return self.session.get_bind().dialect.name == "postgresql" and not any(
+            path for _, path in self._search_fields
+        )
+
+    def _match(self, column, term):
+        if isinstance(column.type, Text):
+            tsquery = _tsquery(term)
+            if tsquery is None:
+                return None
+            return _tsvector(column).op("@@")(tsquery)
+        return column.ilike(parse_like_term(term))
+
+    def _rank(self, search):
+        rank, tsquery = [], _tsquery(search)
+        for column, _ in self._search_fields:
+            if not isinstance(column.type, Text):
+                rank.append(func.similarity(column, search))
+            elif tsquery is not None:
+                rank.append(func.ts_rank(_tsvector(column), tsquery))
+        return sum(rank[1:], rank[0]) if rank else None
+
+    def _apply_search(self, query, count_query, joins, count_joins, search):
+        if not self._indexed_search():
+            return super(SearchMixin, self)._apply_search(
+                query, count_query, joins, count_joins, search
+            )
+        for term in search.split(" "):
+            if not term:
+                continue
+            matches = [self._match(column, term) for column, _ in self._search_fields]
+            matches = [match for match in matches if match is not None]
+            condition = or_(*matches) if matches else false()
+            query = query.filter(condition)
+            if count_query is not None:
+                count_query = count_query.filter(condition)
+        g._search_rank = self._rank(search)
+        return query, count_query, joins, count_joins
+
+    def _apply_sorting(self, query, joins, sort_column, sort_desc):
+        rank = getattr(g, "_search_rank", None)
+        if sort_column is None and rank is not None:
+            _, is_estimate = bounded_count(self.session, query, self.rank_limit)
+            pk = getattr(self.model, self._primary_key)
+            if not is_estimate:
+                return query.order_by(rank.desc(), pk), joins
+            return query.order_by(pk), joins
+        return super(SearchMixin, self)._apply_sorting(
+            query, joins, sort_column, sort_desc
+        )
@@ -0,0 +1,59 @@
+import logging
+
+from flask import flash
+from flask_admin.babel import gettext
+from inventory.transactions import is_transient, retry_transient
+
+log = logging.getLogger(__name__)
+
+
+class TransactionalMixin(object):
+    """Run every create, update and delete of a sqla ModelView, with the
+    stock changes its on_model_change makes, as one transaction.
+
+    Whatever goes wrong, including a ValidationError raised by
+    on_model_change, the session is rolled back, which also returns its
+    connection to the pool. A transaction failing on a deadlock or
+    serialization conflict is run again from the form, as
+    inventory.transactions.retry_transient does, and only reported once it
+    has failed TRANSACTION_RETRIES times.
+    """
+
+    def handle_view_exception(self, exc):
+        if is_transient(exc):
+            # left to _transaction, which rolls back and runs it again
+            raise exc
+        return super(TransactionalMixin, self).handle_view_exception(exc)
+
+    def _transaction(self, action, *args, rollback=None):
+        result = False
+        try:
+            result = retry_transient(
+                lambda: action(*args), rollback=rollback or self.session.rollback
+            )
+        except Exception as ex:
+            flash(gettext("Failed to save record. %(error)s", error=str(ex)), "error")
+            log.exception("Failed to save record.")
+        finally:
+            if result is False:
+                # the model views commit what succeeded; nothing of a failed
+                # attempt may stay in the session or hold its connection
+                self.session.rollback()
+        return result
+
+    def create_model(self, form):
+        return self._transaction(super(TransactionalMixin, self).create_model, form)
+
+    def update_model(self, form, model):
+        def rollback():
+            self.session.rollback()
+            # the rollback expired the model; without the stored values the
+            # form's changes would have no history for on_model_change
+            self.session.refresh(model)
+
+        return self._transaction(
+            super(TransactionalMixin, self).update_model, form, model, rollback=rollback
+        )
+
+    def delete_model(self, model):
+        return self._transaction(super(TransactionalMixin, self).delete_model, model)